@@ -1,2 +1,11 @@
-from dimo.env_handling import WorkspaceManager, set_workspace, get_workspace
-__version__ = "0.1.0"
\ No newline at end of file
+__version__ = "0.1.0"
+
+_ENV_HANDLING = ("WorkspaceManager", "set_workspace", "get_workspace")
+
+
+def __getattr__(name):
+    # Loaded on first use, so importing dimo (e.g. for `dimo version`) stays cheap
+    if name in _ENV_HANDLING:
+        from dimo import env_handling
+        return getattr(env_handling, name)
+    raise AttributeError(f"module 'dimo' has no attribute '{name}'")
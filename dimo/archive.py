@@ -0,0 +1,109 @@
+"""Tar and zip packages as content sources for `update-mets` and `report`.
+
+Members are read in archive order in a single sequential pass, without
+extracting anything to disk. Tar files (also compressed) are read as a
+stream; zip members are read in the order they are stored.
+
+Member names are mapped to the same relative paths update_dias_mets uses for
+a content directory: if the archive contains a top-level ``content/``
+directory (a whole package), only the files below it are used and the prefix
+is dropped; otherwise every file in the archive is content.
+"""
+
+import os
+import tarfile
+import zipfile
+from datetime import datetime
+
+from dimo.hashing import DEFAULT_CHUNK_SIZE, hash_stream
+
+CONTENT_DIR = "content"
+IGNORED_NAMES = {".DS_Store"}
+IGNORED_TOP_DIRS = {"__MACOSX"}
+
+
+def is_archive(path):
+    """True if path is a tar (optionally compressed) or zip file"""
+    if not os.path.isfile(path):
+        return False
+    try:
+        return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+    except OSError:
+        return False
+
+
+def member_rel_path(name):
+    """
+    Map a member name to (in_content, relative path) or None for members
+    that are never content (macOS metadata, .DS_Store).
+    """
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or parts[-1] in IGNORED_NAMES or parts[0] in IGNORED_TOP_DIRS:
+        return None
+    if parts[0] == CONTENT_DIR and len(parts) > 1:
+        return True, os.path.normpath(os.path.join(*parts[1:]))
+    return False, os.path.normpath(os.path.join(*parts))
+
+
+def iter_archive(path, read=True):
+    """
+    Yield (name, size, mtime, stream) for every regular file in the archive,
+    in storage order. stream is a binary file object that is only valid
+    until the next item, or None when read=False (metadata only; tar files
+    are then opened seekable so file data is skipped rather than read).
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            infos = [info for info in zf.infolist() if not info.is_dir()]
+            infos.sort(key=lambda info: info.header_offset)
+            for info in infos:
+                mtime = datetime(*info.date_time).timestamp()
+                if not read:
+                    yield info.filename, info.file_size, mtime, None
+                    continue
+                with zf.open(info) as stream:
+                    yield info.filename, info.file_size, mtime, stream
+        return
+
+    with tarfile.open(path, "r|*" if read else "r:*") as tf:
+        while True:
+            member = tf.next()
+            if member is None:
+                break
+            if member.isfile():
+                stream = tf.extractfile(member) if read else None
+                yield member.name, member.size, member.mtime, stream
+            # TarFile keeps every member it has seen; drop them to keep memory flat
+            tf.members = []
+
+
+def hash_archive(path, algorithm="sha256", chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Hash every content file in the archive in one sequential pass.
+
+    Returns {relative path: (size, checksum)}, with checksum a tuple when
+    algorithm is a tuple (see hash_file). progress, if given, is called once
+    per hashed member.
+    """
+    content, other = {}, {}
+    for name, size, _, stream in iter_archive(path):
+        mapped = member_rel_path(name)
+        if mapped is None:
+            continue
+        in_content, rel_path = mapped
+        (content if in_content else other)[rel_path] = (size, hash_stream(stream, algorithm,
+                                                                          chunk_size))
+        if progress is not None:
+            progress()
+    return content or other
+
+
+def archive_records(path):
+    """
+    Yield (in_content, relative path, size, mtime) for every file in the
+    archive without reading file data.
+    """
+    for name, size, mtime, _ in iter_archive(path, read=False):
+        mapped = member_rel_path(name)
+        if mapped is not None:
+            yield mapped[0], mapped[1], size, mtime
@@ -0,0 +1,316 @@
+"""Batch processing of many workspaces over one shared worker pool.
+
+A workspace is a directory with a dias-mets.xml and/or an N5 extraction
+(arkivstruktur.xml, either in the directory itself or in its content/
+directory). Every workspace is split into independent tasks (update-mets,
+report, N5 tests) that run in one process pool, so a migration of hundreds
+of packages pays for one start-up instead of one per package.
+
+Scheduling is size-aware: tasks are started largest first, but at most half
+of the workers run large tasks at the same time, so one huge package does
+not hold up the small ones behind it. Sizes are estimated cheaply, without
+walking any content: from the SIZE attributes in dias-mets.xml and the size
+of the N5 XML files. Every task runs in isolation: an
+exception is recorded in the result and the batch continues, and if a
+worker process dies, only the task that brought it down is marked failed.
+"""
+
+import contextlib
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+TASK_KINDS = ("update-mets", "report", "n5")
+RESULT_VERSION = 1
+
+METS_FILENAME = "dias-mets.xml"
+CONTENT_DIR = "content"
+N5_FILENAMES = ("arkivstruktur.xml", "endringslogg.xml")
+
+LARGE_TASK_BYTES = 1024 ** 3
+DISCOVERY_DEPTH = 3
+
+# SIZE="..." attributes of <mets:file>, read without parsing the XML
+SIZE_ATTRIBUTE = re.compile(rb'\sSIZE="(\d+)"')
+SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class Task:
+    """One unit of work: a task kind run against one workspace"""
+    __slots__ = ('workspace', 'kind', 'size')
+
+    def __init__(self, workspace, kind, size):
+        self.workspace = workspace
+        self.kind = kind
+        self.size = size
+
+
+def n5_dir(workspace):
+    """Directory holding the N5 extraction of a workspace, or None"""
+    for candidate in (workspace, os.path.join(workspace, CONTENT_DIR)):
+        if os.path.isfile(os.path.join(candidate, N5_FILENAMES[0])):
+            return candidate
+    return None
+
+
+def workspace_tasks(workspace):
+    """Task kinds that apply to a workspace"""
+    has_content = os.path.isdir(os.path.join(workspace, CONTENT_DIR))
+    kinds = []
+    if has_content and os.path.isfile(os.path.join(workspace, METS_FILENAME)):
+        kinds.append("update-mets")
+    kinds.append("report")
+    if n5_dir(workspace):
+        kinds.append("n5")
+    return kinds
+
+
+def _is_workspace(path):
+    return os.path.isfile(os.path.join(path, METS_FILENAME)) or n5_dir(path) is not None
+
+
+def discover_workspaces(source, max_depth=DISCOVERY_DEPTH):
+    """
+    Workspaces named by source: either a text file with one directory per
+    line (blank lines and lines starting with # are skipped; relative paths
+    are relative to the file), or a directory that is searched up to
+    max_depth levels down. A workspace's own subdirectories are not searched.
+    """
+    if os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+        return [os.path.normpath(os.path.join(base, line)) for line in lines
+                if line and not line.startswith("#")]
+
+    workspaces = []
+    pending = [(os.path.abspath(source), 0)]
+    while pending:
+        path, depth = pending.pop()
+        if _is_workspace(path):
+            workspaces.append(path)
+            continue
+        if depth >= max_depth:
+            continue
+        try:
+            with os.scandir(path) as it:
+                subdirs = [entry.path for entry in it
+                           if entry.is_dir(follow_symlinks=False) and not entry.name.startswith(".")]
+        except OSError:
+            continue
+        pending.extend((subdir, depth + 1) for subdir in subdirs)
+    return sorted(workspaces)
+
+
+def declared_content_size(mets_file):
+    """
+    Total of the SIZE attributes in a METS file: the content size it
+    declares. One sequential read with a regular expression, no parsing and
+    no directory walk; 0 if there is no METS file.
+    """
+    if not os.path.isfile(mets_file):
+        return 0
+    total = 0
+    tail = b""
+    with open(mets_file, "rb") as f:
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = tail + chunk
+            # Keep an unfinished attribute at the end for the next chunk
+            cut = data.rfind(b"<")
+            cut = cut if cut > 0 else len(data)
+            total += sum(int(size) for size in SIZE_ATTRIBUTE.findall(data, 0, cut))
+            tail = data[cut:]
+    return total + sum(int(size) for size in SIZE_ATTRIBUTE.findall(tail))
+
+
+def plan_tasks(workspaces, kinds=TASK_KINDS):
+    """
+    Tasks for every workspace, each with an estimate of the bytes it will
+    read (the content size declared in dias-mets.xml for update-mets and
+    report, the XML size for the N5 tests), which the scheduler uses to keep
+    large tasks from blocking small ones. Content is never walked here; a
+    workspace without dias-mets.xml counts as small.
+    """
+    tasks = []
+    for workspace in workspaces:
+        applicable = [kind for kind in workspace_tasks(workspace) if kind in kinds]
+        content_size = None
+        for kind in applicable:
+            if kind == "n5":
+                directory = n5_dir(workspace)
+                size = sum(os.path.getsize(os.path.join(directory, name))
+                           for name in N5_FILENAMES
+                           if os.path.isfile(os.path.join(directory, name)))
+            else:
+                if content_size is None:
+                    content_size = declared_content_size(os.path.join(workspace, METS_FILENAME))
+                size = content_size
+            tasks.append(Task(workspace, kind, size))
+    return tasks
+
+
+def _run(kind, workspace, options):
+    if kind == "update-mets":
+        from dimo.update_mets import stop_logging, update_dias_mets
+        try:
+            return update_dias_mets(
+                os.path.join(workspace, METS_FILENAME), os.path.join(workspace, CONTENT_DIR),
+                dry_run=options.get('dry_run', False), streaming=options.get('streaming', False),
+                hash_workers=options.get('hash_workers'),
+                hash_mode=options.get('hash_mode', "thread"),
+            )
+        finally:
+            # Also after a failure: the log thread must not outlive the redirected output
+            stop_logging()
+    if kind == "report":
+        from dimo.report import generate_report
+        content = os.path.join(workspace, CONTENT_DIR)
+        return generate_report(path=content if os.path.isdir(content) else workspace, format=None)
+    if kind == "n5":
+        from dimo.env_handling import set_workspace
+        from dimo.tester.n5.test_n5 import run_n5_test
+        set_workspace(n5_dir(workspace))
+        return run_n5_test('all')
+    raise ValueError(f"Unknown task: {kind}")
+
+
+def run_task(kind, workspace, options):
+    """
+    Run one task in a pool worker. The worker changes to the workspace (so a
+    dias-mets.xsd there is found, as when running dimo inside it), and its
+    console output goes to logs/batch_<kind>.log in the workspace. Exceptions
+    are returned as a failed result instead of raised.
+    """
+    started = time.perf_counter()
+    logs_dir = os.path.join(workspace, "logs")
+    try:
+        os.makedirs(logs_dir, exist_ok=True)
+        os.chdir(workspace)
+        with open(os.path.join(logs_dir, f"batch_{kind}.log"), "w", encoding="utf-8") as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            result = _run(kind, workspace, options)
+        return {'status': 'ok', 'seconds': time.perf_counter() - started, 'result': result}
+    except Exception as e:
+        return {
+            'status': 'failed',
+            'seconds': time.perf_counter() - started,
+            'error': f"{type(e).__name__}: {e}",
+            'traceback': traceback.format_exc(),
+        }
+
+
+def _next_task(large, small, running_large, large_slots):
+    """Largest task first, but keep workers free for small tasks while there are any"""
+    if large and (running_large < large_slots or not small):
+        return large.pop(0)
+    if small:
+        return small.pop(0)
+    return None
+
+
+def run_batch(tasks, jobs=None, large_size=LARGE_TASK_BYTES, options=None, on_result=None):
+    """
+    Run tasks over one shared process pool with jobs workers (default: CPU
+    count, at most the number of tasks).
+
+    Tasks of at least large_size bytes run on at most half of the workers at
+    a time. If a worker process dies, the pool is replaced and the tasks that
+    were running are retried one at a time, so only the task that crashes on
+    its own is marked failed. options are passed to every task (dry_run,
+    streaming, hash_workers, hash_mode). on_result(task, result) is called as
+    tasks finish. Returns {workspace: {kind: result}}.
+    """
+    options = dict(options or {})
+    if not tasks:
+        return {}
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks)))
+    # Hashing threads per task, so the pool does not oversubscribe the CPUs
+    options.setdefault('hash_workers', max(1, (os.cpu_count() or 1) // jobs))
+
+    ordered = sorted(tasks, key=lambda task: task.size, reverse=True)
+    large = [task for task in ordered if task.size >= large_size]
+    small = [task for task in ordered if task.size < large_size]
+    large_slots = max(1, jobs // 2)
+
+    results = {}
+
+    def finish(task, result):
+        results.setdefault(task.workspace, {})[task.kind] = result
+        if on_result is not None:
+            on_result(task, result)
+
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    pending = {}
+    suspects = []      # were running when a worker died; retried alone
+    isolated = False   # a suspect is running on its own
+    try:
+        while large or small or suspects or pending:
+            if suspects:
+                if not pending:
+                    task = suspects.pop(0)
+                    pending[executor.submit(run_task, task.kind, task.workspace, options)] = task
+                    isolated = True
+            else:
+                isolated = False
+                while len(pending) < jobs:
+                    running_large = sum(1 for task in pending.values() if task.size >= large_size)
+                    task = _next_task(large, small, running_large, large_slots)
+                    if task is None:
+                        break
+                    pending[executor.submit(run_task, task.kind, task.workspace, options)] = task
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                task = pending.pop(future)
+                try:
+                    finish(task, future.result())
+                except BrokenProcessPool:
+                    broken.append(task)
+            if broken:
+                if isolated:
+                    finish(broken[0], {'status': 'failed', 'seconds': None,
+                                       'error': "worker process terminated abruptly"})
+                else:
+                    suspects.extend(broken + list(pending.values()))
+                pending.clear()
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=jobs)
+    finally:
+        executor.shutdown()
+    return results
+
+
+def batch_result(source, tasks, results, jobs, started):
+    """Consolidated result of a batch run as plain data"""
+    counts = {'ok': 0, 'failed': 0}
+    for workspace_results in results.values():
+        for result in workspace_results.values():
+            counts[result['status']] += 1
+    return {
+        'version': RESULT_VERSION,
+        'source': source,
+        'started': started,
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'jobs': jobs or os.cpu_count(),
+        'workspaces': len({task.workspace for task in tasks}),
+        'tasks': len(tasks),
+        'counts': counts,
+        'results': results,
+    }
+
+
+def save_result(result_path, result):
+    """Write the consolidated result atomically (temp file + rename)"""
+    tmp_path = f"{result_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, default=str)
+    os.replace(tmp_path, result_path)
@@ -0,0 +1,171 @@
+"""Synthetic workloads for the dimo benchmark suite.
+
+Generates content trees, dias-mets.xml files and N5 extractions of a chosen
+size. All generators take a seed, so the same arguments always produce the
+same workload.
+"""
+
+import hashlib
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+SIZE_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+FILES_PER_DIRECTORY = 100
+EXTENSIONS = (".pdf", ".txt", ".xml", ".tif", ".doc")
+
+
+def _file_size(rng: random.Random, distribution: str, mean_size: int) -> int:
+    if distribution == "fixed":
+        return mean_size
+    if distribution == "uniform":
+        return rng.randint(0, 2 * mean_size)
+    if distribution == "lognormal":
+        # Median at mean_size / 2 with a long tail, like real document archives
+        return min(int(rng.lognormvariate(0, 1.2) * mean_size / 2), 64 * mean_size)
+    raise ValueError(f"Unknown size distribution: {distribution} "
+                     f"(valid: {', '.join(SIZE_DISTRIBUTIONS)})")
+
+
+def generate_content(content_dir: str, n_files: int, mean_size: int = 16 * 1024,
+                     distribution: str = "lognormal", seed: int = 0) -> List[Tuple[str, int, str]]:
+    """Write n_files files below content_dir.
+
+    Returns (relative path, size, sha256) for every file.
+    """
+    rng = random.Random(seed)
+    block = rng.getrandbits(8 * 1024 * 1024).to_bytes(1024 * 1024, "little")
+    files = []
+    for i in range(n_files):
+        rel_dir = os.path.join(f"arkiv{i // (FILES_PER_DIRECTORY * 100)}",
+                               f"d{i // FILES_PER_DIRECTORY:05d}")
+        rel_path = os.path.join(rel_dir, f"fil{i:07d}{EXTENSIONS[i % len(EXTENSIONS)]}")
+        size = _file_size(rng, distribution, mean_size)
+        os.makedirs(os.path.join(content_dir, rel_dir), exist_ok=True)
+
+        digest = hashlib.sha256()
+        # Unique prefix so files with equal size do not share a checksum
+        prefix = f"{i}\n".encode()[:size]
+        with open(os.path.join(content_dir, rel_path), "wb") as f:
+            f.write(prefix)
+            digest.update(prefix)
+            remaining = size - len(prefix)
+            offset = i % len(block)
+            while remaining > 0:
+                chunk = block[offset:offset + remaining]
+                f.write(chunk)
+                digest.update(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        files.append((rel_path, size, digest.hexdigest()))
+    return files
+
+
+def generate_mets(mets_file: str, files: List[Tuple[str, int, str]], entries: Optional[int] = None,
+                  moved_share: float = 0.0, renamed_share: float = 0.0, seed: int = 0) -> Dict[str, int]:
+    """Write a dias-mets.xml with one <mets:file> per entry.
+
+    Entries refer to the given files in order. A moved_share of them point to
+    the right file name in a different directory; a renamed_share point to a
+    different file name but carry the correct SIZE/CHECKSUM. Entries beyond
+    len(files) refer to files that do not exist. Returns the count per kind.
+    """
+    rng = random.Random(seed)
+    entries = len(files) if entries is None else entries
+    counts = {"exact": 0, "moved": 0, "renamed": 0, "missing": 0}
+    with open(mets_file, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<mets:mets xmlns:mets="http://www.loc.gov/METS/" '
+                'xmlns:xlink="http://www.w3.org/1999/xlink" OBJID="benchmark">\n'
+                '  <mets:fileSec>\n    <mets:fileGrp ID="fgrp001" USE="FILES">\n')
+        for i in range(entries):
+            if i < len(files):
+                rel_path, size, checksum = files[i]
+                roll = rng.random()
+                if roll < moved_share:
+                    kind = "moved"
+                    href = os.path.join("flyttet", os.path.basename(rel_path))
+                    checksum = "0" * 64
+                elif roll < moved_share + renamed_share:
+                    kind = "renamed"
+                    href = os.path.join(os.path.dirname(rel_path), f"gammelt_navn{i}.bin")
+                else:
+                    kind = "exact"
+                    href = rel_path
+                    checksum = "0" * 64
+            else:
+                kind, href, size, checksum = "missing", f"mangler/fil{i}.pdf", 0, "0" * 64
+            counts[kind] += 1
+            href = "file:content/" + href.replace(os.sep, "/")
+            f.write(f'      <mets:file ID="fil{i}" MIMETYPE="application/octet-stream" '
+                    f'SIZE="{size}" CHECKSUM="{checksum}" CHECKSUMTYPE="SHA-256">\n'
+                    f'        <mets:FLocat LOCTYPE="URL" xlink:href={quoteattr(href)} '
+                    f'xlink:type="simple"/>\n      </mets:file>\n')
+        f.write('    </mets:fileGrp>\n  </mets:fileSec>\n</mets:mets>\n')
+    return counts
+
+
+def generate_n5(uttrekk_dir: str, registreringer: int, dokumenter_per_registrering: int = 1,
+                endringer_per_registrering: float = 0.5, seed: int = 0) -> Dict[str, int]:
+    """Write arkivstruktur.xml and endringslogg.xml with the given number of registreringer"""
+    rng = random.Random(seed)
+    ns = "http://www.arkivverket.no/standarder/noark5/arkivstruktur"
+    per_mappe = 20
+    mapper_per_klasse = 50
+    counts = {"arkivdel": 1, "klasse": 0, "mappe": 0, "registrering": 0, "dokumentobjekt": 0}
+    os.makedirs(uttrekk_dir, exist_ok=True)
+
+    def date(first_year: int = 1995, last_year: int = 2022) -> str:
+        return f"{rng.randint(first_year, last_year)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    with open(os.path.join(uttrekk_dir, "arkivstruktur.xml"), "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<arkiv xmlns="{ns}">\n'
+                '<systemID>arkiv-1</systemID><tittel>Benchmark</tittel>\n'
+                '<arkivdel><systemID>arkivdel-1</systemID><tittel>Arkivdel</tittel>'
+                '<opprettetDato>2000-01-01</opprettetDato><avsluttetDato>2020-12-31</avsluttetDato>\n'
+                '<klassifikasjonssystem><systemID>ks-1</systemID>\n')
+        reg = 0
+        while reg < registreringer:
+            counts["klasse"] += 1
+            f.write(f'<klasse><systemID>klasse-{counts["klasse"]}</systemID>'
+                    f'<opprettetDato>{date(2000, 2005)}</opprettetDato>\n')
+            for _ in range(mapper_per_klasse):
+                if reg >= registreringer:
+                    break
+                counts["mappe"] += 1
+                f.write(f'<mappe><systemID>mappe-{counts["mappe"]}</systemID>'
+                        f'<tittel>Sak {counts["mappe"]}</tittel><opprettetDato>{date()}</opprettetDato>\n')
+                for _ in range(min(per_mappe, registreringer - reg)):
+                    reg += 1
+                    f.write(f'<registrering><systemID>reg-{reg}</systemID>'
+                            f'<tittel>{escape(f"Journalpost {reg} & vedlegg")}</tittel>'
+                            f'<journalposttype>{rng.choice(("Inngående dokument", "Utgående dokument"))}'
+                            f'</journalposttype><journaldato>{date()}</journaldato>')
+                    for d in range(dokumenter_per_registrering):
+                        counts["dokumentobjekt"] += 1
+                        size = rng.choice((0, rng.randint(1, 10 ** 6)))
+                        f.write('<dokumentbeskrivelse><dokumentobjekt><versjonsnummer>1</versjonsnummer>'
+                                f'<format>PDF</format>'
+                                f'<referanseDokumentfil>dokumenter/{reg}_{d}.pdf</referanseDokumentfil>'
+                                f'<sjekksum>{rng.getrandbits(256):064x}</sjekksum>'
+                                f'<sjekksumAlgoritme>SHA256</sjekksumAlgoritme>'
+                                f'<filstoerrelse>{size}</filstoerrelse>'
+                                '</dokumentobjekt></dokumentbeskrivelse>')
+                    f.write('</registrering>\n')
+                f.write('</mappe>\n')
+            f.write('</klasse>\n')
+        counts["registrering"] = reg
+        f.write('</klassifikasjonssystem></arkivdel>\n</arkiv>\n')
+
+    ens = "http://www.arkivverket.no/standarder/noark5/endringslogg"
+    with open(os.path.join(uttrekk_dir, "endringslogg.xml"), "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<endringslogg xmlns="{ens}">\n')
+        counts["endring"] = int(registreringer * endringer_per_registrering)
+        for i in range(counts["endring"]):
+            # Skewed so that some entities get more than 4 changes
+            target = int(rng.paretovariate(1.5)) % max(registreringer, 1) + 1
+            f.write(f'<endring><referanseArkivenhet>reg-{target}</referanseArkivenhet>'
+                    f'<endringstidspunkt>{date()}T12:00:00</endringstidspunkt></endring>\n')
+        f.write('</endringslogg>\n')
+    return counts
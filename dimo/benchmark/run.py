@@ -0,0 +1,185 @@
+"""Benchmark runner for update_dias_mets, generate_report, the N5 tests and CLI startup.
+
+Each benchmark runs in a fresh process, so peak RSS is measured per benchmark
+and earlier runs do not warm caches for later ones. Results can be saved as a
+baseline and later runs compared against it to catch regressions.
+"""
+
+import contextlib
+import json
+import os
+import pathlib as pl
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dimo.profiling import peak_rss_bytes
+
+from .generate import generate_content, generate_mets, generate_n5
+
+N5_TESTS = ('01', '02', '03', '04', '05', 'all')
+
+# `dimo version` is started this many times by the cli_startup benchmark
+STARTUP_RUNS = 10
+
+
+def _bench_update_mets(workspace: str, streaming: bool) -> None:
+    from dimo.update_mets import update_dias_mets
+    mets_file = os.path.join(workspace, "dias-mets.xml")
+    shutil.copy(os.path.join(workspace, "dias-mets.orig.xml"), mets_file)
+    update_dias_mets(mets_file, os.path.join(workspace, "content"), use_cache=False,
+                     streaming=streaming)
+
+
+def _bench_report(workspace: str) -> None:
+    from dimo.report import generate_report
+    generate_report(path=os.path.join(workspace, "content"), format="json")
+
+
+def _bench_n5(uttrekk: str, test_name: str) -> None:
+    from dimo.tester.n5.test_n5 import N5Tester
+    N5Tester(pl.Path(uttrekk), use_index=False).run_test(test_name)
+
+
+def _bench_cli_startup(runs: int) -> None:
+    """Start `dimo version` in fresh interpreters; catches heavy module-level imports"""
+    for _ in range(runs):
+        subprocess.run([sys.executable, "-m", "dimo.cli", "version"], check=True,
+                       stdout=subprocess.DEVNULL)
+
+
+def _measure(func: Callable, args: Tuple) -> Dict[str, Any]:
+    """Run func(*args) in this (fresh) process and return time and memory"""
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        func(*args)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    return {'wall_seconds': wall, 'cpu_seconds': cpu, 'peak_rss_bytes': peak_rss_bytes()}
+
+
+def _run_isolated(func: Callable, args: Tuple) -> Dict[str, Any]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_measure, func, args).result()
+
+
+def prepare_workload(workdir: str, files: int, entries: Optional[int], registreringer: int,
+                     mean_size: int, distribution: str, moved_share: float,
+                     renamed_share: float, seed: int = 0) -> Dict[str, Any]:
+    """Generate (or reuse) the synthetic workload described by the arguments"""
+    params = {
+        'files': files, 'entries': entries, 'registreringer': registreringer,
+        'mean_size': mean_size, 'distribution': distribution,
+        'moved_share': moved_share, 'renamed_share': renamed_share, 'seed': seed,
+    }
+    params_file = os.path.join(workdir, "workload.json")
+    if os.path.exists(params_file):
+        with open(params_file, encoding="utf-8") as f:
+            existing = json.load(f)
+        if existing['params'] == params:
+            return existing
+
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    workspace = os.path.join(workdir, "mets")
+    uttrekk = os.path.join(workdir, "n5")
+    content = generate_content(os.path.join(workspace, "content"), files, mean_size,
+                               distribution, seed)
+    mets_counts = generate_mets(os.path.join(workspace, "dias-mets.orig.xml"), content,
+                                entries, moved_share, renamed_share, seed)
+    n5_counts = generate_n5(uttrekk, registreringer, seed=seed)
+    workload = {
+        'params': params,
+        'content_bytes': sum(size for _, size, _ in content),
+        'mets_entries': mets_counts,
+        'n5': n5_counts,
+        'arkivstruktur_bytes': os.path.getsize(os.path.join(uttrekk, "arkivstruktur.xml")),
+        'endringslogg_bytes': os.path.getsize(os.path.join(uttrekk, "endringslogg.xml")),
+    }
+    with open(params_file, "w", encoding="utf-8") as f:
+        json.dump(workload, f, indent=2)
+    return workload
+
+
+def run_benchmarks(workdir: str, workload: Dict[str, Any],
+                   only: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Run every benchmark against a prepared workload"""
+    workspace = os.path.join(workdir, "mets")
+    uttrekk = os.path.join(workdir, "n5")
+    n_files = workload['params']['files']
+    content_bytes = workload['content_bytes']
+    n5_records = workload['n5']['registrering']
+    arkivstruktur_bytes = workload['arkivstruktur_bytes']
+    endringslogg_bytes = workload['endringslogg_bytes']
+
+    # name -> (function, args, items processed, item unit, bytes processed)
+    benchmarks = {
+        'update_mets': (_bench_update_mets, (workspace, False), n_files, 'files', content_bytes),
+        'update_mets_streaming': (_bench_update_mets, (workspace, True), n_files, 'files', content_bytes),
+        'report': (_bench_report, (workspace,), n_files, 'files', None),
+        'cli_startup': (_bench_cli_startup, (STARTUP_RUNS,), STARTUP_RUNS, 'runs', None),
+    }
+    for test_name in N5_TESTS:
+        if test_name == '01':
+            items, nbytes = workload['n5']['endring'], endringslogg_bytes
+        elif test_name == 'all':
+            items, nbytes = n5_records, arkivstruktur_bytes + endringslogg_bytes
+        else:
+            items, nbytes = n5_records, arkivstruktur_bytes
+        benchmarks[f'n5_{test_name}'] = (_bench_n5, (uttrekk, test_name), items, 'records', nbytes)
+
+    results = {}
+    for name, (func, args, items, unit, nbytes) in benchmarks.items():
+        if only and name not in only:
+            continue
+        result = _run_isolated(func, args)
+        wall = result['wall_seconds'] or 1e-9
+        result['items'] = items
+        result['items_per_second'] = items / wall
+        result['unit'] = unit
+        if nbytes is not None:
+            result['mb_per_second'] = nbytes / wall / (1024 * 1024)
+        results[name] = result
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'workload': workload,
+        'results': results,
+    }
+
+
+def compare_to_baseline(current: Dict[str, Any], baseline: Dict[str, Any],
+                        tolerance: float = 0.2) -> List[Dict[str, Any]]:
+    """Compare wall time and peak RSS per benchmark.
+
+    A benchmark regresses when it is more than ``tolerance`` (relative) slower
+    or larger than in the baseline. Returns one row per benchmark found in both.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        row = {'benchmark': name, 'regressions': []}
+        for metric in ('wall_seconds', 'peak_rss_bytes'):
+            if result.get(metric) is None or not base.get(metric):
+                continue
+            ratio = result[metric] / base[metric]
+            row[f'{metric}_ratio'] = ratio
+            if ratio > 1 + tolerance:
+                row['regressions'].append(metric)
+        rows.append(row)
+    if current['workload']['params'] != baseline.get('workload', {}).get('params'):
+        rows.append({'benchmark': '(workload)', 'regressions': [],
+                     'note': 'workload parameters differ from the baseline'})
+    return rows
@@ -0,0 +1,109 @@
+"""Persistent sjekksum-cache for update-mets.
+
+Cachen lagres som en SQLite-database i 'logs'-mappen og er nøklet på relativ
+sti, filstørrelse, st_mtime_ns og inode. Bare filer der én av disse har endret
+seg siden forrige kjøring trenger å hashes på nytt. Hver algoritme lagres som
+egen rad, så en fil er et treff bare når alle ønskede sjekksummer finnes.
+"""
+
+import sqlite3
+
+CACHE_FILENAME = "checksum_cache.sqlite"
+
+# Økes når tabellstrukturen endres; en cache med annen versjon bygges på nytt.
+SCHEMA_VERSION = 2
+
+
+class ChecksumCache:
+    """Oppslag og lagring av sjekksummer nøklet på (sti, størrelse, mtime, inode, algoritme)."""
+
+    def __init__(self, db_path, rebuild=False):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        self._pending_stats = []
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS files")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " rel_path TEXT NOT NULL,"
+            " algorithm TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " checksum TEXT NOT NULL,"
+            " PRIMARY KEY (rel_path, algorithm)) WITHOUT ROWID"
+        )
+        self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._conn.commit()
+
+    def lookup(self, rel_path, stat_result, algorithms=("sha256",)):
+        """
+        Returnerer lagrede sjekksummer (tuple i samme rekkefølge som algorithms)
+        hvis filen er uendret og alle finnes, ellers None.
+        """
+        rows = self._conn.execute(
+            "SELECT algorithm, checksum FROM files"
+            " WHERE rel_path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+            (rel_path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino),
+        ).fetchall()
+        found = dict(rows)
+        if all(name in found for name in algorithms):
+            self.hits += 1
+            return tuple(found[name] for name in algorithms)
+        self.misses += 1
+        return None
+
+    def store(self, rel_path, stat_result, checksums, algorithms=("sha256",)):
+        """Legger nye sjekksummer i kø for skriving (flushes i batcher)."""
+        stat_key = (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+        self._pending_stats.append((rel_path, *stat_key))
+        for name, checksum in zip(algorithms, checksums):
+            self._pending.append((rel_path, name, *stat_key, checksum))
+        if len(self._pending) >= 10000:
+            self.flush()
+
+    def flush(self):
+        if self._pending_stats:
+            # Sjekksummer fra en eldre versjon av filen er ugyldige for alle algoritmer
+            self._conn.executemany(
+                "DELETE FROM files WHERE rel_path = ?"
+                " AND NOT (size = ? AND mtime_ns = ? AND inode = ?)",
+                self._pending_stats,
+            )
+            self._pending_stats = []
+        if self._pending:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", self._pending
+            )
+            self._pending = []
+        self._conn.commit()
+
+    def prune(self, seen_paths):
+        """Fjerner oppføringer for filer som ikke lenger finnes i content."""
+        self.flush()
+        stale = [
+            (rel_path,)
+            for (rel_path,) in self._conn.execute("SELECT DISTINCT rel_path FROM files")
+            if rel_path not in seen_paths
+        ]
+        self._conn.executemany("DELETE FROM files WHERE rel_path = ?", stale)
+        self._conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
@@ -1,15 +1,12 @@
-import argparse
-import subprocess
 import sys
-from dimo.update_mets import update_dias_mets
-from dimo.report import generate_report
 from dimo import __version__
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
 import typer
-from rich.console import Console
-from rich.table import Table
-from dimo.tester.n5.test_n5 import run_n5_test
+
+# Subcommands import what they need (lxml, rich, the N5 tester, ...) in the
+# command body, so simple commands such as `dimo version` start quickly.
+# The cli_startup benchmark guards this.
 
 app = typer.Typer()
 
@@ -18,10 +15,35 @@ class ReportFormat(str, Enum):
     json = "json"
     html = "html"
 
+class IoOrder(str, Enum):
+    none = "none"
+    inode = "inode"
+    extent = "extent"
+
+class HashMode(str, Enum):
+    auto = "auto"
+    thread = "thread"
+    process = "process"
+
+# dimo.hashing.DEFAULT_CHUNK_SIZE; not imported so startup stays fast
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+PROFILE_HELP = "Write per-phase time/memory/throughput metrics to this JSON file and print a summary"
+CPROFILE_HELP = "Write cProfile statistics to this file"
+TRACE_MEMORY_HELP = "Track peak Python memory per phase with tracemalloc (slow)"
+
+def _profiling(profile: Optional[str], cprofile: Optional[str], trace_memory: bool):
+    """Profile session for a command; the summary is only printed when profiling was asked for"""
+    from dimo.profiling import profile_session
+    return profile_session(metrics_path=profile, cprofile_path=cprofile, trace_memory=trace_memory,
+                           summary=bool(profile or cprofile or trace_memory))
+
 @app.callback(invoke_without_command=True)
 def callback(ctx: typer.Context):
     """DIMO - Digital Archive Management Tools"""
     if ctx.invoked_subcommand is None:
+        from rich.console import Console
+        from rich.table import Table
         console = Console()
         console.print("\n[bold cyan]DIMO - Digital Archive Management Tools[/]\n")
         
@@ -31,7 +53,12 @@ def callback(ctx: typer.Context):
         commands_table.add_row("version", "Show version information")
         commands_table.add_row("update", "Update DIMO to the latest version")
         commands_table.add_row("update-mets", "Update dias-METS file with correct paths and checksums")
+        commands_table.add_row("watch", "Keep the dias-METS file in sync with content while it changes")
+        commands_table.add_row("verify-mets", "Audit content against SIZE/CHECKSUM in the dias-METS file (read-only)")
         commands_table.add_row("report", "Generate reports about files and content")
+        commands_table.add_row("batch", "Process many workspaces over one shared worker pool")
+        commands_table.add_row("index", "Build persistent indexes of archive extractions")
+        commands_table.add_row("bench", "Benchmark DIMO on a synthetic workload")
         console.print(commands_table)
         console.print()
 
@@ -45,6 +72,7 @@ def version(check: bool = typer.Option(False, help="Check for updates")):
 @app.command()
 def update():
     """Update DIMO to the latest version"""
+    import subprocess
     typer.echo("Updating DIMO to the latest version...")
     try:
         subprocess.check_call([
@@ -59,22 +87,305 @@ def update():
 @app.command("update-mets")
 def update_mets(
     mets_file: str = typer.Option("dias-mets.xml", help="METS file to update"),
-    content_dir: str = typer.Option("content", help="Content directory"),
-    dry_run: bool = typer.Option(False, help="Run without writing changes to file")
+    content_dir: str = typer.Option("content", help="Content directory, or a tar/zip package read without extracting it"),
+    dry_run: bool = typer.Option(False, help="Run without writing changes to file"),
+    cache: bool = typer.Option(True, help="Reuse checksums of unchanged files from logs/checksum_cache.sqlite"),
+    rebuild_cache: bool = typer.Option(False, help="Discard the checksum cache and re-hash every file"),
+    hash_workers: Optional[int] = typer.Option(None, help="Number of hashing workers (default: automatic)"),
+    hash_mode: HashMode = typer.Option(HashMode.auto, help="Run hashing in threads, processes or pick automatically"),
+    hash_chunk_size: int = typer.Option(DEFAULT_CHUNK_SIZE, help="Read buffer size in bytes for hashing"),
+    hash_mmap_threshold: Optional[int] = typer.Option(None, help="Hash files of at least this many bytes from a memory map instead of read buffers (default: never)"),
+    streaming: bool = typer.Option(False, help="Rewrite the METS file in a single streaming pass with bounded memory"),
+    inventory: Optional[str] = typer.Option(None, help="File inventory to reuse (created there if missing)"),
+    stream_validation: bool = typer.Option(False, help="Validate against the XSD while parsing instead of loading the whole METS (always on with --streaming)"),
+    io_order: IoOrder = typer.Option(IoOrder.none, help="Read order for hashing: scan order, or sorted per device by inode or physical extent (for HDD/HSM/tape storage)"),
+    io_device_workers: int = typer.Option(1, help="Concurrent readers per device with --io-order inode/extent"),
+    verbose: bool = typer.Option(False, help="Also show per-file events on the console (always written to logs/mets_update.log)"),
+    resume: bool = typer.Option(True, "--resume/--restart", help="Continue from the hash journal of an interrupted run, or discard it and start over"),
+    checksum: List[str] = typer.Option(["sha256"], help="Checksum algorithm (repeatable: md5, sha1, sha256, sha384, sha512). The first is written to METS, all of them to fixity_manifest.tsv; every file is read once"),
+    profile: Optional[str] = typer.Option(None, help=PROFILE_HELP),
+    cprofile: Optional[str] = typer.Option(None, help=CPROFILE_HELP),
+    trace_memory: bool = typer.Option(False, help=TRACE_MEMORY_HELP)
 ):
     """Update dias-METS file with correct paths and checksums"""
-    update_dias_mets(mets_file, content_dir, dry_run=dry_run)
+    from dimo.update_mets import METS_CHECKSUMTYPES, update_dias_mets
+
+    if rebuild_cache and not cache:
+        raise typer.BadParameter("--rebuild-cache cannot be combined with --no-cache")
+    checksum = [name.lower() for name in checksum]
+    unknown = [name for name in checksum if name not in METS_CHECKSUMTYPES]
+    if unknown:
+        raise typer.BadParameter(f"Unknown checksum algorithm(s): {', '.join(unknown)} "
+                                 f"(valid: {', '.join(METS_CHECKSUMTYPES)})")
+    with _profiling(profile, cprofile, trace_memory) as profiler:
+        update_dias_mets(mets_file, content_dir, dry_run=dry_run, use_cache=cache,
+                         rebuild_cache=rebuild_cache, hash_workers=hash_workers,
+                         hash_mode=hash_mode.value, hash_chunk_size=hash_chunk_size,
+                         hash_mmap_threshold=hash_mmap_threshold, streaming=streaming, inventory_path=inventory,
+                         stream_validation=stream_validation, profiler=profiler,
+                         checksum_algorithms=checksum, resume=resume,
+                         io_order=io_order.value, io_device_workers=io_device_workers,
+                         verbose=verbose)
+
+@app.command()
+def watch(
+    mets_file: str = typer.Option("dias-mets.xml", help="METS file to keep in sync"),
+    content_dir: str = typer.Option("content", help="Content directory"),
+    interval: float = typer.Option(2.0, help="Seconds between polls of the content directory"),
+    debounce: float = typer.Option(5.0, help="Write METS after this many seconds without changes"),
+    max_delay: float = typer.Option(60.0, help="Write METS at the latest this long after the first unwritten change"),
+    checksum: str = typer.Option("sha256", help="Checksum algorithm written to METS (md5, sha1, sha256, sha384, sha512)"),
+    cache: bool = typer.Option(True, help="Reuse and update logs/checksum_cache.sqlite"),
+    hash_workers: Optional[int] = typer.Option(None, help="Number of hashing workers (default: automatic)"),
+    hash_mode: HashMode = typer.Option(HashMode.auto, help="Run hashing in threads, processes or pick automatically"),
+    hash_chunk_size: int = typer.Option(DEFAULT_CHUNK_SIZE, help="Read buffer size in bytes for hashing"),
+    verbose: bool = typer.Option(False, help="Also show per-file events on the console (always written to logs/mets_watch.log)")
+):
+    """Keep the dias-METS file in sync with content while it changes (Ctrl+C to stop)"""
+    from dimo.update_mets import METS_CHECKSUMTYPES
+    from dimo.watch import MetsWatcher
+
+    checksum = checksum.lower()
+    if checksum not in METS_CHECKSUMTYPES:
+        raise typer.BadParameter(f"Unknown checksum algorithm: {checksum} "
+                                 f"(valid: {', '.join(METS_CHECKSUMTYPES)})")
+    watcher = MetsWatcher(mets_file, content_dir, algorithm=checksum, hash_workers=hash_workers,
+                          hash_mode=hash_mode.value, hash_chunk_size=hash_chunk_size,
+                          debounce=debounce, max_delay=max_delay, use_cache=cache,
+                          verbose=verbose)
+    watcher.run(interval=interval)
+
+@app.command("verify-mets")
+def verify_mets(
+    mets_file: str = typer.Option("dias-mets.xml", help="METS file to verify against"),
+    content_dir: str = typer.Option("content", help="Content directory"),
+    sample: float = typer.Option(1.0, help="Share of files to verify per run, e.g. 0.05; runs rotate through the package"),
+    sample_slot: Optional[int] = typer.Option(None, help="Which rotation group to verify (default: derived from today's date)"),
+    hash_workers: Optional[int] = typer.Option(None, help="Number of hashing workers (default: automatic)"),
+    hash_mode: HashMode = typer.Option(HashMode.auto, help="Run hashing in threads, processes or pick automatically"),
+    hash_chunk_size: int = typer.Option(DEFAULT_CHUNK_SIZE, help="Read buffer size in bytes for hashing"),
+    hash_mmap_threshold: Optional[int] = typer.Option(None, help="Hash files of at least this many bytes from a memory map instead of read buffers (default: never)"),
+    output: Optional[str] = typer.Option(None, help="Write the full result (including every failure) to this JSON file"),
+    profile: Optional[str] = typer.Option(None, help=PROFILE_HELP),
+    cprofile: Optional[str] = typer.Option(None, help=CPROFILE_HELP),
+    trace_memory: bool = typer.Option(False, help=TRACE_MEMORY_HELP)
+):
+    """Audit content against SIZE/CHECKSUM in the dias-METS file without changing anything"""
+    import json
+    from rich.console import Console
+    from rich.table import Table
+    from dimo.verify_mets import verify_dias_mets
+
+    if not 0 < sample <= 1:
+        raise typer.BadParameter("--sample must be greater than 0 and at most 1")
+    with _profiling(profile, cprofile, trace_memory) as profiler:
+        result = verify_dias_mets(mets_file, content_dir, sample=sample, sample_slot=sample_slot,
+                                  hash_workers=hash_workers, hash_mode=hash_mode.value,
+                                  hash_chunk_size=hash_chunk_size,
+                                  hash_mmap_threshold=hash_mmap_threshold, profiler=profiler)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    console = Console()
+    if result['sample_buckets'] > 1:
+        console.print(f"Verified rotation group {result['sample_slot'] + 1} of {result['sample_buckets']}")
+    table = Table(title="METS fixity audit")
+    table.add_column("Status", style="cyan")
+    table.add_column("Files", justify="right")
+    for status, count in result['counts'].items():
+        table.add_row(status, f"{count:,}")
+    console.print(table)
+    for failure in result['failures'][:20]:
+        console.print(f"[red]{failure['status']}[/]: {failure['path']}")
+    if len(result['failures']) > 20:
+        console.print(f"... and {len(result['failures']) - 20} more"
+                      + (f" (see {output})" if output else " (use --output for the full list)"))
+    if result['failures']:
+        sys.exit(1)
 
 @app.command()
 def report(
-    path: str = typer.Option(".", help="Path to analyze"),
-    format: ReportFormat = typer.Option(ReportFormat.text, help="Output format")
+    path: str = typer.Option(".", help="Path to analyze (a directory, or a tar/zip file)"),
+    format: ReportFormat = typer.Option(ReportFormat.text, help="Output format"),
+    workers: Optional[int] = typer.Option(None, help="Threads used to walk the directory tree (default: automatic)"),
+    snapshot: Optional[str] = typer.Option(None, help="Snapshot file: reuse unchanged directories from it, report changes and save a new one"),
+    inventory: Optional[str] = typer.Option(None, help="File inventory to reuse (created there if missing)"),
+    profile: Optional[str] = typer.Option(None, help=PROFILE_HELP),
+    cprofile: Optional[str] = typer.Option(None, help=CPROFILE_HELP),
+    trace_memory: bool = typer.Option(False, help=TRACE_MEMORY_HELP)
 ):
     """Generate reports about files and content"""
-    generate_report(path=path, format=format.value)
+    from dimo.archive import is_archive
+    from dimo.report import generate_report
+
+    if snapshot and inventory:
+        raise typer.BadParameter("--snapshot and --inventory cannot be combined")
+    if (snapshot or inventory) and is_archive(path):
+        raise typer.BadParameter("--snapshot and --inventory need a directory, not a tar/zip file")
+    with _profiling(profile, cprofile, trace_memory) as profiler:
+        generate_report(path=path, format=format.value, workers=workers, snapshot=snapshot,
+                        inventory=inventory, profiler=profiler)
+
+@app.command()
+def batch(
+    source: str = typer.Argument(..., help="Directory to search for workspaces, or a file listing one workspace directory per line"),
+    task: Optional[List[str]] = typer.Option(None, help="Run only these tasks (repeatable: update-mets, report, n5; default: all that apply)"),
+    jobs: Optional[int] = typer.Option(None, help="Worker processes shared by all workspaces (default: CPU count)"),
+    output: str = typer.Option("dimo-batch.json", help="Consolidated result file"),
+    large_size: int = typer.Option(1024 ** 3, help="Tasks reading at least this many bytes are large; they use at most half of the workers"),
+    hash_workers: Optional[int] = typer.Option(None, help="Hashing threads per update-mets task (default: CPU count / jobs)"),
+    streaming: bool = typer.Option(False, help="Use streaming METS updates"),
+    dry_run: bool = typer.Option(False, help="Run update-mets without writing changes")
+):
+    """Run update-mets, report and N5 tests for many workspaces over one shared worker pool"""
+    from datetime import datetime
+    from rich.console import Console
+    from rich.table import Table
+    from dimo.batch import (TASK_KINDS, batch_result, discover_workspaces, plan_tasks,
+                            run_batch, save_result)
+
+    kinds = task or list(TASK_KINDS)
+    unknown = [kind for kind in kinds if kind not in TASK_KINDS]
+    if unknown:
+        raise typer.BadParameter(f"Unknown task(s): {', '.join(unknown)} (valid: {', '.join(TASK_KINDS)})")
+
+    console = Console()
+    started = datetime.now().isoformat(timespec='seconds')
+    workspaces = discover_workspaces(source)
+    tasks = plan_tasks(workspaces, kinds)
+    console.print(f"{len(workspaces)} workspaces, {len(tasks)} tasks")
+
+    def on_result(task, result):
+        status = "[green]ok[/]" if result['status'] == 'ok' else "[red]failed[/]"
+        console.print(f"{status} {task.kind} {task.workspace}"
+                      + (f": {result['error']}" if result['status'] != 'ok' else ""))
+
+    options = {'dry_run': dry_run, 'streaming': streaming}
+    if hash_workers:
+        options['hash_workers'] = hash_workers
+    results = run_batch(tasks, jobs=jobs, large_size=large_size, options=options,
+                        on_result=on_result)
+    result = batch_result(source, tasks, results, jobs, started)
+    save_result(output, result)
+
+    table = Table(title="Batch results")
+    table.add_column("Workspace", style="cyan")
+    for kind in kinds:
+        table.add_column(kind)
+    for workspace, workspace_results in sorted(results.items()):
+        table.add_row(workspace, *(workspace_results[kind]['status'] if kind in workspace_results
+                                   else "-" for kind in kinds))
+    console.print(table)
+    console.print(f"{result['counts']['ok']} ok, {result['counts']['failed']} failed; "
+                  f"result written to {output}")
+    if result['counts']['failed']:
+        sys.exit(1)
+
+index_app = typer.Typer(help="Build persistent indexes of archive extractions")
+app.add_typer(index_app, name="index")
+
+@index_app.command("n5")
+def index_n5(
+    path: Optional[str] = typer.Option(None, help="Extraction directory (default: current workspace)"),
+    rebuild: bool = typer.Option(False, help="Rebuild even if the index is up to date"),
+    query: Optional[str] = typer.Option(None, help="Run an SQL query against the index and print the rows")
+):
+    """Index arkivstruktur.xml and endringslogg.xml into logs/n5_index.sqlite"""
+    from pathlib import Path
+    from rich.console import Console
+    from rich.table import Table
+    from dimo import get_workspace
+    from dimo.tester.n5.index import N5Index
+    uttrekksmappe = Path(path) if path else get_workspace().get_workspace_path()
+    n5_index = N5Index(uttrekksmappe)
+    console = Console()
+    try:
+        if rebuild or not n5_index.is_fresh():
+            counts = n5_index.build()
+            console.print(f"Built N5 index: {n5_index.path}")
+            table = Table()
+            table.add_column("Table", style="cyan")
+            table.add_column("Rows", justify="right")
+            for name, count in counts.items():
+                table.add_row(name, f"{count:,}")
+            console.print(table)
+        else:
+            console.print(f"N5 index is up to date: {n5_index.path}")
+        if query:
+            for row in n5_index.query(query):
+                console.print(row)
+    except Exception as e:
+        typer.echo(f"Error indexing N5 extraction: {e}", err=True)
+        sys.exit(1)
+    finally:
+        n5_index.close()
+
+@app.command()
+def bench(
+    workdir: str = typer.Option("dimo-bench", help="Directory for the generated workload"),
+    files: int = typer.Option(10000, help="Number of content files"),
+    entries: Optional[int] = typer.Option(None, help="Number of <mets:file> entries (default: one per file)"),
+    registreringer: int = typer.Option(100000, help="Number of N5 registreringer"),
+    mean_size: int = typer.Option(16 * 1024, help="Mean content file size in bytes"),
+    distribution: str = typer.Option("lognormal", help="File size distribution: fixed, uniform or lognormal"),
+    moved: float = typer.Option(0.05, help="Share of METS entries pointing to a moved file"),
+    renamed: float = typer.Option(0.02, help="Share of METS entries pointing to a renamed file"),
+    only: Optional[List[str]] = typer.Option(None, help="Run only these benchmarks (repeatable)"),
+    baseline: Optional[str] = typer.Option(None, help="Compare against this baseline JSON file"),
+    save_baseline: Optional[str] = typer.Option(None, help="Save the results as a baseline JSON file"),
+    tolerance: float = typer.Option(0.2, help="Allowed relative slowdown/growth before a regression is reported")
+):
+    """Benchmark update-mets, report and the N5 tests on a synthetic workload"""
+    import json
+    from rich.console import Console
+    from rich.table import Table
+    from dimo.benchmark.run import compare_to_baseline, prepare_workload, run_benchmarks
+
+    console = Console()
+    console.print(f"Preparing workload in {workdir} ...")
+    workload = prepare_workload(workdir, files, entries, registreringer, mean_size,
+                                distribution, moved, renamed)
+    results = run_benchmarks(workdir, workload, only=only)
+
+    table = Table(title="DIMO benchmarks")
+    for column in ("Benchmark", "Wall (s)", "CPU (s)", "Throughput", "MB/s", "Peak RSS (MB)"):
+        table.add_column(column, justify="left" if column == "Benchmark" else "right")
+    for name, result in results['results'].items():
+        rss = result['peak_rss_bytes']
+        table.add_row(
+            name,
+            f"{result['wall_seconds']:.2f}",
+            f"{result['cpu_seconds']:.2f}",
+            f"{result['items_per_second']:,.0f} {result['unit']}/s",
+            f"{result['mb_per_second']:.1f}" if 'mb_per_second' in result else "-",
+            f"{rss / (1024 * 1024):.0f}" if rss else "-"
+        )
+    console.print(table)
+
+    if save_baseline:
+        with open(save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        console.print(f"Baseline saved to {save_baseline}")
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            rows = compare_to_baseline(results, json.load(f), tolerance)
+        regressed = [row for row in rows if row['regressions']]
+        for row in rows:
+            if 'note' in row:
+                console.print(f"[yellow]Note: {row['note']}[/]")
+                continue
+            status = "[red]REGRESSION[/]" if row['regressions'] else "[green]ok[/]"
+            ratios = ", ".join(f"{key[:-6]} x{value:.2f}" for key, value in row.items()
+                               if key.endswith('_ratio'))
+            console.print(f"{row['benchmark']}: {status} ({ratios})")
+        if regressed:
+            sys.exit(1)
 
 def display_test_results(results: dict, standard: str):
     """Helper function to display test results in a consistent format"""
+    from rich.console import Console
     console = Console()
     console.print(f"\n[bold cyan]{standard.upper()} Test Results[/]\n")
     for test_id, test_data in results.items():
@@ -86,11 +397,31 @@ def display_test_results(results: dict, standard: str):
 def test(
     standard: str = typer.Argument(..., help="Standard to test against (n5, siard, etc.)"),
     test_name: Optional[str] = typer.Argument(None, help="Test to run (e.g., '01', 'all')"),
+    sample: float = typer.Option(1.0, help="Fixity test (07): share of the document files to verify per run, e.g. 0.05; runs rotate through the extraction"),
+    sample_slot: Optional[int] = typer.Option(None, help="Fixity test (07): which rotation group to verify (default: derived from today's date)"),
+    limit: Optional[int] = typer.Option(None, help="Fixity test (07): verify at most this many document files"),
+    hash_workers: Optional[int] = typer.Option(None, help="Number of hashing workers (default: automatic)"),
+    hash_mode: HashMode = typer.Option(HashMode.auto, help="Run hashing in threads, processes or pick automatically"),
+    output: Optional[str] = typer.Option(None, help="Write the full results (including every fixity failure) to this JSON file"),
+    profile: Optional[str] = typer.Option(None, help=PROFILE_HELP),
+    cprofile: Optional[str] = typer.Option(None, help=CPROFILE_HELP),
+    trace_memory: bool = typer.Option(False, help=TRACE_MEMORY_HELP)
 ):
     """Run tests for different archive standards"""
+    if not 0 < sample <= 1:
+        raise typer.BadParameter("--sample must be greater than 0 and at most 1")
+    if limit is not None and limit < 0:
+        raise typer.BadParameter("--limit must not be negative")
+    options = {'sample': sample, 'sample_slot': sample_slot, 'limit': limit,
+               'hash_workers': hash_workers, 'hash_mode': hash_mode.value}
     try:
+        import json
         from dimo.test import run_test
-        results = run_test(standard, test_name)
+        with _profiling(profile, cprofile, trace_memory) as profiler:
+            results = run_test(standard, test_name, profiler=profiler, options=options)
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
         display_test_results(results, standard)
     except Exception as e:
         typer.echo(f"Error running {standard} test: {e}", err=True)
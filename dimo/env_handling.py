@@ -40,8 +40,8 @@ class WorkspaceManager:
         except Exception:
             return False
 
-# Global workspace manager instance
-workspace_manager = WorkspaceManager()
+# Global workspace manager instance, created on first use by get_workspace()
+workspace_manager: Optional[WorkspaceManager] = None
 
 def set_workspace(path: str) -> None:
     """Set the workspace path globally.
@@ -57,4 +57,7 @@ def set_workspace(path: str) -> None:
 
 def get_workspace() -> WorkspaceManager:
     """Get the current workspace manager instance."""
+    global workspace_manager
+    if workspace_manager is None:
+        workspace_manager = WorkspaceManager()
     return workspace_manager
\ No newline at end of file
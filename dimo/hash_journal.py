@@ -0,0 +1,112 @@
+"""Write-ahead-journal for hashing i update-mets.
+
+Hver ferdig hashet fil skrives som én JSON-linje (sti, størrelse, mtime_ns,
+inode, sjekksummer) og journalen flushes og fsyncs i batcher mens hashingen
+pågår. Dør en kjøring underveis, kan neste kjøring hente alt som ble
+journalført i stedet for å hashe det på nytt. Journalen slettes når en
+kjøring fullføres.
+"""
+
+import json
+import os
+
+JOURNAL_FILENAME = "hash_journal.jsonl"
+JOURNAL_VERSION = 1
+
+
+class HashJournal:
+    """
+    Journal over hashede filer for én update-mets-kjøring.
+
+    resume=True laster en eksisterende journal (hvis den er skrevet med samme
+    algoritmer); resume=False forkaster den og starter på nytt.
+    """
+
+    def __init__(self, path, algorithms=("sha256",), resume=True, batch_size=1000):
+        self.path = path
+        self.algorithms = list(algorithms)
+        self.batch_size = batch_size
+        self.entries = {}
+        self.resumed = 0
+        self._pending = []
+        self._truncated = False
+
+        # En journal som finnes ved start betyr at forrige kjøring ble avbrutt
+        self.interrupted = os.path.exists(path)
+        if resume and self.interrupted:
+            self._load()
+        fresh = not self.entries
+        self._file = open(path, "w" if fresh else "a", encoding="utf-8")
+        if fresh:
+            header = {"version": JOURNAL_VERSION, "algorithms": self.algorithms}
+            self._file.write(json.dumps(header) + "\n")
+            self._sync()
+        elif self._truncated:
+            self._file.write("\n")
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return
+            if header.get("version") != JOURNAL_VERSION or header.get("algorithms") != self.algorithms:
+                return
+            line = ""
+            for line in f:
+                try:
+                    rel_path, size, mtime_ns, inode, checksums = json.loads(line)
+                except ValueError:
+                    continue  # Linje som ble avbrutt under skriving
+                self.entries[rel_path] = (size, mtime_ns, inode, tuple(checksums))
+            self._truncated = bool(line) and not line.endswith("\n")
+
+    def lookup(self, rel_path, stat_result):
+        """Journalførte sjekksummer hvis filen er uendret siden, ellers None."""
+        entry = self.entries.get(rel_path)
+        if entry is not None and entry[:3] == (
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+            stat_result.st_ino,
+        ):
+            self.resumed += 1
+            return entry[3]
+        return None
+
+    def record(self, rel_path, stat_result, checksums):
+        self._pending.append(json.dumps([
+            rel_path,
+            stat_result.st_size,
+            stat_result.st_mtime_ns,
+            stat_result.st_ino,
+            list(checksums),
+        ]))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write("\n".join(self._pending) + "\n")
+            self._pending = []
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def discard(self):
+        """Kjøringen er fullført: journalen trengs ikke lenger."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,329 @@
+"""Hashing-motor for sjekksummer av innholdsfiler.
+
+Filene leses med readinto() inn i en gjenbrukt buffer (én per tråd/prosess),
+slik at vi slipper en ny bytes-allokering per blokk. Store filer kan hashes
+via mmap. Flere algoritmer (f.eks. SHA-256, MD5 og SHA-512) beregnes fra
+samme buffer, så hver fil leses bare én gang. Arbeidet fordeles på tråder
+eller prosesser etter valgt modus.
+"""
+
+import hashlib
+import itertools
+import mmap
+import os
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+HASH_MODES = ("auto", "thread", "process")
+
+# I auto-modus brukes prosesser når gjennomsnittlig filstørrelse er under
+# denne grensen: da dominerer Python-overhead per fil, ikke selve hashingen
+# (som slipper GIL for store buffere).
+AUTO_PROCESS_MAX_AVG_SIZE = 64 * 1024
+AUTO_PROCESS_MIN_FILES = 10000
+
+# imap: filer per oppgave i prosessmodus, og oppgaver i kø per arbeider
+PROCESS_BATCH_SIZE = 64
+PENDING_PER_WORKER = 4
+
+# hashlib-navn -> CHECKSUMTYPE-verdi i METS
+METS_CHECKSUMTYPES = {
+    "md5": "MD5",
+    "sha1": "SHA-1",
+    "sha256": "SHA-256",
+    "sha384": "SHA-384",
+    "sha512": "SHA-512",
+}
+
+_local = threading.local()
+
+
+def _get_buffer(chunk_size):
+    """Returnerer en gjenbrukbar buffer for gjeldende tråd."""
+    buf = getattr(_local, "buffer", None)
+    if buf is None or len(buf) != chunk_size:
+        buf = memoryview(bytearray(chunk_size))
+        _local.buffer = buf
+    return buf
+
+
+def check_algorithms(algorithms):
+    """Sjekker at hashlib kjenner alle algoritmene; ValueError ellers."""
+    for name in algorithms:
+        try:
+            hashlib.new(name)
+        except (ValueError, TypeError):
+            raise ValueError(f"Ukjent hash-algoritme: {name}") from None
+
+
+def hashlib_name(algorithm_name):
+    """'SHA-256', 'SHA256', 'sha256' o.l. -> 'sha256'; None hvis ukjent (se METS_CHECKSUMTYPES)."""
+    if not algorithm_name:
+        return None
+    name = algorithm_name.strip().lower().replace("-", "").replace("_", "")
+    return name if name in METS_CHECKSUMTYPES else None
+
+
+def in_sample(rel_path, buckets, slot):
+    """
+    Stabil fordeling av filer i buckets grupper basert på stien; en fil
+    kontrolleres når gruppen dens er slot. Over buckets kjøringer med
+    slot = 0 .. buckets-1 kontrolleres hver fil nøyaktig én gang.
+    """
+    if buckets <= 1:
+        return True
+    return zlib.crc32(rel_path.encode("utf-8", "surrogateescape")) % buckets == slot
+
+
+def sample_buckets(sample):
+    """Andel (0 < sample <= 1) -> antall grupper i rotasjonen."""
+    if not 0 < sample <= 1:
+        raise ValueError("sample må være større enn 0 og høyst 1")
+    return max(1, round(1 / sample))
+
+
+def hash_file(file_path, algorithm="sha256", chunk_size=DEFAULT_CHUNK_SIZE,
+              mmap_threshold=None):
+    """
+    Returnerer hex-sjekksum for en fil.
+
+    algorithm kan også være en tuple/liste av algoritmer. Da mates hver blokk
+    til alle digestene, og resultatet er en tuple med hex-sjekksummer i samme
+    rekkefølge (én lesing uansett antall algoritmer).
+
+    Leser med readinto() i en forhåndsallokert buffer. Filer større enn
+    mmap_threshold (bytes) hashes direkte fra et minnekart.
+    """
+    with open(file_path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size if mmap_threshold is not None else 0
+        if size and size >= mmap_threshold:
+            single = isinstance(algorithm, str)
+            digests = [hashlib.new(name) for name in ((algorithm,) if single else algorithm)]
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for digest in digests:
+                    digest.update(mm)
+            if single:
+                return digests[0].hexdigest()
+            return tuple(digest.hexdigest() for digest in digests)
+        return hash_stream(f, algorithm, chunk_size)
+
+
+def hash_stream(stream, algorithm="sha256", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Som hash_file, men for et åpent binært filobjekt (f.eks. et medlem i en
+    tar/zip-fil) som leses til slutten. Bruker readinto() når strømmen har det.
+    """
+    single = isinstance(algorithm, str)
+    digests = [hashlib.new(name) for name in ((algorithm,) if single else algorithm)]
+    readinto = getattr(stream, "readinto", None)
+    buf = _get_buffer(chunk_size)
+    while True:
+        if readinto is not None:
+            n = readinto(buf)
+            block = buf[:n] if n else None
+        else:
+            block = stream.read(chunk_size)
+        if not block:
+            break
+        for digest in digests:
+            digest.update(block)
+    if single:
+        return digests[0].hexdigest()
+    return tuple(digest.hexdigest() for digest in digests)
+
+
+# Innstillinger for prosess-arbeidere settes av _init_worker
+_worker_options = {}
+
+
+def _init_worker(options):
+    _worker_options.update(options)
+
+
+def _try_hash(hash_one, file_path):
+    """hash_one(file_path), eller OSError-unntaket i stedet for at det kastes."""
+    try:
+        return hash_one(file_path)
+    except OSError as e:
+        return e
+
+
+def _hash_in_worker(file_path):
+    return hash_file(file_path, **_worker_options)
+
+
+def _try_hash_in_worker(file_path):
+    return _try_hash(_hash_in_worker, file_path)
+
+
+def _hash_batch_in_worker(paths, keep_errors=False):
+    if keep_errors:
+        return [_try_hash(_hash_in_worker, file_path) for file_path in paths]
+    return [hash_file(file_path, **_worker_options) for file_path in paths]
+
+
+def _auto_mode(count, total_size):
+    """Prosesser for mange små filer (se AUTO_PROCESS_*), ellers tråder."""
+    if count >= AUTO_PROCESS_MIN_FILES and (os.cpu_count() or 1) > 1:
+        if total_size / count < AUTO_PROCESS_MAX_AVG_SIZE:
+            return "process"
+    return "thread"
+
+
+def _keep_errors(errors):
+    if errors not in ("raise", "return"):
+        raise ValueError(f"Ugyldig errors: {errors} (gyldige: raise, return)")
+    return errors == "return"
+
+
+class HashEngine:
+    """
+    Parallell hashing av mange filer med konfigurerbar modus og antall arbeidere.
+    Med algorithm som tuple returnerer map() en tuple med sjekksummer per fil.
+
+    Bruk som context manager:
+
+        with HashEngine(workers=8, mode="thread") as engine:
+            for checksum in engine.map(paths):
+                ...
+
+    imap() tar i stedet imot en (lat) iterator og holder køen begrenset.
+
+    Med errors="return" gir map() og imap() OSError-unntaket (manglende
+    tilgang, en katalog, en fil som forsvant underveis) i stedet for
+    sjekksummen for filen det gjelder, og resten av filene hashes som vanlig.
+    Standard er errors="raise".
+    """
+
+    def __init__(self, workers=None, mode="auto", chunk_size=DEFAULT_CHUNK_SIZE,
+                 algorithm="sha256", mmap_threshold=None):
+        if mode not in HASH_MODES:
+            raise ValueError(f"Ukjent hash-modus: {mode} (gyldige: {', '.join(HASH_MODES)})")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size må være større enn 0")
+        if not isinstance(algorithm, str):
+            algorithm = tuple(algorithm)
+        check_algorithms((algorithm,) if isinstance(algorithm, str) else algorithm)
+        self.workers = workers
+        self.mode = mode
+        self.options = {
+            "algorithm": algorithm,
+            "chunk_size": chunk_size,
+            "mmap_threshold": mmap_threshold,
+        }
+        self._executors = {}
+        self.last_mode = None
+
+    def resolve_mode(self, sizes=None):
+        """Velger tråder eller prosesser. sizes er filstørrelsene som skal hashes."""
+        if self.mode != "auto":
+            return self.mode
+        return _auto_mode(len(sizes), sum(sizes)) if sizes else "thread"
+
+    def _executor(self, mode):
+        if mode not in self._executors:
+            if mode == "process":
+                # Importeres først her: multiprocessing koster merkbart ved oppstart
+                from concurrent.futures import ProcessPoolExecutor
+                self._executors[mode] = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.options,),
+                )
+            else:
+                self._executors[mode] = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executors[mode]
+
+    def hash(self, file_path):
+        """Hasher én fil i kallende tråd."""
+        return hash_file(file_path, **self.options)
+
+    def _try_hash(self, file_path):
+        return _try_hash(self.hash, file_path)
+
+    def map(self, paths, sizes=None, errors="raise"):
+        """Hasher alle filer i paths og returnerer sjekksummene i samme rekkefølge."""
+        keep_errors = _keep_errors(errors)
+        mode = self.resolve_mode(sizes)
+        if mode == "process":
+            # Store batcher per IPC-kall holder overhead nede for små filer
+            workers = self.workers or os.cpu_count() or 1
+            batch = max(1, min(256, len(paths) // (workers * 4)))
+            task = _try_hash_in_worker if keep_errors else _hash_in_worker
+            return self._executor(mode).map(task, paths, chunksize=batch)
+        return self._executor(mode).map(self._try_hash if keep_errors else self.hash, paths)
+
+    def _hash_batch(self, paths, keep_errors=False):
+        hash_one = self._try_hash if keep_errors else self.hash
+        return [hash_one(file_path) for file_path in paths]
+
+    def imap(self, items, max_pending=None, errors="raise"):
+        """
+        Hasher (sti, størrelse, tag)-elementer fra en iterator, f.eks. en
+        katalogskanning som fortsatt pågår, og gir (tag, sjekksum) etter hvert
+        som filene blir ferdige (ikke i input-rekkefølge).
+
+        Høyst max_pending oppgaver ligger i kø om gangen (standard: 4 per
+        arbeider). Iteratoren leses bare når det er plass i køen, så
+        produsenten holdes igjen når hashingen ikke henger med, og minnebruken
+        er uavhengig av antall filer.
+
+        I auto-modus starter hashingen straks i tråder. Når
+        AUTO_PROCESS_MIN_FILES elementer er sett, velges modus ut fra dem
+        (som resolve_mode), og resten sendes eventuelt til prosesser; oppgaver
+        som allerede er sendt til trådene, fullføres der.
+        """
+        keep_errors = _keep_errors(errors)
+        items = iter(items)
+        deciding = self.mode == "auto"
+        seen_count = seen_size = 0
+
+        def configure(mode):
+            self.last_mode = mode
+            cpus = os.cpu_count() or 1
+            # Samme standard som ProcessPoolExecutor/ThreadPoolExecutor
+            workers = self.workers or (cpus if mode == "process" else min(32, cpus + 4))
+            if mode == "process":
+                return (self._executor(mode), max_pending or workers * PENDING_PER_WORKER,
+                        PROCESS_BATCH_SIZE, _hash_batch_in_worker)
+            return (self._executor(mode), max_pending or workers * PENDING_PER_WORKER,
+                    1, self._hash_batch)
+
+        executor, limit, batch_size, task = configure("thread" if deciding else self.mode)
+
+        pending = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < limit:
+                batch = list(itertools.islice(items, batch_size))
+                if not batch:
+                    exhausted = True
+                    break
+                future = executor.submit(task, [file_path for file_path, _, _ in batch], keep_errors)
+                pending[future] = [tag for _, _, tag in batch]
+                if deciding:
+                    seen_count += len(batch)
+                    seen_size += sum(size for _, size, _ in batch)
+                    if seen_count >= AUTO_PROCESS_MIN_FILES:
+                        deciding = False
+                        mode = _auto_mode(seen_count, seen_size)
+                        if mode != "thread":
+                            executor, limit, batch_size, task = configure(mode)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from zip(pending.pop(future), future.result())
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._executors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
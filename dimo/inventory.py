@@ -0,0 +1,315 @@
+"""Compact file inventory shared by `report` and `update-mets`.
+
+One parallel os.scandir walk produces a columnar manifest: directory paths are
+stored once in a prefix table, file names in a list, and sizes, mtimes and
+inodes in typed arrays. That is a small fraction of the memory a dict per file
+needs. The manifest can be saved to disk and loaded again, so a single walk can
+serve several commands in one session.
+
+A loaded inventory is only trusted as far as it can be checked cheaply: it is
+rejected (and the tree scanned again) when any directory's mtime has changed,
+which catches added, removed and renamed files, and every file is stat'ed
+again, which catches files modified in place.
+"""
+
+import json
+import os
+import stat
+import sys
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+INVENTORY_MAGIC = b"DIMOINV1\n"
+
+
+class FileRecord:
+    """
+    One file in an inventory. The st_* names match os.stat_result, so a
+    record can be used wherever only size/mtime/inode of a stat are needed.
+    """
+    __slots__ = ('rel_path', 'st_size', 'st_mtime_ns', 'st_ino')
+
+    def __init__(self, rel_path, st_size, st_mtime_ns, st_ino):
+        self.rel_path = rel_path
+        self.st_size = st_size
+        self.st_mtime_ns = st_mtime_ns
+        self.st_ino = st_ino
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+    @property
+    def name(self):
+        return os.path.basename(self.rel_path)
+
+
+class Inventory:
+    """Columnar list of all files below a root directory"""
+
+    def __init__(self, root):
+        self.root = root
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.dirs = []                  # relative directory paths ('' = root)
+        self.dir_mtimes_ns = array('q')  # per directory: mtime when it was listed
+        self.dir_index = array('I')     # per file: index into dirs
+        self.names = []                 # per file: file name
+        self.sizes = array('q')
+        self.mtimes_ns = array('q')
+        self.inodes = array('Q')
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_directory(self, rel_dir, mtime_ns=-1):
+        self.dirs.append(sys.intern(rel_dir))
+        self.dir_mtimes_ns.append(mtime_ns)
+        return len(self.dirs) - 1
+
+    def add(self, dir_idx, name, size, mtime_ns, inode):
+        self.dir_index.append(dir_idx)
+        self.names.append(name)
+        self.sizes.append(size)
+        self.mtimes_ns.append(mtime_ns)
+        self.inodes.append(inode)
+
+    def rel_path(self, i):
+        directory = self.dirs[self.dir_index[i]]
+        return os.path.join(directory, self.names[i]) if directory else self.names[i]
+
+    def full_path(self, i):
+        return os.path.join(self.root, self.rel_path(i))
+
+    def __iter__(self):
+        for i in range(len(self.names)):
+            yield FileRecord(self.rel_path(i), self.sizes[i], self.mtimes_ns[i], self.inodes[i])
+
+    def save(self, path):
+        """Write the inventory to path (header line + names + raw arrays)"""
+        names = "\0".join(self.names).encode("utf-8", "surrogateescape")
+        header = {
+            'root': self.root,
+            'created': self.created,
+            'count': len(self.names),
+            'dirs': self.dirs,
+            'dir_mtimes_ns': self.dir_mtimes_ns.tolist(),
+            'names_bytes': len(names),
+            'byteorder': sys.byteorder,
+            'errors': self.errors,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INVENTORY_MAGIC)
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(names)
+            for column in (self.dir_index, self.sizes, self.mtimes_ns, self.inodes):
+                column.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(INVENTORY_MAGIC)) != INVENTORY_MAGIC:
+                raise ValueError(f"Not a dimo inventory file: {path}")
+            header = json.loads(f.readline())
+            if header['byteorder'] != sys.byteorder:
+                raise ValueError(f"Inventory was written on a {header['byteorder']}-endian system")
+            inventory = cls(header['root'])
+            inventory.created = header['created']
+            inventory.errors = header['errors']
+            inventory.dirs = [sys.intern(d) for d in header['dirs']]
+            # Missing in inventories written before directory mtimes were kept;
+            # those never pass is_current()
+            inventory.dir_mtimes_ns = array('q', header.get('dir_mtimes_ns', ()))
+            count = header['count']
+            names = f.read(header['names_bytes']).decode("utf-8", "surrogateescape")
+            inventory.names = names.split("\0") if count else []
+            for column in (inventory.dir_index, inventory.sizes,
+                           inventory.mtimes_ns, inventory.inodes):
+                column.fromfile(f, count)
+        return inventory
+
+    def is_current(self, workers=None):
+        """
+        True if every directory still has the mtime it had when it was listed,
+        i.e. no file has been added, removed or renamed since.
+        """
+        if len(self.dir_mtimes_ns) != len(self.dirs):
+            return False
+
+        def unchanged(i):
+            try:
+                return os.stat(os.path.join(self.root, self.dirs[i])).st_mtime_ns == self.dir_mtimes_ns[i]
+            except OSError:
+                return False
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return all(executor.map(unchanged, range(len(self.dirs))))
+
+    def refresh(self, workers=None):
+        """
+        Stat every file again (in parallel, one task per directory), so
+        size/mtime/inode are current even for files modified in place. Files
+        that are gone, or no longer regular files, are dropped. Returns the
+        number of files that changed or were dropped.
+        """
+        ranges, start = [], 0
+        for i in range(1, len(self.names) + 1):
+            if i == len(self.names) or self.dir_index[i] != self.dir_index[start]:
+                ranges.append((start, i))
+                start = i
+
+        def stat_range(bounds):
+            stats = []
+            for i in range(*bounds):
+                try:
+                    st = os.stat(self.full_path(i))
+                except OSError:
+                    stats.append(None)
+                    continue
+                stats.append(st if stat.S_ISREG(st.st_mode) else None)
+            return stats
+
+        dir_index, names = array('I'), []
+        sizes, mtimes_ns, inodes = array('q'), array('q'), array('Q')
+        changed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for (first, _), stats in zip(ranges, executor.map(stat_range, ranges)):
+                for i, st in enumerate(stats, first):
+                    if st is None:
+                        changed += 1
+                        continue
+                    if (st.st_size, st.st_mtime_ns, st.st_ino) != \
+                            (self.sizes[i], self.mtimes_ns[i], self.inodes[i]):
+                        changed += 1
+                    dir_index.append(self.dir_index[i])
+                    names.append(self.names[i])
+                    sizes.append(st.st_size)
+                    mtimes_ns.append(st.st_mtime_ns)
+                    inodes.append(st.st_ino)
+        self.dir_index, self.names = dir_index, names
+        self.sizes, self.mtimes_ns, self.inodes = sizes, mtimes_ns, inodes
+        return changed
+
+
+def parallel_walk(root, scan_dir, workers=None):
+    """
+    Walk a tree with a thread pool, one task per directory.
+
+    scan_dir(rel_dir) must return (result, subdirs) where subdirs are paths
+    relative to root. Yields (rel_dir, result) as directories complete.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_dir, ''): ''}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                result, subdirs = future.result()
+                for subdir in subdirs:
+                    pending[executor.submit(scan_dir, subdir)] = subdir
+                yield rel_dir, result
+
+
+def iter_scan(root, workers=None, inventory=None):
+    """
+    Walk root and yield a FileRecord per file as soon as its directory has
+    been listed, so consumers can start while the walk is still running.
+    The files are also added to inventory if one is given.
+    """
+
+    def scan_dir(rel_dir):
+        dirpath = os.path.join(root, rel_dir) if rel_dir else root
+        files, subdirs, errors, mtime_ns = [], [], 0, -1
+        try:
+            # Before listing: a change during the walk makes the inventory stale
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(os.path.join(rel_dir, entry.name))
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files.append((entry.name, st.st_size, st.st_mtime_ns, st.st_ino))
+                    except OSError:
+                        errors += 1
+        except OSError:
+            errors += 1
+        return (files, errors, mtime_ns), subdirs
+
+    for rel_dir, (files, errors, mtime_ns) in parallel_walk(root, scan_dir, workers):
+        if inventory is not None:
+            inventory.errors += errors
+            # Also directories without files, so files added there are noticed
+            dir_idx = inventory.add_directory(rel_dir, mtime_ns)
+        for name, size, mtime_ns, inode in files:
+            if inventory is not None:
+                inventory.add(dir_idx, name, size, mtime_ns, inode)
+            yield FileRecord(os.path.join(rel_dir, name) if rel_dir else name,
+                             size, mtime_ns, inode)
+
+
+def scan_inventory(root, workers=None):
+    """Build an Inventory of root with one stat per file"""
+    inventory = Inventory(root)
+    for _ in iter_scan(root, workers, inventory):
+        pass
+    return inventory
+
+
+def _load_matching(root, inventory_path, workers=None):
+    """
+    The inventory saved at inventory_path if it was made for root and is still
+    current (see Inventory.is_current), with every file stat'ed again; else None.
+    """
+    if not inventory_path or not os.path.exists(inventory_path):
+        return None
+    try:
+        inventory = Inventory.load(inventory_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if os.path.abspath(inventory.root) != os.path.abspath(root):
+        return None
+    inventory.root = root
+    if not inventory.is_current(workers):
+        return None
+    if inventory.refresh(workers):
+        _save(inventory, inventory_path)
+    return inventory
+
+
+def _save(inventory, inventory_path):
+    saved_root, inventory.root = inventory.root, os.path.abspath(inventory.root)
+    inventory.save(inventory_path)
+    inventory.root = saved_root
+
+
+def load_or_scan(root, inventory_path=None, workers=None):
+    """
+    Load the inventory from inventory_path if it exists, was made for the
+    same root and is still current, otherwise scan root (and save to inventory_path if given).
+    """
+    inventory = _load_matching(root, inventory_path, workers)
+    if inventory is None:
+        inventory = scan_inventory(root, workers)
+        if inventory_path:
+            _save(inventory, inventory_path)
+    return inventory
+
+
+def iter_load_or_scan(root, inventory_path=None, workers=None):
+    """
+    Streaming variant of load_or_scan: yields FileRecords as soon as they are
+    known. A fresh scan is saved to inventory_path once the walk completes.
+    """
+    inventory = _load_matching(root, inventory_path, workers)
+    if inventory is not None:
+        yield from inventory
+        return
+    inventory = Inventory(root) if inventory_path else None
+    yield from iter_scan(root, workers, inventory)
+    if inventory_path:
+        _save(inventory, inventory_path)
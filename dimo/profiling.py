@@ -0,0 +1,147 @@
+"""Phase-level instrumentation for long-running DIMO commands.
+
+Code marks its phases with ``recorder.phase(name)``; each phase records wall
+and CPU time, peak memory and optionally files and bytes processed, from
+which files/s and MB/s are derived. The results can be written as a JSON
+metrics file or printed as a rich table. cProfile and tracemalloc capture are
+opt-in because of their overhead.
+"""
+
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far (None if unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Phase:
+    """Measurements for one phase. files/bytes_read may be set inside the block."""
+    __slots__ = ('name', 'wall_seconds', 'cpu_seconds', 'files', 'bytes_read',
+                 'peak_rss_bytes', 'peak_traced_bytes')
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.files = None
+        self.bytes_read = None
+        self.peak_rss_bytes = None
+        self.peak_traced_bytes = None
+
+    def to_dict(self):
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        wall = self.wall_seconds or 1e-9
+        if self.files is not None:
+            data['files_per_second'] = self.files / wall
+        if self.bytes_read is not None:
+            data['mb_per_second'] = self.bytes_read / wall / (1024 * 1024)
+        return data
+
+
+class PhaseRecorder:
+    """Collects Phase measurements; safe to use from several threads"""
+
+    def __init__(self, trace_memory=False):
+        self.phases = []
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        phase = Phase(name)
+        if self.trace_memory and tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield phase
+        finally:
+            phase.wall_seconds = time.perf_counter() - wall_start
+            # process_time covers all threads, so concurrent phases overlap
+            phase.cpu_seconds = time.process_time() - cpu_start
+            phase.peak_rss_bytes = peak_rss_bytes()
+            if self.trace_memory and tracemalloc.is_tracing():
+                phase.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+            with self._lock:
+                self.phases.append(phase)
+
+    def to_dict(self):
+        return {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'total_wall_seconds': time.perf_counter() - self._started,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'phases': [phase.to_dict() for phase in self.phases],
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def print_summary(self, console=None, title="Phase metrics"):
+        from rich.console import Console
+        from rich.table import Table
+
+        console = console or Console(stderr=True)
+        table = Table(title=title)
+        for column in ("Phase", "Wall (s)", "CPU (s)", "Files", "Files/s", "MB/s", "Peak RSS (MB)"):
+            if column == "Phase":
+                table.add_column(column, no_wrap=True)
+            else:
+                table.add_column(column, justify="right")
+        for phase in self.phases:
+            data = phase.to_dict()
+            table.add_row(
+                phase.name,
+                f"{phase.wall_seconds:.3f}",
+                f"{phase.cpu_seconds:.3f}",
+                f"{phase.files:,}" if phase.files is not None else "-",
+                f"{data['files_per_second']:,.0f}" if 'files_per_second' in data else "-",
+                f"{data['mb_per_second']:,.1f}" if 'mb_per_second' in data else "-",
+                f"{phase.peak_rss_bytes / (1024 * 1024):,.0f}" if phase.peak_rss_bytes else "-",
+            )
+        console.print(table)
+
+
+@contextmanager
+def profile_session(metrics_path=None, cprofile_path=None, trace_memory=False, summary=True):
+    """
+    Run a block with a PhaseRecorder and optional cProfile/tracemalloc capture.
+    On exit the metrics are written to metrics_path (JSON), the cProfile stats
+    to cprofile_path, and a summary table is printed to stderr.
+    """
+    recorder = PhaseRecorder(trace_memory=trace_memory)
+    profiler = cProfile.Profile() if cprofile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield recorder
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        if trace_memory:
+            tracemalloc.stop()
+        if metrics_path:
+            recorder.write_json(metrics_path)
+        if summary and recorder.phases:
+            recorder.print_summary()
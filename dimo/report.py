@@ -1,89 +1,476 @@
+import heapq
+import html
+import json
 import os
-from collections import Counter, defaultdict
-from pathlib import Path
+from collections import Counter
 from datetime import datetime
 
-def generate_report(path=".", format="text"):
+from dimo.archive import archive_records, is_archive
+from dimo.inventory import load_or_scan, parallel_walk
+from dimo.profiling import PhaseRecorder
+
+# Define size ranges in bytes
+SIZE_RANGES = [
+    (0, 1024, "0-1KB"),
+    (1024, 1024*1024, "1KB-1MB"),
+    (1024*1024, 1024*1024*1024, "1MB-1GB"),
+    (1024*1024*1024, float('inf'), ">1GB")
+]
+
+TOP_LARGEST = 10
+TOP_NEWEST = 5
+TOP_OLDEST = 5
+
+SNAPSHOT_VERSION = 1
+
+
+class ReportCollector:
+    """
+    Accumulates report statistics with bounded memory: counters plus
+    fixed-size heaps for the top-N lists. Collectors from different
+    directories/threads are combined with merge().
+    """
+    __slots__ = ('total_files', 'total_size', 'extensions', 'size_ranges',
+                 'largest', 'newest', 'oldest', 'errors')
+
+    def __init__(self):
+        self.total_files = 0
+        self.total_size = 0
+        self.extensions = Counter()
+        self.size_ranges = Counter()
+        self.largest = []  # min-heap of (size, path)
+        self.newest = []   # min-heap of (mtime, path)
+        self.oldest = []   # min-heap of (-mtime, path)
+        self.errors = 0
+
+    def add(self, path, name, size, mtime):
+        self.total_files += 1
+        self.total_size += size
+        self.extensions[_suffix(name).lower() or 'no_extension'] += 1
+
+        # Categorize by size range
+        for start, end, label in SIZE_RANGES:
+            if start <= size < end:
+                self.size_ranges[label] += 1
+                break
+
+        _push_bounded(self.largest, (size, path), TOP_LARGEST)
+        _push_bounded(self.newest, (mtime, path), TOP_NEWEST)
+        _push_bounded(self.oldest, (-mtime, path), TOP_OLDEST)
+
+    def merge(self, other):
+        self.total_files += other.total_files
+        self.total_size += other.total_size
+        self.extensions.update(other.extensions)
+        self.size_ranges.update(other.size_ranges)
+        for item in other.largest:
+            _push_bounded(self.largest, item, TOP_LARGEST)
+        for item in other.newest:
+            _push_bounded(self.newest, item, TOP_NEWEST)
+        for item in other.oldest:
+            _push_bounded(self.oldest, item, TOP_OLDEST)
+        self.errors += other.errors
+
+    def to_dict(self):
+        return {
+            'total_files': self.total_files,
+            'total_size': self.total_size,
+            'extensions': dict(self.extensions),
+            'size_ranges': dict(self.size_ranges),
+            'largest': self.largest,
+            'newest': self.newest,
+            'oldest': self.oldest,
+            'errors': self.errors
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        collector = cls()
+        collector.total_files = data['total_files']
+        collector.total_size = data['total_size']
+        collector.extensions = Counter(data['extensions'])
+        collector.size_ranges = Counter(data['size_ranges'])
+        # JSON turns tuples into lists; heaps compare items, so convert back
+        collector.largest = [tuple(item) for item in data['largest']]
+        collector.newest = [tuple(item) for item in data['newest']]
+        collector.oldest = [tuple(item) for item in data['oldest']]
+        collector.errors = data['errors']
+        return collector
+
+    def largest_files(self):
+        return sorted(self.largest, reverse=True)
+
+    def newest_files(self):
+        return sorted(self.newest, reverse=True)
+
+    def oldest_files(self):
+        return [(path, -neg_mtime) for neg_mtime, path in sorted(self.oldest, reverse=True)]
+
+
+def _push_bounded(heap, item, limit):
+    if len(heap) < limit:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def _suffix(name):
+    """Same result as Path(name).suffix, without building a Path"""
+    i = name.rfind('.')
+    if 0 < i < len(name) - 1:
+        return name[i:]
+    return ''
+
+
+def _scan_one_directory(root, rel, previous=None):
+    """
+    List one directory with os.scandir. Returns the statistics for the files
+    in it, the subdirectories still to be scanned (relative to root) and the
+    snapshot record for the directory.
+
+    If previous (a snapshot's directory records) has an entry for this
+    directory with the same mtime, the directory is not listed again and the
+    stored aggregates are reused. A directory's mtime changes when entries
+    are added, removed or renamed, not when a file is rewritten in place.
+    """
+    dirpath = os.path.join(root, rel) if rel else root
+    collector = ReportCollector()
+    try:
+        mtime_ns = os.stat(dirpath).st_mtime_ns
+    except OSError:
+        collector.errors += 1
+        return collector, [], None
+
+    record = previous.get(rel) if previous else None
+    if record is not None and record['mtime_ns'] == mtime_ns:
+        subdirs = [os.path.join(rel, name) for name in record['subdirs']]
+        return ReportCollector.from_dict(record['stats']), subdirs, record
+
+    subdir_names = []
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdir_names.append(entry.name)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        collector.add(entry.path, entry.name, st.st_size, st.st_mtime)
+                except OSError:
+                    collector.errors += 1
+    except OSError:
+        collector.errors += 1
+    record = {'mtime_ns': mtime_ns, 'subdirs': subdir_names, 'stats': collector.to_dict()}
+    return collector, [os.path.join(rel, name) for name in subdir_names], record
+
+
+def scan_directory(path, workers=None, previous=None, directories=None):
+    """
+    Walk the tree under path with a thread pool (one task per directory) and
+    return a merged ReportCollector. Each file is stat'ed once.
+
+    previous: directory records from an earlier snapshot; unchanged
+    directories are taken from it instead of being listed again.
+    directories: optional dict that receives the per-directory records
+    (relative path -> record) for a new snapshot.
+    """
+    def scan_dir(rel):
+        collector, subdirs, record = _scan_one_directory(path, rel, previous)
+        return (collector, record), subdirs
+
+    result = ReportCollector()
+    for rel, (collector, record) in parallel_walk(path, scan_dir, workers):
+        result.merge(collector)
+        if directories is not None and record is not None:
+            directories[rel] = record
+    return result
+
+
+def collect_from_inventory(inventory):
+    """Build a ReportCollector from an Inventory instead of walking the tree"""
+    collector = ReportCollector()
+    collector.errors = inventory.errors
+    for i, name in enumerate(inventory.names):
+        collector.add(inventory.full_path(i), name, inventory.sizes[i],
+                      inventory.mtimes_ns[i] / 1e9)
+    return collector
+
+
+def collect_from_archive(archive_path):
+    """
+    Build a ReportCollector from the member headers of a tar or zip file,
+    without extracting it. Like update-mets, only the files below content/
+    are counted when the archive contains a content/ directory.
+    """
+    content, other = ReportCollector(), ReportCollector()
+    for in_content, rel_path, size, mtime in archive_records(archive_path):
+        (content if in_content else other).add(rel_path, os.path.basename(rel_path), size, mtime)
+    return content if content.total_files else other
+
+
+def load_snapshot(snapshot_path, root):
+    """Load a report snapshot, or None if it is missing or was taken of another tree"""
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        return None
+    try:
+        with open(snapshot_path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('root') != root:
+        return None
+    return snapshot
+
+
+def save_snapshot(snapshot_path, snapshot):
+    """Write the snapshot atomically (temp file + rename)"""
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp_path, snapshot_path)
+
+
+def diff_snapshots(previous, current, limit=100):
+    """Compare two snapshots: total deltas plus added/removed/changed directories"""
+    prev_dirs = previous['directories']
+    cur_dirs = current['directories']
+    prev_totals = previous['totals']
+    cur_totals = current['totals']
+
+    extensions = Counter(cur_totals['extensions'])
+    extensions.subtract(prev_totals['extensions'])
+    added = sorted(set(cur_dirs) - set(prev_dirs))
+    removed = sorted(set(prev_dirs) - set(cur_dirs))
+    changed = sorted(rel for rel in set(cur_dirs) & set(prev_dirs)
+                     if cur_dirs[rel]['mtime_ns'] != prev_dirs[rel]['mtime_ns'])
+
+    def _dir_delta(rel):
+        old = prev_dirs.get(rel, {}).get('stats', {})
+        new = cur_dirs.get(rel, {}).get('stats', {})
+        return {
+            'directory': rel or '.',
+            'files_delta': new.get('total_files', 0) - old.get('total_files', 0),
+            'size_delta': new.get('total_size', 0) - old.get('total_size', 0)
+        }
+
+    return {
+        'previous_created': previous['created'],
+        'files_delta': cur_totals['total_files'] - prev_totals['total_files'],
+        'size_delta': cur_totals['total_size'] - prev_totals['total_size'],
+        'extensions_delta': {ext: delta for ext, delta in extensions.items() if delta},
+        'directories_added': len(added),
+        'directories_removed': len(removed),
+        'directories_changed': len(changed),
+        'changes': [_dir_delta(rel) for rel in (added + removed + changed)[:limit]]
+    }
+
+
+def generate_report(path=".", format="text", workers=None, snapshot=None, inventory=None,
+                    profiler=None):
     """
     Generate a report about files and content in the specified directory
+
+    If snapshot is a file path, per-directory aggregates are loaded from it
+    (when present) so only directories whose mtime changed are listed again,
+    the report includes a diff against it, and a new snapshot is saved.
+
+    If inventory is a file path, the shared file inventory (see
+    dimo.inventory) is loaded from it, or created and saved there.
+
+    path may also be a tar or zip file; the report then covers its members
+    (see collect_from_archive). Snapshots and inventories need a directory.
+
+    profiler is an optional dimo.profiling.PhaseRecorder that receives timings
+    for the scan, snapshot and output phases.
+
+    Returns the report as plain data (as in the JSON format); format=None
+    only returns it without printing anything.
     """
+    if snapshot and inventory:
+        raise ValueError("Use either a snapshot or an inventory, not both")
+    archive = is_archive(path)
+    if archive and (snapshot or inventory):
+        raise ValueError("Snapshots and inventories are not supported for tar/zip files")
+    profiler = profiler or PhaseRecorder()
+    root = os.path.abspath(path)
+    with profiler.phase("load_snapshot"):
+        previous = load_snapshot(snapshot, root)
+    directories = {} if snapshot else None
+    with profiler.phase("scan") as phase:
+        if archive:
+            collector = collect_from_archive(path)
+        elif inventory:
+            collector = collect_from_inventory(load_or_scan(path, inventory, workers))
+        else:
+            collector = scan_directory(
+                root if snapshot else path,
+                workers=workers,
+                previous=previous['directories'] if previous else None,
+                directories=directories
+            )
+        phase.files = collector.total_files
     stats = {
-        'total_files': 0,
-        'total_size': 0,
-        'extensions': Counter(),
-        'size_ranges': defaultdict(int),
-        'largest_files': [],
-        'newest_files': [],
-        'oldest_files': []
+        'total_files': collector.total_files,
+        'total_size': collector.total_size,
+        'extensions': collector.extensions,
+        'size_ranges': {label: collector.size_ranges[label]
+                        for _, _, label in SIZE_RANGES if collector.size_ranges[label]},
+        'largest_files': [(filepath, size) for size, filepath in collector.largest_files()],
+        'newest_files': [(filepath, mtime) for mtime, filepath in collector.newest_files()],
+        'oldest_files': collector.oldest_files()
     }
-    
-    # Define size ranges in bytes
-    size_ranges = [
-        (0, 1024, "0-1KB"),
-        (1024, 1024*1024, "1KB-1MB"),
-        (1024*1024, 1024*1024*1024, "1MB-1GB"),
-        (1024*1024*1024, float('inf'), ">1GB")
-    ]
-    
-    # Collect statistics
-    for filepath in Path(path).rglob('*'):
-        if filepath.is_file():
-            file_size = filepath.stat().st_size
-            file_time = filepath.stat().st_mtime
-            
-            stats['total_files'] += 1
-            stats['total_size'] += file_size
-            stats['extensions'][filepath.suffix.lower() or 'no_extension'] += 1
-            
-            # Categorize by size range
-            for start, end, label in size_ranges:
-                if start <= file_size < end:
-                    stats['size_ranges'][label] += 1
-                    break
-            
-            # Track largest files (keep top 10)
-            stats['largest_files'].append((filepath, file_size))
-            stats['largest_files'].sort(key=lambda x: x[1], reverse=True)
-            stats['largest_files'] = stats['largest_files'][:10]
-            
-            # Track newest and oldest files
-            stats['newest_files'].append((filepath, file_time))
-            stats['oldest_files'].append((filepath, file_time))
-            
-    stats['newest_files'].sort(key=lambda x: x[1], reverse=True)
-    stats['oldest_files'].sort(key=lambda x: x[1])
-    stats['newest_files'] = stats['newest_files'][:5]
-    stats['oldest_files'] = stats['oldest_files'][:5]
-            
+
+    diff = None
+    if snapshot:
+        previous_dirs = previous['directories'] if previous else {}
+        current = {
+            'version': SNAPSHOT_VERSION,
+            'root': root,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'totals': {
+                'total_files': collector.total_files,
+                'total_size': collector.total_size,
+                'extensions': dict(collector.extensions),
+                'size_ranges': dict(collector.size_ranges)
+            },
+            'directories': directories
+        }
+        stats['directories_rescanned'] = sum(
+            1 for rel, record in directories.items() if previous_dirs.get(rel) is not record
+        )
+        stats['directories_total'] = len(directories)
+        with profiler.phase("save_snapshot"):
+            if previous:
+                diff = diff_snapshots(previous, current)
+            save_snapshot(snapshot, current)
+
     # Output report based on format
-    if format == "text":
-        print("\n=== Directory Analysis Report ===")
-        print(f"Path: {path}")
-        print(f"Report generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print("\n=== Summary ===")
-        print(f"Total Files: {stats['total_files']:,}")
-        print(f"Total Size: {_format_size(stats['total_size'])}")
-        
-        print("\n=== File Sizes ===")
-        for label, count in stats['size_ranges'].items():
-            percentage = (count / stats['total_files'] * 100) if stats['total_files'] > 0 else 0
-            print(f"{label}: {count:,} files ({percentage:.1f}%)")
-        
-        print("\n=== File Extensions ===")
-        for ext, count in stats['extensions'].most_common(10):
-            percentage = (count / stats['total_files'] * 100)
-            print(f"{ext}: {count:,} files ({percentage:.1f}%)")
-        
-        print("\n=== Largest Files ===")
-        for filepath, size in stats['largest_files'][:5]:
-            print(f"{filepath.name}: {_format_size(size)}")
-        
-        print("\n=== Newest Files ===")
-        for filepath, mtime in stats['newest_files'][:5]:
-            timestamp = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
-            print(f"{filepath.name}: {timestamp}")
-    
-    # TODO: Implement JSON and HTML output formats
+    report = _report_dict(path, stats, diff)
+    with profiler.phase("render"):
+        if format == "json":
+            print(json.dumps(report, indent=2))
+        elif format == "html":
+            print(_render_html(report))
+        elif format is not None:
+            _print_text(path, stats, diff)
+    return report
+
+
+def _report_dict(path, stats, diff):
+    """Report as plain data (used for the JSON and HTML formats)"""
+    timestamp = lambda mtime: datetime.fromtimestamp(mtime).isoformat(timespec='seconds')
+    report = {
+        'path': path,
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'total_files': stats['total_files'],
+        'total_size': stats['total_size'],
+        'size_ranges': stats['size_ranges'],
+        'extensions': dict(stats['extensions'].most_common()),
+        'largest_files': [{'path': p, 'size': size} for p, size in stats['largest_files']],
+        'newest_files': [{'path': p, 'mtime': timestamp(m)} for p, m in stats['newest_files']],
+        'oldest_files': [{'path': p, 'mtime': timestamp(m)} for p, m in stats['oldest_files']]
+    }
+    if 'directories_total' in stats:
+        report['directories_total'] = stats['directories_total']
+        report['directories_rescanned'] = stats['directories_rescanned']
+    if diff is not None:
+        report['diff'] = diff
+    return report
+
+
+def _print_text(path, stats, diff):
+    print("\n=== Directory Analysis Report ===")
+    print(f"Path: {path}")
+    print(f"Report generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("\n=== Summary ===")
+    print(f"Total Files: {stats['total_files']:,}")
+    print(f"Total Size: {_format_size(stats['total_size'])}")
+    if 'directories_total' in stats:
+        print(f"Directories rescanned: {stats['directories_rescanned']:,} "
+              f"of {stats['directories_total']:,}")
+
+    print("\n=== File Sizes ===")
+    for label, count in stats['size_ranges'].items():
+        percentage = (count / stats['total_files'] * 100) if stats['total_files'] > 0 else 0
+        print(f"{label}: {count:,} files ({percentage:.1f}%)")
+
+    print("\n=== File Extensions ===")
+    for ext, count in stats['extensions'].most_common(10):
+        percentage = (count / stats['total_files'] * 100)
+        print(f"{ext}: {count:,} files ({percentage:.1f}%)")
+
+    print("\n=== Largest Files ===")
+    for filepath, size in stats['largest_files'][:5]:
+        print(f"{os.path.basename(filepath)}: {_format_size(size)}")
+
+    print("\n=== Newest Files ===")
+    for filepath, mtime in stats['newest_files'][:5]:
+        timestamp = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{os.path.basename(filepath)}: {timestamp}")
+
+    if diff is not None:
+        print(f"\n=== Changes since {diff['previous_created']} ===")
+        print(f"Files: {diff['files_delta']:+,}")
+        print(f"Size: {'-' if diff['size_delta'] < 0 else '+'}{_format_size(abs(diff['size_delta']))}")
+        print(f"Directories added: {diff['directories_added']:,}, "
+              f"removed: {diff['directories_removed']:,}, "
+              f"changed: {diff['directories_changed']:,}")
+        for ext, delta in sorted(diff['extensions_delta'].items(), key=lambda x: -abs(x[1]))[:10]:
+            print(f"{ext}: {delta:+,} files")
+
+
+def _render_html(report):
+    """Render the report dict as a standalone HTML page"""
+    esc = lambda value: html.escape(str(value))
+
+    def table(headers, rows):
+        head = "".join(f"<th>{esc(h)}</th>" for h in headers)
+        body = "".join(
+            "<tr>" + "".join(f"<td>{esc(cell)}</td>" for cell in row) + "</tr>" for row in rows
+        )
+        return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+    total = report['total_files'] or 1
+    parts = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset=\"utf-8\"><title>Directory Analysis Report</title>",
+        "<style>body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:1em}"
+        "td,th{border:1px solid #ccc;padding:2px 8px;text-align:left}</style></head><body>",
+        f"<h1>Directory Analysis Report</h1><p>Path: {esc(report['path'])}<br>"
+        f"Report generated: {esc(report['generated'])}</p>",
+        "<h2>Summary</h2>",
+        table(["Total files", "Total size"],
+              [[f"{report['total_files']:,}", _format_size(report['total_size'])]]),
+        "<h2>File Sizes</h2>",
+        table(["Range", "Files", "%"],
+              [[label, f"{count:,}", f"{count / total * 100:.1f}"]
+               for label, count in report['size_ranges'].items()]),
+        "<h2>File Extensions</h2>",
+        table(["Extension", "Files", "%"],
+              [[ext, f"{count:,}", f"{count / total * 100:.1f}"]
+               for ext, count in list(report['extensions'].items())[:25]]),
+        "<h2>Largest Files</h2>",
+        table(["Path", "Size"], [[f['path'], _format_size(f['size'])] for f in report['largest_files']]),
+        "<h2>Newest Files</h2>",
+        table(["Path", "Modified"], [[f['path'], f['mtime']] for f in report['newest_files']]),
+        "<h2>Oldest Files</h2>",
+        table(["Path", "Modified"], [[f['path'], f['mtime']] for f in report['oldest_files']]),
+    ]
+    diff = report.get('diff')
+    if diff is not None:
+        parts += [
+            f"<h2>Changes since {esc(diff['previous_created'])}</h2>",
+            table(["Files", "Size (bytes)", "Dirs added", "Dirs removed", "Dirs changed"],
+                  [[f"{diff['files_delta']:+,}", f"{diff['size_delta']:+,}",
+                    diff['directories_added'], diff['directories_removed'],
+                    diff['directories_changed']]]),
+            table(["Directory", "Files", "Size (bytes)"],
+                  [[c['directory'], f"{c['files_delta']:+,}", f"{c['size_delta']:+,}"]
+                   for c in diff['changes']]),
+        ]
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
 
 def _format_size(size):
     """Convert size in bytes to human readable format"""
@@ -1,7 +1,8 @@
 from typing import Dict, Any, Optional
 from .tester.n5.test_n5 import run_n5_test
 
-def run_test(standard: str, test_name: Optional[str] = None, path: str = ".") -> Dict[str, Any]:
+def run_test(standard: str, test_name: Optional[str] = None, path: str = ".",
+             profiler=None, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Run validation tests for different standards
     
@@ -9,12 +10,15 @@ def run_test(standard: str, test_name: Optional[str] = None, path: str = ".") ->
         standard (str): The standard to test against (noark3, noark4, noark5, siard, fagsystem)
         test_name (str, optional): Specific test to run (e.g., '01', 'all'). Defaults to None.
         path (str): Path to the directory containing files to test. Defaults to "."
+        profiler (PhaseRecorder, optional): Receives per-phase metrics (see dimo.profiling)
+        options (dict, optional): Test options, e.g. sample, sample_slot, limit,
+            hash_workers and hash_mode for the N5 fixity test (07)
         
     Returns:
         Dict[str, Any]: Test results in a standardized format
     """
     if standard == "n5":
-        return run_n5_test(test_name)
+        return run_n5_test(test_name, profiler=profiler, options=options)
     else:
         raise NotImplementedError(f"Tests for {standard} are not yet implemented")
         
@@ -0,0 +1,85 @@
+"""Streaming visitor engine for XML-based archive tests.
+
+A single ``iterparse`` pass over a file dispatches start/end events to every
+registered visitor. Elements are cleared and detached as soon as they end, so
+memory stays flat no matter how large the file is. Visitors therefore see one
+element at a time and keep whatever state they need themselves.
+"""
+
+import xml.etree.ElementTree as ET
+import pathlib as pl
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+
+def local_name(tag: str) -> str:
+    """Strip the namespace from an ElementTree tag"""
+    return tag.rpartition('}')[2]
+
+
+class Visitor:
+    """Base class for tests that run inside the streaming engine.
+
+    ``start_tags``/``end_tags`` name the (local) tags the visitor wants to be
+    called for; ``None`` means every element. On ``start`` only the tag and
+    attributes are available, text is complete on ``end``.
+    """
+    start_tags: Optional[FrozenSet[str]] = frozenset()
+    end_tags: Optional[FrozenSet[str]] = frozenset()
+
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        pass
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        pass
+
+    def result(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+def _dispatch_table(visitors: Iterable[Visitor], attr: str):
+    table = defaultdict(list)
+    wildcard = []
+    for visitor in visitors:
+        tags = getattr(visitor, f"{attr}_tags")
+        handler = getattr(visitor, attr)
+        if tags is None:
+            wildcard.append(handler)
+        else:
+            for tag in tags:
+                table[tag].append(handler)
+    return table, wildcard
+
+
+def run_visitors(xml_path: pl.Path, visitors: List[Visitor]) -> None:
+    """Stream ``xml_path`` once and feed every event to the given visitors.
+
+    ``path`` passed to the visitors is the list of ancestor local names of the
+    current element (not including the element itself).
+    """
+    start_table, start_all = _dispatch_table(visitors, "start")
+    end_table, end_all = _dispatch_table(visitors, "end")
+    no_handlers = ()
+
+    path: List[str] = []
+    elems: List[ET.Element] = []
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        tag = local_name(elem.tag)
+        if event == "start":
+            for handler in start_table.get(tag, no_handlers):
+                handler(tag, elem, path)
+            for handler in start_all:
+                handler(tag, elem, path)
+            path.append(tag)
+            elems.append(elem)
+        else:
+            path.pop()
+            elems.pop()
+            for handler in end_table.get(tag, no_handlers):
+                handler(tag, elem, path)
+            for handler in end_all:
+                handler(tag, elem, path)
+            # The finished element is always the last child of its parent
+            elem.clear()
+            if elems:
+                del elems[-1][-1]
@@ -0,0 +1,165 @@
+"""Columnar date analytics for the N5 date tests (03 and 05).
+
+Dates are stored as ``yyyymmdd`` integers in a typed array instead of one
+string per record. They are parsed from the first ten characters, so both
+xs:date and xs:dateTime values work. Everything after that runs over
+distinct days: counting the array is a single ``Counter`` call (done in C),
+and period checks, histograms, gaps and spikes touch each distinct day
+once, so the Python work grows with the time span, not the record count.
+
+A value may carry a group number (e.g. the arkivdel it belongs to), packed
+into the same integer, so per-group distributions come from the same count.
+"""
+
+from array import array
+from collections import Counter
+from datetime import date
+from statistics import median
+from typing import Any, Dict, List, Optional
+
+# key = group * GROUP_BASE + yyyymmdd
+GROUP_BASE = 10 ** 8
+
+# Gaps between consecutive dates longer than this are reported
+GAP_MIN_DAYS = 31
+MAX_GAPS = 10
+# A month is a spike when it has more than SPIKE_FACTOR x the median month
+SPIKE_FACTOR = 3.0
+SPIKE_MIN_COUNT = 10
+
+
+def date_key(text: Optional[str]) -> int:
+    """``'2021-03-04'`` / ``'2021-03-04T10:00:00'`` -> 20210304; 0 if not a date"""
+    if not text:
+        return 0
+    if len(text) != 10:
+        text = text.strip()
+    if len(text) < 10 or text[4] != '-' or text[7] != '-':
+        return 0
+    digits = text[0:4] + text[5:7] + text[8:10]
+    return int(digits) if digits.isdecimal() else 0
+
+
+def _is_valid(key: int) -> bool:
+    try:
+        date(key // 10000, key // 100 % 100, key % 100)
+    except ValueError:
+        return False
+    return True
+
+
+def format_day(key: int) -> str:
+    return f"{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}"
+
+
+def format_month(key: int) -> str:
+    return f"{key // 10000:04d}-{key // 100 % 100:02d}"
+
+
+class DateColumn:
+    """Dates of one kind (e.g. every journaldato) as packed integers"""
+    __slots__ = ('keys', 'unparsed')
+
+    def __init__(self):
+        self.keys = array('q')
+        self.unparsed = 0
+
+    def __len__(self) -> int:
+        return len(self.keys) + self.unparsed
+
+    def append(self, text: Optional[str], group: int = 0, count: int = 1) -> None:
+        key = date_key(text)
+        if key and count == 1:
+            self.keys.append(group * GROUP_BASE + key)
+        elif key:
+            self.keys.extend([group * GROUP_BASE + key] * count)
+        else:
+            self.unparsed += count
+
+    def grouped_counts(self) -> Dict[int, Counter]:
+        """{group: Counter(yyyymmdd -> count)} over valid dates"""
+        groups: Dict[int, Counter] = {}
+        valid: Dict[int, bool] = {}
+        for key, count in Counter(self.keys).items():
+            group, day = divmod(key, GROUP_BASE)
+            if day not in valid:
+                valid[day] = _is_valid(day)
+            if valid[day]:
+                groups.setdefault(group, Counter())[day] += count
+        return groups
+
+    def day_counts(self) -> Counter:
+        """Counter(yyyymmdd -> count) over valid dates, all groups together"""
+        return merge_counts(self.grouped_counts())
+
+    def invalid(self, day_counts: Counter) -> int:
+        """Values that were not a valid date, given this column's day_counts()"""
+        return len(self) - sum(day_counts.values())
+
+
+def merge_counts(grouped: Dict[int, Counter]) -> Counter:
+    total: Counter = Counter()
+    for counts in grouped.values():
+        total.update(counts)
+    return total
+
+
+def count_in_period(day_counts: Counter, start: int, end: int) -> int:
+    return sum(count for day, count in day_counts.items() if start <= day <= end)
+
+
+def by_year(day_counts: Counter) -> Dict[int, int]:
+    years: Counter = Counter()
+    for day, count in day_counts.items():
+        years[day // 10000] += count
+    return dict(sorted(years.items()))
+
+
+def by_month(day_counts: Counter) -> Dict[str, int]:
+    months: Counter = Counter()
+    for day, count in day_counts.items():
+        months[day // 100] += count
+    return {format_month(month * 100): count for month, count in sorted(months.items())}
+
+
+def gaps(day_counts: Counter, min_days: int = GAP_MIN_DAYS,
+         limit: int = MAX_GAPS) -> List[Dict[str, Any]]:
+    """The longest stretches without any date, longest first"""
+    days = sorted(day_counts)
+    ordinals = [date(day // 10000, day // 100 % 100, day % 100).toordinal() for day in days]
+    found = [
+        {'from': format_day(days[i - 1]), 'to': format_day(days[i]),
+         'days': ordinals[i] - ordinals[i - 1]}
+        for i in range(1, len(days)) if ordinals[i] - ordinals[i - 1] > min_days
+    ]
+    found.sort(key=lambda gap: -gap['days'])
+    return found[:limit]
+
+
+def spikes(day_counts: Counter, factor: float = SPIKE_FACTOR,
+           min_count: int = SPIKE_MIN_COUNT) -> List[Dict[str, Any]]:
+    """Months with far more dates than the median month, in calendar order"""
+    months = by_month(day_counts)
+    if len(months) < 2:
+        return []
+    typical = median(months.values())
+    return [
+        {'month': month, 'count': count, 'median': typical}
+        for month, count in months.items()
+        if count >= min_count and count > factor * typical
+    ]
+
+
+def date_profile(day_counts: Counter) -> Dict[str, Any]:
+    """First/last date, per-year and per-month histograms, gaps and spikes"""
+    if not day_counts:
+        return {'first_date': None, 'last_date': None, 'dates_by_year': {},
+                'dates_by_month': {}, 'gaps': [], 'spikes': []}
+    return {
+        'first_date': format_day(min(day_counts)),
+        'last_date': format_day(max(day_counts)),
+        'dates_by_year': by_year(day_counts),
+        'dates_by_month': by_month(day_counts),
+        'gaps': gaps(day_counts),
+        'spikes': spikes(day_counts),
+    }
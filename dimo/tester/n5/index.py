@@ -0,0 +1,349 @@
+"""Persistent SQLite index of an N5 extraction.
+
+``dimo index n5`` streams arkivstruktur.xml and endringslogg.xml once and
+stores arkivdel/klasse/mappe/registrering/dokumentobjekt/endring rows in
+``logs/n5_index.sqlite``. The index records the size, mtime and SHA-256 of
+both source files and is only used while they are unchanged, so repeated
+test runs and ad-hoc queries do not have to re-parse the XML.
+"""
+
+import sqlite3
+import pathlib as pl
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ...hashing import hash_file
+from ..engine import Visitor, run_visitors
+
+INDEX_FILENAME = "n5_index.sqlite"
+
+# Bumped whenever the table layout changes; older indexes are rebuilt.
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE arkivdel (
+    id INTEGER PRIMARY KEY, system_id TEXT, opprettet_dato TEXT, avsluttet_dato TEXT);
+CREATE TABLE klasse (
+    id INTEGER PRIMARY KEY, arkivdel_id INTEGER, system_id TEXT, opprettet_dato TEXT);
+CREATE TABLE mappe (
+    id INTEGER PRIMARY KEY, arkivdel_id INTEGER, system_id TEXT, opprettet_dato TEXT);
+CREATE TABLE registrering (
+    id INTEGER PRIMARY KEY, arkivdel_id INTEGER, mappe_id INTEGER, system_id TEXT,
+    tittel TEXT, journalposttype TEXT, journaldato TEXT);
+CREATE TABLE dokumentobjekt (
+    id INTEGER PRIMARY KEY, registrering_id INTEGER, seq INTEGER, format TEXT,
+    filstoerrelse TEXT, referanse_dokumentfil TEXT, sjekksum TEXT, sjekksum_algoritme TEXT);
+CREATE TABLE endring (id INTEGER PRIMARY KEY, referanse_arkivenhet TEXT);
+CREATE INDEX registrering_system_id ON registrering (system_id);
+CREATE INDEX dokumentobjekt_registrering ON dokumentobjekt (registrering_id, seq);
+"""
+
+# Entity tag -> (table, {descendant tag: column}). As with find('.//tag'),
+# the first descendant with a given tag wins.
+ENTITIES = {
+    'arkivdel': ('arkivdel', {
+        'systemID': 'system_id',
+        'opprettetDato': 'opprettet_dato',
+        'avsluttetDato': 'avsluttet_dato',
+    }),
+    'klasse': ('klasse', {
+        'systemID': 'system_id',
+        'opprettetDato': 'opprettet_dato',
+    }),
+    'mappe': ('mappe', {
+        'systemID': 'system_id',
+        'opprettetDato': 'opprettet_dato',
+    }),
+    'registrering': ('registrering', {
+        'systemID': 'system_id',
+        'tittel': 'tittel',
+        'journalposttype': 'journalposttype',
+        'journaldato': 'journaldato',
+    }),
+    'dokumentobjekt': ('dokumentobjekt', {
+        'format': 'format',
+        'filstoerrelse': 'filstoerrelse',
+        'referanseDokumentfil': 'referanse_dokumentfil',
+        'sjekksum': 'sjekksum',
+        'sjekksumAlgoritme': 'sjekksum_algoritme',
+    }),
+}
+
+BATCH_SIZE = 10000
+
+
+class _RowWriter:
+    """Buffers rows per table and writes them with executemany"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.pending: Dict[str, List[Dict[str, Any]]] = {}
+
+    def add(self, table: str, row: Dict[str, Any]) -> None:
+        rows = self.pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table: Optional[str] = None) -> None:
+        for name in ([table] if table else list(self.pending)):
+            rows = self.pending.pop(name, [])
+            if not rows:
+                continue
+            columns = list(rows[0])
+            self.conn.executemany(
+                f"INSERT INTO {name} ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                [tuple(row[c] for c in columns) for row in rows],
+            )
+
+
+class ArkivstrukturIndexer(Visitor):
+    """Collects entity rows from arkivstruktur.xml"""
+    start_tags = frozenset(ENTITIES)
+    end_tags = frozenset(ENTITIES).union(*(fields for _, fields in ENTITIES.values()))
+
+    def __init__(self, writer: _RowWriter):
+        self.writer = writer
+        self.next_id = {entity: 1 for entity in ENTITIES}
+        # Open entities, innermost last: (entity tag, row)
+        self.open: List[Tuple[str, Dict[str, Any]]] = []
+        self.dok_seq: Dict[int, int] = {}
+
+    def _innermost_id(self, entity: str) -> Optional[int]:
+        for tag, row in reversed(self.open):
+            if tag == entity:
+                return row['id']
+        return None
+
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        row: Dict[str, Any] = {'id': self.next_id[tag]}
+        self.next_id[tag] += 1
+        row.update({column: None for column in ENTITIES[tag][1].values()})
+        if tag in ('klasse', 'mappe', 'registrering'):
+            row['arkivdel_id'] = self._innermost_id('arkivdel')
+        if tag == 'registrering':
+            row['mappe_id'] = self._innermost_id('mappe')
+        elif tag == 'dokumentobjekt':
+            reg_id = self._innermost_id('registrering')
+            row['registrering_id'] = reg_id
+            row['seq'] = self.dok_seq.get(reg_id, 0)
+            self.dok_seq[reg_id] = row['seq'] + 1
+        row['_seen'] = set()
+        self.open.append((tag, row))
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if tag in ENTITIES and self.open and self.open[-1][0] == tag:
+            _, row = self.open.pop()
+            del row['_seen']
+            if tag == 'registrering':
+                self.dok_seq.pop(row['id'], None)
+            self.writer.add(ENTITIES[tag][0], row)
+            return
+        for entity, row in self.open:
+            column = ENTITIES[entity][1].get(tag)
+            if column and tag not in row['_seen']:
+                row['_seen'].add(tag)
+                row[column] = elem.text
+
+
+class EndringsloggIndexer(Visitor):
+    """Collects referanseArkivenhet values from endringslogg.xml"""
+    end_tags = frozenset({'referanseArkivenhet'})
+
+    def __init__(self, writer: _RowWriter):
+        self.writer = writer
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if 'endring' in path and elem.text:
+            self.writer.add('endring', {'referanse_arkivenhet': elem.text.strip()})
+
+
+def _source_state(path: pl.Path) -> Dict[str, str]:
+    stat_result = path.stat()
+    return {
+        'size': str(stat_result.st_size),
+        'mtime_ns': str(stat_result.st_mtime_ns),
+    }
+
+
+class N5Index:
+    """Read/write access to the SQLite index of one extraction"""
+
+    def __init__(self, uttrekksmappe: pl.Path):
+        self.uttrekksmappe = pl.Path(uttrekksmappe)
+        self.sources = {
+            'arkivstruktur': self.uttrekksmappe / "arkivstruktur.xml",
+            'endringslogg': self.uttrekksmappe / "endringslogg.xml",
+        }
+        self.path = self.uttrekksmappe / "logs" / INDEX_FILENAME
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _meta(self) -> Dict[str, str]:
+        try:
+            return dict(self.conn.execute("SELECT key, value FROM meta"))
+        except sqlite3.DatabaseError:
+            return {}
+
+    def is_fresh(self) -> bool:
+        """True if the index exists and was built from the current source files.
+
+        Size and mtime are checked first; only if they differ is the file
+        re-hashed, and a matching hash refreshes the stored stat values.
+        """
+        if not self.path.exists():
+            return False
+        meta = self._meta()
+        if meta.get('schema_version') != str(SCHEMA_VERSION):
+            return False
+        updates = {}
+        for name, source in self.sources.items():
+            if not source.exists():
+                return False
+            state = _source_state(source)
+            if all(meta.get(f'{name}_{key}') == value for key, value in state.items()):
+                continue
+            if hash_file(source) != meta.get(f'{name}_sha256'):
+                return False
+            updates.update({f'{name}_{key}': value for key, value in state.items()})
+        if updates:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", updates.items())
+        return True
+
+    def build(self) -> Dict[str, int]:
+        """(Re)build the index from the source files. Returns row counts per table."""
+        self.close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+        writer = _RowWriter(conn)
+
+        meta = {'schema_version': str(SCHEMA_VERSION)}
+        for name, source in self.sources.items():
+            state = _source_state(source)
+            meta.update({f'{name}_{key}': value for key, value in state.items()})
+            meta[f'{name}_sha256'] = hash_file(source)
+
+        run_visitors(self.sources['arkivstruktur'], [ArkivstrukturIndexer(writer)])
+        run_visitors(self.sources['endringslogg'], [EndringsloggIndexer(writer)])
+        writer.flush()
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        conn.commit()
+        counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ('arkivdel', 'klasse', 'mappe', 'registrering', 'dokumentobjekt', 'endring')
+        }
+        conn.close()
+        tmp_path.replace(self.path)
+        return counts
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+        """Run an ad-hoc read query and return rows as dicts"""
+        cursor = self.conn.execute(sql, params)
+        columns = [d[0] for d in cursor.description or ()]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    # Test answers. The result shapes match the streaming visitors in test_n5.
+
+    def test_endringslogg(self) -> Dict[str, Any]:
+        rows = self.conn.execute(
+            "SELECT referanse_arkivenhet, COUNT(*) FROM endring "
+            "GROUP BY referanse_arkivenhet ORDER BY MIN(id)"
+        ).fetchall()
+        return {
+            'significant_changes': {ref: count for ref, count in rows if count > 4},
+            'total_changes': sum(count for _, count in rows)
+        }
+
+    def test_arkivenhetstelling(self) -> Dict[str, Any]:
+        count = lambda table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return {
+            'arkivdeler': count('arkivdel'),
+            'saker': count('mappe'),
+            'journalposter': count('registrering'),
+            'dokumentobjekt': count('dokumentobjekt')
+        }
+
+    def test_klasse_dato(self) -> Dict[str, Any]:
+        from .dates import DateColumn
+        from .test_n5 import klasse_dato_result
+
+        dates = DateColumn()
+        for (dato,) in self.conn.execute(
+                "SELECT opprettet_dato FROM klasse WHERE opprettet_dato IS NOT NULL"):
+            dates.append(dato)
+        return klasse_dato_result(dates)
+
+    def test_tomme_dokumentobjekt(self) -> Dict[str, Any]:
+        rows = self.conn.execute(
+            "SELECT r.system_id, r.tittel, r.journalposttype, d.format "
+            "FROM registrering r JOIN dokumentobjekt d "
+            "ON d.registrering_id = r.id AND d.seq = 0 "
+            "WHERE d.filstoerrelse = '0' ORDER BY r.id"
+        ).fetchall()
+        empty_docs = [{
+            'system_id': system_id,
+            'title': tittel,
+            'journalposttype': journalposttype or "",
+            'format': dok_format or ""
+        } for system_id, tittel, journalposttype, dok_format in rows]
+        return {
+            'empty_documents': empty_docs,
+            'count': len(empty_docs)
+        }
+
+    def test_periodisering(self) -> Dict[str, Any]:
+        from .dates import DateColumn
+        from .test_n5 import periodisering_result
+
+        arkivdeler, positions = [], {}
+        for arkivdel_id, system_id, opprettet, avsluttet in self.conn.execute(
+                "SELECT id, system_id, opprettet_dato, avsluttet_dato FROM arkivdel ORDER BY id"):
+            arkivdeler.append({
+                'systemID': system_id.strip() if system_id else None,
+                'opprettetDato': opprettet.strip() if opprettet else None,
+                'avsluttetDato': avsluttet.strip() if avsluttet else None,
+            })
+            positions[arkivdel_id] = len(arkivdeler)
+        journal_dates = DateColumn()
+        for arkivdel_id, dato in self.conn.execute(
+                "SELECT arkivdel_id, journaldato FROM registrering WHERE journaldato IS NOT NULL"):
+            journal_dates.append(dato, positions.get(arkivdel_id, 0))
+        return periodisering_result(journal_dates, arkivdeler)
+
+    def dokumentobjekt_files(self) -> Iterator[Tuple[Optional[str], ...]]:
+        """(registrering systemID, referanseDokumentfil, sjekksum, sjekksumAlgoritme,
+        filstoerrelse) per dokumentobjekt, in document order"""
+        return self.conn.execute(
+            "SELECT r.system_id, d.referanse_dokumentfil, d.sjekksum, d.sjekksum_algoritme, "
+            "d.filstoerrelse FROM dokumentobjekt d "
+            "LEFT JOIN registrering r ON r.id = d.registrering_id ORDER BY d.id"
+        )
+
+
+INDEXED_TESTS = {
+    '01': N5Index.test_endringslogg,
+    '02': N5Index.test_arkivenhetstelling,
+    '03': N5Index.test_klasse_dato,
+    '04': N5Index.test_tomme_dokumentobjekt,
+    '05': N5Index.test_periodisering,
+}
@@ -1,194 +1,644 @@
 import xml.etree.ElementTree as ET
+import os
 import pathlib as pl
-from typing import Dict, Any, Optional
+import posixpath
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Any, List, Optional, Set, Tuple
 
 from ... import env_handling
+from ...hashing import HashEngine, hashlib_name, in_sample, sample_buckets
+from ...inventory import iter_scan
+from ...profiling import PhaseRecorder
+from ..engine import Visitor, run_visitors
+from .dates import (DateColumn, count_in_period, date_key, date_profile, format_day,
+                    merge_counts)
+from .index import INDEXED_TESTS, N5Index
 
-class N5Tester:
-    def __init__(self, uttrekksmappe: pl.Path):
-        self.uttrekksmappe = uttrekksmappe
-        self.arkivstruktur_path = pl.Path.joinpath(uttrekksmappe, "arkivstruktur.xml")
-        self.endringslogg_path = pl.Path.joinpath(uttrekksmappe, "endringslogg.xml")
+# Longest list of findings included per category; the counts are always complete
+MAX_REPORTED = 1000
+# Not part of the extraction: dimo writes its logs and index here
+IGNORED_DIRS = frozenset({'logs'})
 
-    def run_test(self, test_name: str) -> Dict[str, Any]:
-        """Run a specific N5 test by name"""
-        test_map = {
-            '01': self._test_endringslogg,
-            '02': self._test_arkivenhetstelling,
-            '03': self._test_klasse_dato,
-            '04': self._test_tomme_dokumentobjekt,
-            '05': self._test_periodisering,
-            'all': self._run_all_tests
-        }
+# Test 07: dokumentobjekt fields and result statuses
+FIXITY_FIELDS = ('referanseDokumentfil', 'sjekksum', 'sjekksumAlgoritme', 'filstoerrelse')
+FIXITY_STATUSES = ("ok", "missing", "size_mismatch", "checksum_mismatch",
+                   "unreadable", "no_reference", "no_checksum", "unsupported", "skipped")
 
-        if test_name not in test_map:
-            raise ValueError(f"Unknown test: {test_name}")
 
-        return test_map[test_name]()
+class EndringsloggVisitor(Visitor):
+    """Test 01: Count changes in endringslogg
+    https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/antall_endringer_endringslogg.py 
+    """
+    end_tags = frozenset({'referanseArkivenhet'})
 
-    def _test_endringslogg(self) -> Dict[str, Any]:
-        """Test 01: Count changes in endringslogg
-        https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/antall_endringer_endringslogg.py 
-        """
-        tree = ET.parse(self.endringslogg_path)
-        root = tree.getroot()
-        
-        changes = {}
-        total_changes = 0
-        namespace = {'ns': 'http://www.arkivverket.no/standarder/noark5/endringslogg'}
-
-        for parent in root.findall(".//ns:endring", namespace):
-            for child in parent.findall(".//ns:referanseArkivenhet", namespace):
-                if child.text:
-                    ref = child.text.strip()
-                    changes[ref] = changes.get(ref, 0) + 1
-                    total_changes += 1
+    def __init__(self):
+        self.changes: Dict[str, int] = {}
+        self.total_changes = 0
 
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if 'endring' in path and elem.text:
+            ref = elem.text.strip()
+            self.changes[ref] = self.changes.get(ref, 0) + 1
+            self.total_changes += 1
+
+    def result(self) -> Dict[str, Any]:
         return {
-            'significant_changes': {ref: count for ref, count in changes.items() if count > 4},
-            'total_changes': total_changes
+            'significant_changes': {ref: count for ref, count in self.changes.items() if count > 4},
+            'total_changes': self.total_changes
         }
 
-    def _test_arkivenhetstelling(self) -> Dict[str, Any]:
-        """Test 02: Count archive entities
-        https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/arkivenhetstelling.py 
-        """
-        counts = {
-            'arkivdeler': 0,
-            'saker': 0,
-            'journalposter': 0,
-            'dokumentobjekt': 0
+
+class ArkivenhetstellingVisitor(Visitor):
+    """Test 02: Count archive entities
+    https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/arkivenhetstelling.py 
+    """
+    keys = {
+        'arkivdel': 'arkivdeler',
+        'mappe': 'saker',
+        'registrering': 'journalposter',
+        'dokumentobjekt': 'dokumentobjekt'
+    }
+    start_tags = frozenset(keys)
+
+    def __init__(self):
+        self.counts = {key: 0 for key in self.keys.values()}
+
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        self.counts[self.keys[tag]] += 1
+
+    def result(self) -> Dict[str, Any]:
+        return self.counts
+
+
+class KlasseDatoVisitor(Visitor):
+    """Test 03: Count classes by creation date
+    https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/klasse_dato.py
+    """
+    start_tags = frozenset({'klasse'})
+    end_tags = frozenset({'klasse', 'opprettetDato'})
+
+    def __init__(self):
+        self.dates = DateColumn()
+        # Open klasse elements; True once their first opprettetDato is seen
+        self.open_klasser: List[bool] = []
+
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        self.open_klasser.append(False)
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if tag == 'klasse':
+            self.open_klasser.pop()
+            return
+        # The first opprettetDato below a klasse counts for it, as with find('.//opprettetDato')
+        waiting = self.open_klasser.count(False)
+        if waiting:
+            self.open_klasser = [True] * len(self.open_klasser)
+            if elem.text:
+                self.dates.append(elem.text, count=waiting)
+
+    def result(self) -> Dict[str, Any]:
+        return klasse_dato_result(self.dates)
+
+
+def klasse_dato_result(dates: DateColumn) -> Dict[str, Any]:
+    """Compute the test 03 result: klasser per creation day plus date profile"""
+    day_counts = dates.day_counts()
+    return {
+        'date_counts': {format_day(day): count for day, count in sorted(day_counts.items())},
+        'invalid_dates': dates.invalid(day_counts),
+        **date_profile(day_counts),
+    }
+
+
+class TommeDokumentobjektVisitor(Visitor):
+    """Test 04: Check for empty documents
+    https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/sjekk_tomme_dokumentobjekt.py 
+    """
+    start_tags = frozenset({'registrering', 'dokumentobjekt'})
+    end_tags = frozenset({'registrering', 'dokumentobjekt', 'systemID', 'tittel',
+                          'journalposttype', 'filstoerrelse', 'format'})
+
+    def __init__(self):
+        self.empty_docs: List[Dict[str, Any]] = []
+        self.reg: Optional[Dict[str, Any]] = None
+        self.dok: Optional[Dict[str, Any]] = None
+        self.in_first_dok = False
+
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if tag == 'registrering':
+            self.reg = {}
+            self.dok = None
+        elif self.reg is not None and self.dok is None:
+            # Only the first dokumentobjekt of a registrering is checked
+            self.dok = {}
+            self.in_first_dok = True
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if self.reg is None:
+            return
+        if tag == 'registrering':
+            dok = self.dok or {}
+            if dok.get('filstoerrelse') == "0":
+                self.empty_docs.append({
+                    'system_id': self.reg.get('systemID'),
+                    'title': self.reg.get('tittel'),
+                    'journalposttype': self.reg.get('journalposttype') or "",
+                    'format': dok.get('format') or ""
+                })
+            self.reg = None
+            self.dok = None
+        elif tag == 'dokumentobjekt':
+            self.in_first_dok = False
+        else:
+            # First occurrence wins, as with Element.find('.//tag')
+            self.reg.setdefault(tag, elem.text)
+            if self.in_first_dok:
+                self.dok.setdefault(tag, elem.text)
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            'empty_documents': self.empty_docs,
+            'count': len(self.empty_docs)
         }
 
-        for element in ET.parse(self.arkivstruktur_path).iter():
-            tag = element.tag.split('}')[-1]
-            if tag == 'arkivdel': counts['arkivdeler'] += 1
-            elif tag == 'mappe': counts['saker'] += 1
-            elif tag == 'registrering': counts['journalposter'] += 1
-            elif tag == 'dokumentobjekt': counts['dokumentobjekt'] += 1
 
-        return counts
+class PeriodiseringVisitor(Visitor):
+    """Test 05: Check periodization of archive records
+    Analyzes the dates in the archive structure and checks if they fall within the expected period.
+    https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/periodiseringskontroll.py
+    """
+    start_tags = frozenset({'arkivdel'})
+    end_tags = frozenset({'arkivdel', 'journaldato', 'systemID', 'opprettetDato', 'avsluttetDato'})
 
-    def _test_klasse_dato(self) -> Dict[str, Any]:
-        """Test 03: Count classes by creation date
-        https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/klasse_dato.py
-        """
-        tree = ET.parse(self.arkivstruktur_path)
-        root = tree.getroot()
-        
-        date_counts = {}
-        ns = "http://www.arkivverket.no/standarder/noark5/arkivstruktur"
-
-        for klasse in root.findall(f".//{{{ns}}}klasse"):
-            dato = klasse.find(f".//{{{ns}}}opprettetDato")
-            if dato is not None and dato.text:
-                date = dato.text.strip()
-                date_counts[date] = date_counts.get(date, 0) + 1
-
-        return {'date_counts': dict(sorted(date_counts.items()))}
+    def __init__(self):
+        # Grouped by arkivdel: 1 for the first arkivdel, 0 outside any
+        self.journal_dates = DateColumn()
+        self.arkivdeler: List[Dict[str, Optional[str]]] = []
+        self.arkivdel: Optional[Dict[str, Optional[str]]] = None
 
-    def _test_tomme_dokumentobjekt(self) -> Dict[str, Any]:
-        """Test 04: Check for empty documents
-        https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/sjekk_tomme_dokumentobjekt.py 
-        """
-        tree = ET.parse(self.arkivstruktur_path)
-        root = tree.getroot()
-        
-        empty_docs = []
-        ns = "http://www.arkivverket.no/standarder/noark5/arkivstruktur"
-
-        for reg in root.findall(f".//{{{ns}}}registrering"):
-            dok = reg.find(f".//{{{ns}}}dokumentobjekt")
-            if dok is not None:
-                size = dok.find(f".//{{{ns}}}filstoerrelse")
-                if size is not None and size.text == "0":
-                    empty_docs.append({
-                        'system_id': reg.find(f".//{{{ns}}}systemID").text,
-                        'title': reg.find(f".//{{{ns}}}tittel").text,
-                        'journalposttype': reg.find(f".//{{{ns}}}journalposttype").text if reg.find(f".//{{{ns}}}journalposttype") is not None else "",
-                        'format': dok.find(f".//{{{ns}}}format").text if dok.find(f".//{{{ns}}}format") is not None else ""
-                    })
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        self.arkivdel = {}
+        self.arkivdeler.append(self.arkivdel)
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if tag == 'journaldato':
+            if elem.text:
+                group = len(self.arkivdeler) if self.arkivdel is not None else 0
+                self.journal_dates.append(elem.text, group)
+        elif tag == 'arkivdel':
+            self.arkivdel = None
+        elif self.arkivdel is not None and tag not in self.arkivdel:
+            # First descendant wins, as with Element.find('.//tag')
+            self.arkivdel[tag] = elem.text.strip() if elem.text else None
+
+    def result(self) -> Dict[str, Any]:
+        return periodisering_result(self.journal_dates, self.arkivdeler)
+
+
+def periodisering_result(journal_dates: DateColumn,
+                         arkivdeler: List[Dict[str, Optional[str]]]) -> Dict[str, Any]:
+    """Compute the test 05 result from journal dates (grouped by arkivdel
+    position, 1-based) and the arkivdeler (systemID, opprettetDato,
+    avsluttetDato)"""
+    # The period is taken from the first arkivdeler that give a start and an end
+    start_date = end_date = None
+    for arkivdel in arkivdeler:
+        start_date = arkivdel.get('opprettetDato') or start_date
+        end_date = arkivdel.get('avsluttetDato') or end_date
+        if start_date and end_date:
+            break
+    # Use default dates if not found
+    start_date = start_date or "1970-01-01"
+    end_date = end_date or "2030-12-31"
+    period_start = date_key(start_date) or date_key("1970-01-01")
+    period_end = date_key(end_date) or date_key("2030-12-31")
+
+    grouped = journal_dates.grouped_counts()
+    day_counts = merge_counts(grouped)
+    valid = sum(day_counts.values())
+    dates_within = count_in_period(day_counts, period_start, period_end)
+
+    per_arkivdel = []
+    for position, arkivdel in enumerate(arkivdeler, 1):
+        counts = grouped.get(position)
+        if not counts:
+            continue
+        own_start = date_key(arkivdel.get('opprettetDato'))
+        own_end = date_key(arkivdel.get('avsluttetDato'))
+        within = count_in_period(counts, own_start or period_start, own_end or period_end)
+        total = sum(counts.values())
+        per_arkivdel.append({
+            'system_id': arkivdel.get('systemID'),
+            'period_start': arkivdel.get('opprettetDato'),
+            'period_end': arkivdel.get('avsluttetDato'),
+            'journal_dates': total,
+            'dates_within_period': within,
+            'dates_outside_period': total - within,
+            **date_profile(counts),
+        })
+
+    return {
+        'total_journal_dates': len(journal_dates),
+        'period_start': start_date,
+        'period_end': end_date,
+        'dates_within_period': dates_within,
+        'dates_outside_period': valid - dates_within,
+        'invalid_dates': len(journal_dates) - valid,
+        **date_profile(day_counts),
+        'arkivdeler': per_arkivdel,
+    }
+
+
+def _normalize_reference(reference: str) -> str:
+    """referanseDokumentfil -> relative path with '/' separators"""
+    reference = reference.strip().replace('\\', '/')
+    return posixpath.normpath(reference).lstrip('/') if reference else reference
+
+
+def _findings(items: List[Any]) -> Dict[str, Any]:
+    return {'count': len(items), 'items': items[:MAX_REPORTED]}
+
+
+class _SystemIdVisitor(Visitor):
+    """Test 06, arkivstruktur.xml: every systemID and referanseDokumentfil"""
+    end_tags = frozenset({'systemID', 'referanseDokumentfil'})
+
+    def __init__(self, test: 'ReferanseintegritetTest'):
+        self.test = test
+        self.registrering: Optional[str] = None
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        text = elem.text.strip() if elem.text else ""
+        if tag == 'systemID':
+            if text in self.test.system_ids:
+                self.test.duplicate_ids[text] += 1
+            else:
+                self.test.system_ids.add(text)
+            if path and path[-1] == 'registrering':
+                self.registrering = text
+        elif text:
+            self.test.file_refs.setdefault(_normalize_reference(text), self.registrering)
+            self.test.file_ref_count += 1
+
+
+class _EndringRefVisitor(Visitor):
+    """Test 06, endringslogg.xml: every referanseArkivenhet"""
+    end_tags = frozenset({'referanseArkivenhet'})
+
+    def __init__(self, test: 'ReferanseintegritetTest'):
+        self.test = test
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if 'endring' in path and elem.text:
+            self.test.endring_refs[elem.text.strip()] += 1
+
+
+class ReferanseintegritetTest:
+    """Test 06: Referential integrity between endringslogg.xml, arkivstruktur.xml and the files
+    One streaming pass per XML file fills hash sets of systemIDs, file
+    references and endringslogg references while the extraction directory is
+    walked in the background; the checks are then set lookups (a hash join),
+    so the cost is linear in the number of records and files.
+    """
 
+    def __init__(self, uttrekksmappe: pl.Path, options: Optional[Dict[str, Any]] = None):
+        self.uttrekksmappe = uttrekksmappe
+        self.system_ids: Set[str] = set()
+        self.duplicate_ids: Counter = Counter()   # systemID -> extra occurrences
+        self.file_refs: Dict[str, Optional[str]] = {}  # path -> first registrering systemID
+        self.file_ref_count = 0
+        self.endring_refs: Counter = Counter()
+        self.arkivstruktur = _SystemIdVisitor(self)
+        self.endringslogg = _EndringRefVisitor(self)
+        # The directory walk runs while the XML files are parsed
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._files = self._executor.submit(self._scan_files)
+
+    def _scan_files(self) -> Set[str]:
+        """Relative paths ('/'-separated) of the files in subdirectories"""
+        files = set()
+        for record in iter_scan(str(self.uttrekksmappe)):
+            rel_path = record.rel_path.replace(os.sep, '/')
+            top, _, rest = rel_path.partition('/')
+            if rest and top not in IGNORED_DIRS:
+                files.add(rel_path)
+        return files
+
+    def result(self) -> Dict[str, Any]:
+        try:
+            files = self._files.result()
+        finally:
+            self._executor.shutdown()
+
+        dangling_endringer = [
+            {'referanse_arkivenhet': ref, 'occurrences': count}
+            for ref, count in sorted(self.endring_refs.items()) if ref not in self.system_ids
+        ]
+        dangling_files = [
+            {'referanse_dokumentfil': path, 'registrering': registrering}
+            for path, registrering in sorted(self.file_refs.items(), key=lambda item: item[0])
+            if path not in files
+        ]
+        # Only directories that documents are referenced in; top-level files
+        # (arkivstruktur.xml, schemas, ...) are never expected to be referenced
+        document_dirs = {path.partition('/')[0] for path in self.file_refs}
+        unreferenced = sorted(
+            path for path in files
+            if path not in self.file_refs and (not document_dirs or path.partition('/')[0] in document_dirs)
+        )
+        duplicates = [
+            {'system_id': system_id, 'occurrences': count + 1}
+            for system_id, count in sorted(self.duplicate_ids.items())
+        ]
         return {
-            'empty_documents': empty_docs,
-            'count': len(empty_docs)
+            'system_ids': len(self.system_ids),
+            'file_references': self.file_ref_count,
+            'files_on_disk': len(files),
+            'endringslogg_references': sum(self.endring_refs.values()),
+            'duplicate_system_ids': _findings(duplicates),
+            'dangling_endringslogg_references': _findings(dangling_endringer),
+            'dangling_file_references': _findings(dangling_files),
+            'unreferenced_files': _findings(unreferenced),
         }
 
-    def _test_periodisering(self) -> Dict[str, Any]:
-        """Test 05: Check periodization of archive records
-        Analyzes the dates in the archive structure and checks if they fall within the expected period.
-        https://github.com/arkivverket/AV-MTM/blob/master/n5uttrekkstester/periodiseringskontroll.py
-        """
-        tree = ET.parse(self.arkivstruktur_path)
-        root = tree.getroot()
-        ns = "http://www.arkivverket.no/standarder/noark5/arkivstruktur"
-        
-        # Find all journal dates
-        journal_dates = []
-        for reg in root.findall(f".//{{{ns}}}journaldato"):
-            if reg is not None and reg.text:
-                journal_dates.append(reg.text.strip())
-        
-        # Try to find period dates from arkivdel
-        start_date = None
-        end_date = None
-        for arkivdel in root.findall(f".//{{{ns}}}arkivdel"):
-            opprettet = arkivdel.find(f".//{{{ns}}}opprettetDato")
-            avsluttet = arkivdel.find(f".//{{{ns}}}avsluttetDato")
-            if opprettet is not None and opprettet.text:
-                start_date = opprettet.text.strip()
-            if avsluttet is not None and avsluttet.text:
-                end_date = avsluttet.text.strip()
-            if start_date and end_date:
-                break
-        
-        # Use default dates if not found
-        start_date = start_date or "1970-01-01"
-        end_date = end_date or "2030-12-31"
-        
-        # Count dates within and outside period
-        dates_within = 0
-        dates_outside = 0
-        dates_by_year = {}
-        
-        for date_str in journal_dates:
+
+def _int_or_none(text: Optional[str]) -> Optional[int]:
+    try:
+        return int(text) if text is not None else None
+    except ValueError:
+        return None
+
+
+class _DokumentobjektVisitor(Visitor):
+    """Test 07, arkivstruktur.xml: file reference, checksum and size per dokumentobjekt"""
+    start_tags = frozenset({'dokumentobjekt'})
+    end_tags = frozenset({'dokumentobjekt', 'systemID', *FIXITY_FIELDS})
+
+    def __init__(self, test: 'FixityTest'):
+        self.test = test
+        self.registrering: Optional[str] = None
+        self.fields: Optional[Dict[str, Optional[str]]] = None
+
+    def start(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        self.fields = {}
+
+    def end(self, tag: str, elem: ET.Element, path: List[str]) -> None:
+        if tag == 'dokumentobjekt':
+            if self.fields is not None:
+                self.test.add(self.registrering, *(self.fields.get(field) for field in FIXITY_FIELDS))
+            self.fields = None
+        elif tag == 'systemID':
+            if path and path[-1] == 'registrering':
+                self.registrering = elem.text
+        elif self.fields is not None:
+            self.fields.setdefault(tag, elem.text)
+
+
+class FixityTest:
+    """Test 07: Fixity of the document files against sjekksum and filstoerrelse
+    The dokumentobjekt fields are collected during the arkivstruktur.xml pass
+    (or read from a fresh index). Every file is checked with a stat first;
+    only files that exist and have the expected size are read, in parallel
+    through HashEngine, one pool per checksum algorithm. A file that cannot be
+    read is reported as unreadable; the other files are still checked.
+
+    Options: sample (share of the files per run; runs rotate through the
+    extraction as in verify-mets), sample_slot, limit (check at most this
+    many documents), hash_workers and hash_mode.
+    """
+    endringslogg = None
+
+    def __init__(self, uttrekksmappe: pl.Path, options: Optional[Dict[str, Any]] = None):
+        options = options or {}
+        self.uttrekksmappe = uttrekksmappe
+        self.sample = options.get('sample', 1.0)
+        self.buckets = sample_buckets(self.sample)
+        sample_slot = options.get('sample_slot')
+        if sample_slot is None:
+            sample_slot = date.today().toordinal()
+        self.sample_slot = sample_slot % self.buckets
+        self.limit = options.get('limit')
+        self.hash_workers = options.get('hash_workers')
+        self.hash_mode = options.get('hash_mode', 'auto')
+        self.documents = 0
+        self.counts: Counter = Counter()
+        self.failures: List[Dict[str, Any]] = []
+        # (registrering, path, sjekksum, sjekksumAlgoritme, filstoerrelse) to check
+        self.entries: List[Tuple[Optional[str], str, Optional[str], Optional[str], Optional[int]]] = []
+        self.arkivstruktur = _DokumentobjektVisitor(self)
+
+    def load_index(self, index: N5Index) -> None:
+        """Collect the dokumentobjekt fields from the index instead of the XML"""
+        for row in index.dokumentobjekt_files():
+            self.add(*row)
+
+    def add(self, registrering: Optional[str], referanse: Optional[str], sjekksum: Optional[str],
+            algoritme: Optional[str], filstoerrelse: Optional[str]) -> None:
+        self.documents += 1
+        path = _normalize_reference(referanse) if referanse and referanse.strip() else None
+        entry = (registrering.strip() if registrering else None, path,
+                 sjekksum.strip() if sjekksum else None,
+                 algoritme.strip() if algoritme else None,
+                 _int_or_none(filstoerrelse))
+        if path is None:
+            self._fail(entry, "no_reference")
+        elif not in_sample(path, self.buckets, self.sample_slot) or \
+                (self.limit is not None and len(self.entries) >= self.limit):
+            self.counts["skipped"] += 1
+        else:
+            self.entries.append(entry)
+
+    def _fail(self, entry: Tuple, status: str, actual: Any = None) -> None:
+        registrering, path, sjekksum, algoritme, filstoerrelse = entry
+        self.counts[status] += 1
+        self.failures.append({
+            'registrering': registrering,
+            'referanse_dokumentfil': path,
+            'status': status,
+            'expected_size': filstoerrelse,
+            'expected_checksum': sjekksum,
+            'checksum_algorithm': algoritme,
+            'actual': actual,
+        })
+
+    def result(self) -> Dict[str, Any]:
+        to_hash = defaultdict(list)  # hashlib name -> [(entry, full path, size)]
+        for entry in self.entries:
+            _, path, sjekksum, algoritme, filstoerrelse = entry
+            full_path = os.path.join(self.uttrekksmappe, path)
             try:
-                date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                year = date.year
-                dates_by_year[year] = dates_by_year.get(year, 0) + 1
-                
-                period_start = datetime.strptime(start_date, "%Y-%m-%d").date()
-                period_end = datetime.strptime(end_date, "%Y-%m-%d").date()
-                
-                if period_start <= date <= period_end:
-                    dates_within += 1
-                else:
-                    dates_outside += 1
-            except ValueError:
+                st = os.stat(full_path)
+            except OSError:
+                self._fail(entry, "missing")
                 continue
-        
+            if filstoerrelse is not None and st.st_size != filstoerrelse:
+                self._fail(entry, "size_mismatch", st.st_size)
+                continue
+            if not sjekksum:
+                self._fail(entry, "no_checksum")
+                continue
+            algorithm = hashlib_name(algoritme)
+            if algorithm is None:
+                self._fail(entry, "unsupported")
+                continue
+            to_hash[algorithm].append((entry, full_path, st.st_size))
+
+        bytes_hashed = 0
+        for algorithm, items in to_hash.items():
+            sizes = [size for _, _, size in items]
+            bytes_hashed += sum(sizes)
+            with HashEngine(workers=self.hash_workers, mode=self.hash_mode,
+                            algorithm=algorithm) as engine:
+                checksums = engine.map([full_path for _, full_path, _ in items], sizes,
+                                       errors="return")
+                for (entry, _, _), checksum in zip(items, checksums):
+                    if isinstance(checksum, OSError):
+                        self._fail(entry, "unreadable", str(checksum))
+                    elif checksum == entry[2].lower():
+                        self.counts["ok"] += 1
+                    else:
+                        self._fail(entry, "checksum_mismatch", checksum)
+
         return {
-            'total_journal_dates': len(journal_dates),
-            'period_start': start_date,
-            'period_end': end_date,
-            'dates_within_period': dates_within,
-            'dates_outside_period': dates_outside,
-            'dates_by_year': dict(sorted(dates_by_year.items()))
+            'documents': self.documents,
+            'sample': self.sample,
+            'sample_buckets': self.buckets,
+            'sample_slot': self.sample_slot,
+            'limit': self.limit,
+            'bytes_hashed': bytes_hashed,
+            'counts': {status: self.counts.get(status, 0) for status in FIXITY_STATUSES},
+            'failures': self.failures,
         }
 
+
+# Streaming tests per source file. New tests are added by registering a
+# Visitor class here; 'all' runs every visitor for a file in one pass.
+ENDRINGSLOGG_TESTS = {
+    '01': EndringsloggVisitor,
+}
+ARKIVSTRUKTUR_TESTS = {
+    '02': ArkivenhetstellingVisitor,
+    '03': KlasseDatoVisitor,
+    '04': TommeDokumentobjektVisitor,
+    '05': PeriodiseringVisitor,
+}
+# Tests that also read the extraction directory. They are constructed with
+# the directory and the tester options, provide an endringslogg and an
+# arkivstruktur visitor (None if they do not need the file), which join the
+# regular passes, and compute their result from the files on disk afterwards.
+# With a fresh index, load_index() (if present) replaces the visitors.
+# They read the files on disk (test 07 hashes every document), so they only
+# run when asked for by name and are not part of 'all'.
+EXTRACTION_TESTS = {
+    '06': ReferanseintegritetTest,
+    '07': FixityTest,
+}
+
+class N5Tester:
+    def __init__(self, uttrekksmappe: pl.Path, use_index: bool = True,
+                 profiler: Optional[PhaseRecorder] = None,
+                 options: Optional[Dict[str, Any]] = None):
+        self.uttrekksmappe = uttrekksmappe
+        # Passed to the extraction tests (e.g. sample/limit for test 07)
+        self.options = options or {}
+        # Receives one phase per index lookup / streaming pass
+        self.profiler = profiler or PhaseRecorder()
+        self.arkivstruktur_path = pl.Path.joinpath(uttrekksmappe, "arkivstruktur.xml")
+        self.endringslogg_path = pl.Path.joinpath(uttrekksmappe, "endringslogg.xml")
+        # Built by `dimo index n5`; only used while it matches the source files
+        self.index = N5Index(uttrekksmappe) if use_index else None
+
+    def run_test(self, test_name: str) -> Dict[str, Any]:
+        """Run a specific N5 test by name"""
+        if test_name == 'all':
+            return self._run_all_tests()
+        if test_name not in {**ENDRINGSLOGG_TESTS, **ARKIVSTRUKTUR_TESTS, **EXTRACTION_TESTS}:
+            raise ValueError(f"Unknown test: {test_name}")
+        return self._run_tests([test_name])[test_name]
+
+    def _run_tests(self, test_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Run the given tests from the index if it is fresh, otherwise with
+        one streaming pass per source file"""
+        results = {}
+        index_fresh = (self.index is not None and self.index.path.exists()
+                       and self.index.is_fresh())
+        if index_fresh:
+            for name in test_names:
+                if name in INDEXED_TESTS:
+                    with self.profiler.phase(f"index:{name}"):
+                        results[name] = INDEXED_TESTS[name](self.index)
+            test_names = [name for name in test_names if name not in results]
+        extraction = {name: EXTRACTION_TESTS[name](self.uttrekksmappe, self.options)
+                      for name in test_names if name in EXTRACTION_TESTS}
+        if index_fresh:
+            for name, test in extraction.items():
+                if hasattr(test, 'load_index'):
+                    with self.profiler.phase(f"index:{name}"):
+                        test.load_index(self.index)
+                    test.endringslogg = test.arkivstruktur = None
+        for path, registry, source in ((self.endringslogg_path, ENDRINGSLOGG_TESTS, 'endringslogg'),
+                                       (self.arkivstruktur_path, ARKIVSTRUKTUR_TESTS, 'arkivstruktur')):
+            visitors = {name: registry[name]() for name in test_names if name in registry}
+            extra = [getattr(test, source) for test in extraction.values()
+                     if getattr(test, source) is not None]
+            if visitors or extra:
+                with self.profiler.phase(f"stream:{path.name}") as phase:
+                    phase.bytes_read = path.stat().st_size
+                    run_visitors(path, list(visitors.values()) + extra)
+                results.update({name: visitor.result() for name, visitor in visitors.items()})
+        for name, test in extraction.items():
+            with self.profiler.phase(f"files:{name}"):
+                results[name] = test.result()
+        return results
+
+    def query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        """Run an ad-hoc SQL query against the extraction index"""
+        if self.index is None or not self.index.is_fresh():
+            raise RuntimeError("No up-to-date N5 index; run 'dimo index n5' first")
+        return self.index.query(sql, params)
+
+    def _test_endringslogg(self) -> Dict[str, Any]:
+        """Test 01: Count changes in endringslogg"""
+        return self.run_test('01')
+
+    def _test_arkivenhetstelling(self) -> Dict[str, Any]:
+        """Test 02: Count archive entities"""
+        return self.run_test('02')
+
+    def _test_klasse_dato(self) -> Dict[str, Any]:
+        """Test 03: Count classes by creation date"""
+        return self.run_test('03')
+
+    def _test_tomme_dokumentobjekt(self) -> Dict[str, Any]:
+        """Test 04: Check for empty documents"""
+        return self.run_test('04')
+
+    def _test_periodisering(self) -> Dict[str, Any]:
+        """Test 05: Check periodization of archive records"""
+        return self.run_test('05')
+
+    def _test_referanseintegritet(self) -> Dict[str, Any]:
+        """Test 06: Check references between endringslogg, arkivstruktur and files"""
+        return self.run_test('06')
+
+    def _test_fixity(self) -> Dict[str, Any]:
+        """Test 07: Verify document files against sjekksum and filstoerrelse"""
+        return self.run_test('07')
+
     def _run_all_tests(self) -> Dict[str, Any]:
-        """Run all available tests"""
-        return {
-            'test_01': self._test_endringslogg(),
-            'test_02': self._test_arkivenhetstelling(),
-            'test_03': self._test_klasse_dato(),
-            'test_04': self._test_tomme_dokumentobjekt(),
-            'test_05': self._test_periodisering()
-        }
+        """Run all XML tests (one pass over each XML file, or the index); the
+        extraction tests 06 and 07 only run by name"""
+        names = sorted({**ENDRINGSLOGG_TESTS, **ARKIVSTRUKTUR_TESTS})
+        results = self._run_tests(names)
+        return {f'test_{name}': results[name] for name in names}
 
-def run_n5_test(test_name: Optional[str] = None) -> Dict[str, Any]:
+def run_n5_test(test_name: Optional[str] = None,
+                profiler: Optional[PhaseRecorder] = None,
+                options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Main entry point for running N5 tests"""
     workspace = env_handling.get_workspace()
     uttrekksmappe = workspace.get_workspace_path()
-    tester = N5Tester(uttrekksmappe)
+    tester = N5Tester(uttrekksmappe, profiler=profiler, options=options)
     return tester.run_test(test_name or 'all')
\ No newline at end of file
@@ -1,49 +1,177 @@
 import os
-import hashlib
 import mimetypes
 import shutil
+import tempfile
+import atexit
 import datetime
 import logging
+import logging.handlers
+import queue
+import re
+import time
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 
 import xml.etree.ElementTree as ET  # stdlib ElementTree
 from lxml import etree  # For XSD-validering 
 
+from dimo.archive import hash_archive, is_archive
+from dimo.checksum_cache import CACHE_FILENAME, ChecksumCache
+from dimo.hash_journal import JOURNAL_FILENAME, HashJournal
+from dimo.hashing import DEFAULT_CHUNK_SIZE, METS_CHECKSUMTYPES, HashEngine, hash_file
+from dimo.inventory import iter_load_or_scan
+from dimo.io_scheduling import ReadScheduler
+from dimo.profiling import PhaseRecorder
 
-def configure_logger(log_file_path):
+NSMAP = {
+    "mets": "http://www.loc.gov/METS/",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+    "xlink": "http://www.w3.org/1999/xlink"
+}
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+METS_FILE_TAG = "{http://www.loc.gov/METS/}file"
+SCHEMA_LOCATION = "{http://www.w3.org/2001/XMLSchema-instance}schemaLocation"
+
+# Første valgte algoritme (se METS_CHECKSUMTYPES) skrives i
+# CHECKSUM/CHECKSUMTYPE; alle skrives til fixity-manifestet.
+FIXITY_MANIFEST = "fixity_manifest.tsv"
+
+# Elementer som kan ha svært mange barn. I strømmemodus skrives disse som
+# åpne beholdere; alle andre elementer skrives som hele deltrær.
+STREAM_CONTAINERS = {
+    "{http://www.loc.gov/METS/}mets",
+    "{http://www.loc.gov/METS/}fileSec",
+    "{http://www.loc.gov/METS/}fileGrp",
+    "{http://www.loc.gov/METS/}structMap",
+    "{http://www.loc.gov/METS/}div",
+}
+
+
+# Merker loggposter som gjelder én enkelt fil. De skrives til loggfilen, men
+# vises ikke i konsollen (med mindre verbose=True); der vises oppsummeringer.
+PER_FILE = {"per_file": True}
+
+
+class _BatchedFileHandler(logging.FileHandler):
+    """FileHandler som flusher hver flush_every post (og ved feil), ikke etter hver post."""
+
+    def __init__(self, filename, flush_every=1000, **kwargs):
+        self.flush_every = flush_every
+        self._unflushed = 0
+        super().__init__(filename, **kwargs)
+
+    def emit(self, record):
+        super().emit(record)
+        if record.levelno >= logging.ERROR:
+            self._flush_now()
+
+    def flush(self):
+        # Kalles av StreamHandler.emit etter hver post
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self._flush_now()
+
+    def _flush_now(self):
+        self._unflushed = 0
+        super().flush()
+
+    def close(self):
+        if self.stream:
+            self._flush_now()
+        super().close()
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Legger poster i køen uformatert; formateringen skjer i lyttertråden."""
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def stop_logging():
+    """Tømmer loggkøen, lukker loggfilen og fjerner handlerne (idempotent)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    logging.getLogger("dias_mets_updater").handlers.clear()
+
+
+atexit.register(stop_logging)
+
+
+def configure_logger(log_file_path, verbose=False):
     """
     Setter opp en logger som skriver til fil med tidsstempel.
+
+    Loggingen blokkerer ikke: poster legges i en kø og skrives av en egen
+    tråd (QueueListener) til fil i batcher. Hendelser per fil logges på DEBUG
+    eller merket med PER_FILE og havner bare i loggfilen; konsollen viser
+    oppsummeringer og fremdrift. verbose=True viser alt også i konsollen.
+    Kall stop_logging() når kjøringen er ferdig.
     """
+    global _listener
+    stop_logging()
     logger = logging.getLogger("dias_mets_updater")
     logger.setLevel(logging.DEBUG)
+    logger.propagate = False
 
-    # Fjern eventuelle gamle handlere for å unngå duplisert logging
-    if logger.hasHandlers():
-        logger.handlers.clear()
-
-    file_handler = logging.FileHandler(log_file_path, mode="a", encoding="utf-8")
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
+    file_handler = _BatchedFileHandler(log_file_path, mode="a", encoding="utf-8")
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
-    # I tillegg kan du legge til en konsoll-handler hvis ønskelig
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    if verbose:
+        console_handler.setLevel(logging.DEBUG)
+    else:
+        console_handler.setLevel(logging.INFO)
+        console_handler.addFilter(lambda record: not getattr(record, "per_file", False))
 
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _listener.start()
     return logger
 
 
+class ProgressLogger:
+    """
+    Tellere med fremdriftslogging høyst hvert interval sekund, i stedet for
+    én loggpost per fil. update() er billig nok til å kalles per fil.
+    """
+
+    def __init__(self, logger, label, total=None, interval=5.0):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self._started = time.monotonic()
+        self._next = self._started + interval
+
+    def update(self, n=1):
+        self.count += n
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            rate = self.count / max(now - self._started, 1e-9)
+            done = f"{self.count}/{self.total}" if self.total else f"{self.count}"
+            self.logger.info(f"{self.label}: {done} ({rate:.0f}/s)")
+
+
 def calculate_sha256(file_path):
     """Returnerer SHA-256-sjekksum for en gitt fil."""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+    return hash_file(file_path, "sha256")
 
 
 def get_mimetype(file_path):
@@ -69,182 +197,718 @@ def prettify_xml(elem, level=0):
             elem.tail = "\n" + level * indent
 
 
-def validate_xml(mets_file, schema_file="dias-mets.xsd", stage="before", logger=None):
-    """Validerer METS-fil mot XSD-skjema (hvis tilgjengelig)."""
+_schema_cache = {}
+
+
+def load_schema(schema_file):
+    """Kompilerer XSD-skjemaet én gang per prosess (cache på sti og mtime)."""
+    key = (os.path.abspath(schema_file), os.stat(schema_file).st_mtime_ns)
+    if key not in _schema_cache:
+        _schema_cache[key] = etree.XMLSchema(file=schema_file)
+    return _schema_cache[key]
+
+
+def _validate_streaming(mets_file, schema):
+    """Validerer mens filen leses med iterparse; minnebruk er uavhengig av filstørrelse."""
+    context = etree.iterparse(mets_file, events=("end",), schema=schema, huge_tree=True)
+    for _, elem in context:
+        elem.clear(keep_tail=True)
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+    del context
+
+
+def validate_xml(mets_file, schema_file="dias-mets.xsd", stage="before", logger=None,
+                 tree=None, streaming=False):
+    """
+    Validerer METS mot XSD-skjema (hvis tilgjengelig).
+
+    - tree: et lxml-tre i minnet som valideres i stedet for filen på disk.
+    - streaming=True validerer filen mens den leses (iterparse), uten å bygge
+      hele treet.
+
+    Returnerer True/False for gyldig/ugyldig, eller None hvis skjemaet mangler.
+    """
     if logger is None:
         logger = logging.getLogger("dias_mets_updater")
 
     if not os.path.exists(schema_file):
         logger.warning(f"Fant ikke XSD-skjema '{schema_file}'. Hopper over validering.")
-        return
+        return None
 
     try:
-        schema = etree.XMLSchema(file=schema_file)
-        parser = etree.XMLParser(schema=schema)
+        schema = load_schema(schema_file)
 
-        tree = etree.parse(mets_file)
-        schema.assertValid(tree)  # Validerer hele dokumentet
+        if tree is not None:
+            schema.assertValid(tree)
+        elif streaming:
+            _validate_streaming(mets_file, schema)
+        else:
+            schema.assertValid(etree.parse(mets_file))  # Validerer hele dokumentet
 
         logger.info(f"XML-validering {stage} endringer: OK")
+        return True
 
     except etree.XMLSyntaxError as e:
         logger.error(f"XML Syntax Error {stage} endringer: {e}")
     except etree.DocumentInvalid as e:
         logger.error(f"Valideringsfeil {stage} endringer: {e}")
+    return False
+
+
+class ContentFile:
+    """
+    Størrelse og sjekksummer for én fil i content (kompakt, uten __dict__).
+    checksums følger rekkefølgen på de valgte algoritmene; den første er den
+    som skrives i METS.
+    """
+    __slots__ = ("size", "checksums")
+
+    def __init__(self, size, checksums):
+        self.size = size
+        self.checksums = checksums
+
+    @property
+    def checksum(self):
+        return self.checksums[0]
+
+
+class ContentIndex:
+    """
+    Oppslagsindekser over content_files, bygget fortløpende under skanningen.
+
+    - files: relativ sti -> ContentFile
+    - by_basename: filnavn -> liste av relative stier (flyttede filer)
+    - by_fingerprint: (størrelse, sjekksum) -> liste av relative stier (omdøpte filer)
+
+    checksum_type er CHECKSUMTYPE for sjekksummen som skrives i METS.
+    """
+
+    def __init__(self, content_files, checksum_type="SHA-256"):
+        self.files = content_files
+        self.checksum_type = checksum_type
+        self.by_basename = defaultdict(list)
+        self.by_fingerprint = defaultdict(list)
+        self.referenced = set()
+        for rel_path, info in content_files.items():
+            self._index(rel_path, info)
+
+    def add(self, rel_path, info):
+        """Legger til én fil (indeksen kan bygges mens filene hashes)."""
+        self.files[rel_path] = info
+        self._index(rel_path, info)
+
+    def remove(self, rel_path):
+        """Fjerner én fil (slettet eller endret), f.eks. i watch-modus."""
+        info = self.files.pop(rel_path, None)
+        if info is None:
+            return
+        for table, key in ((self.by_basename, os.path.basename(rel_path)),
+                           (self.by_fingerprint, (info.size, info.checksum))):
+            paths = table[key]
+            paths.remove(rel_path)
+            if not paths:
+                del table[key]
+        self.referenced.discard(rel_path)
+
+    def _index(self, rel_path, info):
+        self.by_basename[os.path.basename(rel_path)].append(rel_path)
+        self.by_fingerprint[(info.size, info.checksum)].append(rel_path)
+
+    def match(self, old_norm, old_size=None, old_checksum=None):
+        """
+        Finner filen et METS-element peker på. Returnerer (status, kandidater):
+
+        - "exact": stien finnes uendret
+        - "moved": entydig treff på filnavn
+        - "renamed": entydig treff på (størrelse, sjekksum) fra METS
+        - "ambiguous": flere mulige treff, ingen oppdatering
+        - "missing": ingen treff
+        """
+        if old_norm in self.files:
+            return "exact", [old_norm]
+
+        fingerprint = None
+        if old_size is not None and old_checksum:
+            fingerprint = (old_size, old_checksum)
+
+        candidates = self.by_basename.get(os.path.basename(old_norm), [])
+        if len(candidates) > 1 and fingerprint is not None:
+            # Flere filer med samme navn: bruk SIZE/CHECKSUM fra METS til å skille dem
+            narrowed = [c for c in candidates if c in self.by_fingerprint.get(fingerprint, ())]
+            if narrowed:
+                candidates = narrowed
+        if len(candidates) == 1:
+            return "moved", candidates
+        if candidates:
+            return "ambiguous", candidates
+
+        if fingerprint is not None:
+            candidates = self.by_fingerprint.get(fingerprint, [])
+            if len(candidates) == 1:
+                return "renamed", candidates
+            if candidates:
+                return "ambiguous", candidates
+
+        return "missing", []
+
+    def unreferenced(self):
+        """Filer i content som ingen <mets:file> peker på."""
+        return sorted(set(self.files) - self.referenced)
+
+
+def _href_to_rel_path(xlink_href):
+    """'file:content/ARKIV1/arkiv.dat' -> 'ARKIV1/arkiv.dat' (normalisert)."""
+    old_href = xlink_href.replace("file:", "").strip()
+    old_norm = os.path.normpath(old_href)
+    if old_norm.startswith("content" + os.sep):
+        old_norm = os.path.relpath(old_norm, "content")
+    return old_norm
+
+
+def apply_file_info(file_element, flocat, rel_path, info, checksum_type="SHA-256"):
+    """Setter SIZE/CHECKSUM/CHECKSUMTYPE og xlink:href på et <mets:file>-element."""
+    file_element.set("SIZE", str(info.size))
+    file_element.set("CHECKSUM", info.checksum)
+    file_element.set("CHECKSUMTYPE", checksum_type)
+    flocat.set(XLINK_HREF, f"file:content/{rel_path}")
+
+
+def update_file_element(file_element, index, logger):
+    """
+    Oppdaterer ett <mets:file>-element mot ContentIndex. Returnerer match-status
+    (se ContentIndex.match), eller "skipped" hvis elementet mangler FLocat/href.
+    """
+    # Finn <mets:FLocat> inni <file>
+    flocat = file_element.find(".//mets:FLocat", namespaces=NSMAP)
+    if flocat is None:
+        return "skipped"
+
+    # Hent ut xlink:href
+    xlink_href = flocat.get(XLINK_HREF)
+    if not xlink_href:
+        return "skipped"  # Finner ingen sti, hopp over
+
+    old_norm = _href_to_rel_path(xlink_href)
+    logger.debug(f"Sjekker <file>-element med sti: {xlink_href} (-> {old_norm})")
+
+    # SIZE/CHECKSUM fra METS brukes for å kjenne igjen omdøpte filer
+    old_size = file_element.get("SIZE")
+    old_checksum = None
+    if file_element.get("CHECKSUMTYPE", "SHA-256") == index.checksum_type:
+        old_checksum = file_element.get("CHECKSUM")
+    try:
+        old_size = int(old_size) if old_size is not None else None
+    except ValueError:
+        old_size = None
+
+    status, candidates = index.match(old_norm, old_size, old_checksum)
+    if status in ("exact", "moved", "renamed"):
+        new_rel_path = candidates[0]
+        apply_file_info(file_element, flocat, new_rel_path, index.files[new_rel_path],
+                        index.checksum_type)
+        index.referenced.add(new_rel_path)
+        if status == "exact":
+            logger.debug(f"Oppdatert metadata for fil: {old_norm}")
+        else:
+            logger.debug(f"Oppdatert filsti ({status}): {old_norm} -> {new_rel_path}")
+    elif status == "ambiguous":
+        logger.warning(
+            f"Flertydig match for sti: {old_norm} ({len(candidates)} kandidater: "
+            f"{', '.join(candidates[:5])}{' ...' if len(candidates) > 5 else ''}). "
+            "Ingen oppdatering gjort.",
+            extra=PER_FILE,
+        )
+    else:
+        logger.warning(f"Fant ingen match for sti: {old_norm}. Ingen oppdatering gjort.",
+                       extra=PER_FILE)
+    return status
+
+
+def log_match_summary(index, stats, logger):
+    """Logger oppsummering av matchingen og lister filer uten METS-referanse."""
+    logger.info(
+        "Matching: "
+        + ", ".join(f"{status}={stats.get(status, 0)}"
+                    for status in ("exact", "moved", "renamed", "ambiguous", "missing", "skipped"))
+    )
+    unreferenced = index.unreferenced()
+    if unreferenced:
+        logger.warning(f"{len(unreferenced)} filer i content er ikke referert i METS:")
+        for rel_path in unreferenced:
+            logger.warning(f"  Ikke referert: {rel_path}", extra=PER_FILE)
+
+
+def _run_summary(index, stats, log_file):
+    """Oppsummering av en kjøring som returneres fra update_dias_mets."""
+    return {
+        'files': len(index.files),
+        'matching': {status: stats.get(status, 0)
+                     for status in ("exact", "moved", "renamed", "ambiguous", "missing", "skipped")},
+        'unreferenced': len(index.unreferenced()),
+        'log_file': log_file,
+    }
 
 
-def update_dias_mets(mets_file, content_dir, dry_run=False):
+def write_fixity_manifest(manifest_path, content_files, algorithms):
+    """
+    Skriver sidecar-manifest med alle sjekksummer per fil (tabulatorseparert:
+    sti, størrelse og én kolonne per algoritme). Skrives atomisk via temp-fil.
+    """
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("\t".join(("path", "size", *algorithms)) + "\n")
+        for rel_path in sorted(content_files):
+            info = content_files[rel_path]
+            path = "content/" + rel_path.replace(os.sep, "/")
+            f.write("\t".join((path, str(info.size), *info.checksums)) + "\n")
+    os.replace(tmp_path, manifest_path)
+
+
+def _prepare_root(attrib):
+    """Sikre at rot-elementet har riktig METS-tag + schemaLocation."""
+    attrib[SCHEMA_LOCATION] = "http://www.loc.gov/METS/ dias-mets.xsd"
+    return "{http://www.loc.gov/METS/}mets"
+
+
+def _new_namespaces(elem, declared):
+    """Navnerom elementet trenger som ikke allerede er deklarert på en forelder."""
+    return {prefix: uri for prefix, uri in elem.nsmap.items() if declared.get(prefix) != uri}
+
+
+_XMLNS_ATTRIBUTE = re.compile(rb'\s+xmlns(?::([^=\s]+))?="([^"]*)"')
+
+
+def _write_empty(xf, out, elem, declared):
+    """
+    Skriver et tomt element selvlukkende (<x />), som i tre-modus. xf.element
+    gir alltid <x></x>, så elementet serialiseres for seg, navnerom som
+    allerede er deklarert fjernes, og bytene skrives rett til utfilen etter
+    at xf er tømt.
+    """
+    def drop_declared(match):
+        prefix = match.group(1).decode() if match.group(1) else None
+        return b"" if declared.get(prefix) == match.group(2).decode() else match.group(0)
+
+    data = etree.tostring(elem, encoding="utf-8", xml_declaration=False, with_tail=False)
+    data = _XMLNS_ATTRIBUTE.sub(drop_declared, data)
+    if data.endswith(b"/>"):
+        # Samme form som ElementTree i tre-modus: <x />
+        data = data[:-2].rstrip() + b" />"
+    xf.flush()
+    out.write(data)
+
+
+def _write_subtree(xf, out, elem, depth, declared, indent):
+    """
+    Skriver et ferdig lest deltre med innrykk. Elementene skrives via
+    xf.element slik at navnerom som allerede er deklarert ikke gjentas;
+    tomme elementer skrives selvlukkende (se _write_empty).
+    """
+    if not isinstance(elem.tag, str):
+        # Kommentar eller prosesseringsinstruksjon
+        tail, elem.tail = elem.tail, None
+        xf.write(elem)
+        elem.tail = tail
+        return
+    if len(elem) == 0 and not elem.text:
+        _write_empty(xf, out, elem, declared)
+        return
+    new_ns = _new_namespaces(elem, declared)
+    with xf.element(elem.tag, dict(elem.attrib), nsmap=new_ns or None):
+        if elem.text and (len(elem) == 0 or elem.text.strip()):
+            xf.write(elem.text)
+        if len(elem):
+            child_declared = {**declared, **new_ns}
+            for child in elem:
+                xf.write("\n" + indent * (depth + 1))
+                _write_subtree(xf, out, child, depth + 1, child_declared, indent)
+                if child.tail and child.tail.strip():
+                    xf.write(child.tail)
+            xf.write("\n" + indent * depth)
+
+
+def stream_update_mets(mets_file, output_path, index, logger, indent="  ", progress=None):
+    """
+    Oppdaterer METS i én strømmende gjennomgang med konstant minnebruk.
+
+    Leser med iterparse og skriver fortløpende med etree.xmlfile. Beholdere
+    (se STREAM_CONTAINERS) åpnes i utfilen når første barn dukker opp; øvrige
+    elementer skrives som hele deltrær når de er ferdig lest, og fjernes
+    deretter fra treet. Innrykk gjøres i samme gjennomgang. progress er en
+    valgfri ProgressLogger som oppdateres per <mets:file>.
+    Returnerer match-statistikk per status.
+    """
+    stats = defaultdict(int)
+    # Hver oppføring: [element, åpen xmlfile-kontekst eller None, deklarerte navnerom]
+    stack = []
+
+    def open_container(entry, depth):
+        elem = entry[0]
+        attrib = dict(elem.attrib)
+        tag = elem.tag
+        declared = stack[depth - 1][2] if depth else {}
+        new_ns = _new_namespaces(elem, declared)
+        if depth == 0:
+            tag = _prepare_root(attrib)
+            new_ns.setdefault("xsi", NSMAP["xsi"])
+        else:
+            xf.write("\n" + indent * depth)
+        ctx = xf.element(tag, attrib, nsmap=new_ns or None)
+        ctx.__enter__()
+        if elem.text and elem.text.strip():
+            xf.write(elem.text)
+        entry[1] = ctx
+        entry[2] = {**declared, **new_ns}
+
+    with open(output_path, "wb") as out, etree.xmlfile(out, encoding="utf-8") as xf:
+        xf.write_declaration()
+        context = etree.iterparse(
+            mets_file, events=("start", "end"), remove_blank_text=True, huge_tree=True
+        )
+        for event, elem in context:
+            if event == "start":
+                if stack:
+                    parent = stack[-1]
+                    grandparent_open = len(stack) == 1 or stack[-2][1] is not None
+                    if (parent[1] is None and grandparent_open
+                            and parent[0].tag in STREAM_CONTAINERS):
+                        open_container(parent, len(stack) - 1)
+                stack.append([elem, None, None])
+                continue
+
+            _, ctx, _ = stack.pop()
+            depth = len(stack)
+            if ctx is not None:
+                xf.write("\n" + indent * depth)
+                ctx.__exit__(None, None, None)
+            elif depth == 0:
+                # Rot uten barn
+                attrib = dict(elem.attrib)
+                elem.tag = _prepare_root(attrib)
+                elem.attrib.update(attrib)
+                _write_subtree(xf, out, elem, depth, {}, indent)
+            elif stack[-1][1] is not None:
+                # Ferdig deltre direkte under en åpen beholder
+                if elem.tag == METS_FILE_TAG:
+                    stats[update_file_element(elem, index, logger)] += 1
+                    if progress is not None:
+                        progress.update()
+                xf.write("\n" + indent * depth)
+                _write_subtree(xf, out, elem, depth, stack[-1][2], indent)
+            else:
+                # Del av et større deltre som skrives når forelderen er ferdig
+                continue
+
+            # Frigjør minne: tøm elementet og fjern ferdige søsken
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+        del context
+    return stats
+
+
+def _atomic_stream_update(mets_file, index, logger, dry_run, progress=None):
+    """
+    Kjører stream_update_mets mot en temp-fil, validerer resultatet (strømmende)
+    og bytter det inn med os.replace. Ved dry run valideres og slettes temp-filen.
+    """
+    target_dir = os.path.dirname(os.path.abspath(mets_file))
+    fd, tmp_path = tempfile.mkstemp(prefix=".dias-mets.", suffix=".tmp", dir=target_dir)
+    os.close(fd)
+    try:
+        stats = stream_update_mets(mets_file, tmp_path, index, logger, progress=progress)
+        validate_xml(tmp_path, stage="after", logger=logger, streaming=True)
+        if not dry_run:
+            shutil.copymode(mets_file, tmp_path)
+            os.replace(tmp_path, mets_file)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return stats
+
+
+def update_dias_mets(mets_file, content_dir, dry_run=False, use_cache=True,
+                     rebuild_cache=False, hash_workers=None, hash_mode="auto",
+                     hash_chunk_size=DEFAULT_CHUNK_SIZE, hash_mmap_threshold=None, streaming=False,
+                     inventory_path=None, stream_validation=False, profiler=None,
+                     checksum_algorithms=("sha256",), resume=True, io_order="none",
+                     io_device_workers=1, verbose=False):
     """
     Oppdaterer en dias-mets.xml med nye filstier, filstørrelser og sjekksummer
     basert på faktisk innhold i 'content_dir'.
 
     - Oppretter en backup av METS-filen i 'logs'-mappen.
     - Validerer før og etter endringer (hvis dias-mets.xsd finnes).
-    - Skriver utfyllende logger til mets_update.log.
-    - Håndterer million+ filer ved å bruke ThreadPoolExecutor (parallelle sjekksummer).
+    - Skriver utfyllende logger til mets_update.log (ikke-blokkerende, se
+      configure_logger). Konsollen viser fremdrift og oppsummeringer;
+      verbose=True viser også hendelser per fil.
+    - Håndterer million+ filer med parallell hashing (HashEngine). hash_workers,
+      hash_mode ("auto", "thread", "process") og hash_chunk_size styrer motoren.
+      Filer på minst hash_mmap_threshold bytes hashes via mmap (None: aldri).
+      Skanning og hashing går i en pipeline med begrenset kø (HashEngine.imap),
+      så hashingen starter før skanningen er ferdig.
+    - Gjenbruker sjekksummer fra checksum_cache.sqlite i 'logs' for filer som
+      ikke er endret (use_cache). rebuild_cache=True tømmer cachen først, og
+      kan ikke kombineres med use_cache=False.
+    - streaming=True oppdaterer METS med iterparse/xmlfile (konstant minne) og
+      skriver atomisk via temp-fil, i stedet for å bygge hele treet i minnet.
+    - content_dir kan også være en tar- eller zip-fil. Filene hashes da i én
+      sekvensiell lesing uten utpakking (se dimo.archive); cache, journal og
+      inventar brukes ikke.
+    - inventory_path: fil-inventar (dimo.inventory) som lastes hvis det finnes,
+      ellers skannes content_dir og inventaret lagres der for gjenbruk.
+    - Validering før endring kjører i en egen tråd samtidig med skanning og
+      hashing. stream_validation=True (alltid ved streaming) validerer uten å
+      bygge hele treet i minnet.
+    - checksum_algorithms: hashlib-navn (se METS_CHECKSUMTYPES) som beregnes i
+      samme lesing. Den første skrives i CHECKSUM/CHECKSUMTYPE; med flere
+      algoritmer skrives alle til fixity_manifest.tsv ved siden av METS-filen.
+    - Ferdige sjekksummer journalføres fortløpende i logs/hash_journal.jsonl.
+      Avbrytes kjøringen, fortsetter neste kjøring fra journalen (resume=True);
+      resume=False forkaster den. Journalen slettes når kjøringen fullføres.
+    - io_order="inode" eller "extent" hasher i lagringsvennlig rekkefølge for
+      roterende disker og HSM/tape (se dimo.io_scheduling): sortert per enhet,
+      io_device_workers lesere per enhet og små filer i batcher. Skanningen
+      fullføres da før hashingen starter, siden filene må sorteres.
+    - profiler: PhaseRecorder (dimo.profiling) som får tid, minne og
+      gjennomstrømning per fase (skann, cache, hash, match, validering, skriving).
+
+    Returnerer en oppsummering: antall filer, matching per status, antall
+    filer uten METS-referanse og loggfilen.
     """
+    profiler = profiler or PhaseRecorder()
+    if rebuild_cache and not use_cache:
+        raise ValueError("rebuild_cache krever use_cache (cachen brukes ikke med use_cache=False)")
+    checksum_algorithms = tuple(checksum_algorithms)
+    unknown = [name for name in checksum_algorithms if name not in METS_CHECKSUMTYPES]
+    if not checksum_algorithms or unknown:
+        raise ValueError(
+            f"Ugyldige sjekksum-algoritmer: {', '.join(unknown) or '(ingen)'} "
+            f"(gyldige: {', '.join(METS_CHECKSUMTYPES)})"
+        )
+
     # Opprett logs-mappe og loggfil
     logs_dir = os.path.join(os.path.dirname(mets_file), "logs")
     os.makedirs(logs_dir, exist_ok=True)
     log_file = os.path.join(logs_dir, "mets_update.log")
 
-    logger = configure_logger(log_file)
+    logger = configure_logger(log_file, verbose=verbose)
     logger.info("Starter oppdatering av METS.")
 
-    # Valider METS før endring
-    validate_xml(mets_file, stage="before", logger=logger)
+    # Valider METS før endring, i bakgrunnen mens content skannes og hashes
+    stream_validation = stream_validation or streaming
+    validation_executor = ThreadPoolExecutor(max_workers=1)
+    def validate_before():
+        with profiler.phase("validate_before") as phase:
+            phase.bytes_read = os.path.getsize(mets_file)
+            return validate_xml(mets_file, stage="before", logger=logger,
+                                streaming=stream_validation)
+
+    before_validation = validation_executor.submit(validate_before)
+    validation_executor.shutdown(wait=False)
 
     # Lag backup
     backup_file = os.path.join(logs_dir, "dias-mets.xml.bak")
     shutil.copy(mets_file, backup_file)
     logger.info(f"Laget backup av METS-fil: {backup_file}")
 
+    index = ContentIndex({}, METS_CHECKSUMTYPES[checksum_algorithms[0]])
+
+    journal = None
+    if is_archive(content_dir):
+        # tar/zip: én sekvensiell lesing av pakkefilen, uten utpakking
+        logger.info(f"Leser og hasher pakkefilen {content_dir} uten utpakking "
+                    f"(algoritmer: {', '.join(checksum_algorithms)}).")
+        progress = ProgressLogger(logger, "Hashet")
+        with profiler.phase("archive_hash") as phase:
+            members = hash_archive(content_dir, checksum_algorithms, hash_chunk_size,
+                                   progress=progress.update)
+            for rel_path, (size, checksums) in members.items():
+                index.add(rel_path, ContentFile(size, checksums))
+            phase.files = len(members)
+            phase.bytes_read = sum(size for size, _ in members.values())
+    else:
+        cache = None
+        if use_cache:
+            cache = ChecksumCache(os.path.join(logs_dir, CACHE_FILENAME), rebuild=rebuild_cache)
+            if rebuild_cache:
+                logger.info("Sjekksum-cache er tømt og bygges på nytt.")
+
+        # Sjekksummer fra en avbrutt kjøring; nye journalføres underveis
+        journal = HashJournal(os.path.join(logs_dir, JOURNAL_FILENAME), checksum_algorithms,
+                              resume=resume)
+        if journal.entries:
+            logger.info(f"Gjenopptar avbrutt kjøring ({len(journal.entries)} filer i journalen).")
+        elif journal.interrupted:
+            logger.info("Hash-journal fra avbrutt kjøring er forkastet.")
+
+        def files_to_hash():
+            """
+            Produsent i pipelinen: skanner content_dir (én stat per fil, evt. fra
+            lagret inventar) og gir bare filer som ikke finnes i cache/journal.
+            HashEngine.imap leser herfra når det er plass i køen, så skanning og
+            hashing overlapper og køen holder seg liten.
+            """
+            for record in iter_load_or_scan(content_dir, inventory_path):
+                if record.name == ".DS_Store":
+                    continue
+                # F.eks. content/ARKIV1/arkiv.dat -> ARKIV1/arkiv.dat
+                rel_path = os.path.normpath(record.rel_path)
+                checksums = cache.lookup(rel_path, record, checksum_algorithms) if cache else None
+                if checksums is None and journal.entries:
+                    checksums = journal.lookup(rel_path, record)
+                    if checksums is not None and cache:
+                        cache.store(rel_path, record, checksums, checksum_algorithms)
+                if checksums is None:
+                    yield os.path.join(content_dir, record.rel_path), record.st_size, (rel_path, record)
+                    continue
+                index.add(rel_path, ContentFile(record.st_size, checksums))
+
+        engine = HashEngine(workers=hash_workers, mode=hash_mode, chunk_size=hash_chunk_size,
+                            algorithm=checksum_algorithms, mmap_threshold=hash_mmap_threshold)
+        if io_order != "none":
+            scheduler = ReadScheduler(order=io_order, device_workers=io_device_workers,
+                                      algorithm=checksum_algorithms, chunk_size=hash_chunk_size,
+                                      mmap_threshold=hash_mmap_threshold)
+            logger.info(
+                f"Skanner {content_dir}, deretter hashing i {io_order}-rekkefølge "
+                f"(algoritmer: {', '.join(checksum_algorithms)}, "
+                f"{io_device_workers} leser(e) per enhet, blokkstørrelse: {hash_chunk_size} bytes)."
+            )
+        else:
+            logger.info(
+                f"Skanner og hasher {content_dir} (algoritmer: {', '.join(checksum_algorithms)}, "
+                f"arbeidere: {hash_workers or 'auto'}, blokkstørrelse: {hash_chunk_size} bytes)."
+            )
+
+        def hash_results():
+            if io_order == "none":
+                return engine.imap(files_to_hash())
+            return scheduler.run([(file_path, size, tag, tag[1].st_ino)
+                                  for file_path, size, tag in files_to_hash()])
+
+        hashed = hashed_bytes = 0
+        progress = ProgressLogger(logger, "Hashet")
+        with profiler.phase("scan_hash") as phase, engine:
+            for (rel_path, record), file_checksums in hash_results():
+                progress.update()
+                index.add(rel_path, ContentFile(record.st_size, file_checksums))
+                journal.record(rel_path, record, file_checksums)
+                if cache:
+                    cache.store(rel_path, record, file_checksums, checksum_algorithms)
+                hashed += 1
+                hashed_bytes += record.st_size
+            phase.files = len(index.files)
+            phase.bytes_read = hashed_bytes
+        journal.close()
+        if io_order != "none":
+            mode = f"{io_order}-rekkefølge på {scheduler.devices} enhet(er)"
+        else:
+            mode = engine.last_mode or "ingen"
+        logger.info(
+            f"Hashet {hashed} filer ({hashed_bytes} bytes, modus: {mode}); "
+            f"{journal.resumed} hentet fra journalen."
+        )
+
+        if cache:
+            with profiler.phase("cache_write"):
+                pruned = cache.prune(index.files)
+                cache.close()
+            logger.info(
+                f"Sjekksum-cache: {cache.hits} treff, {cache.misses} bom, "
+                f"{pruned} utdaterte oppføringer fjernet."
+            )
+
+    content_files = index.files
+    logger.info(f"Fant totalt {len(content_files)} filer i '{content_dir}'.")
+
+    # Ekstra sjekksummer får ikke plass i METS; de skrives til et sidecar-manifest
+    if len(checksum_algorithms) > 1 and not dry_run:
+        manifest_path = os.path.join(os.path.dirname(mets_file), FIXITY_MANIFEST)
+        with profiler.phase("fixity_manifest"):
+            write_fixity_manifest(manifest_path, content_files, checksum_algorithms)
+        logger.info(f"Fixity-manifest skrevet: {manifest_path}")
+    before_validation.result()
+
+    if streaming:
+        logger.info("Oppdaterer METS i strømmemodus.")
+        with profiler.phase("stream_update") as phase:
+            phase.bytes_read = os.path.getsize(mets_file)
+            stats = _atomic_stream_update(mets_file, index, logger, dry_run,
+                                          ProgressLogger(logger, "Matchet <file>-elementer"))
+            phase.files = sum(stats.values())
+        log_match_summary(index, stats, logger)
+        if not dry_run:
+            logger.info("dias-mets.xml er oppdatert med nye stier, filstørrelser og sjekksummer.")
+        else:
+            logger.info("Dry run - ingen endringer er skrevet til METS-filen.")
+        if journal:
+            journal.discard()
+        logger.info(f"Loggfil er lagret: {log_file}")
+        stop_logging()
+        return _run_summary(index, stats, log_file)
+
     # Parse METS-filen med lxml eller stdlib
     # Merk at for XSD-validering brukte vi lxml. For manipulasjon kan stdlib fungere.
     # Her bruker vi lxml for konsistens (etree).
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(mets_file, parser)
-    root = tree.getroot()
-
-    # Opprett namespace-map (inkluder xlink!)
-    NSMAP = {
-    "mets": "http://www.loc.gov/METS/",
-    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
-    "xlink": "http://www.w3.org/1999/xlink"
-}
-
+    with profiler.phase("parse") as phase:
+        phase.bytes_read = os.path.getsize(mets_file)
+        parser = etree.XMLParser(remove_blank_text=True)
+        tree = etree.parse(mets_file, parser)
+        root = tree.getroot()
 
     # Sikre at rot-elementet har riktig METS-tag + schemaLocation
     root.tag = "{http://www.loc.gov/METS/}mets"
     root.set("{http://www.w3.org/2001/XMLSchema-instance}schemaLocation",
              "http://www.loc.gov/METS/ dias-mets.xsd")
 
-    # Funksjon for å hente ut filinfo parallelt
-    def process_file(file_path):
-        file_size = os.path.getsize(file_path)
-        file_checksum = calculate_sha256(file_path)
-        return file_path, file_size, file_checksum
-
-    # Samle filer i content_dir med parallell sjekk
-    logger.info(f"Skanner katalog: {content_dir}")
-    all_files = []
-    for dirpath, _, files in os.walk(content_dir):
-        for f in files:
-            if f == ".DS_Store":
-                continue
-            full_path = os.path.join(dirpath, f)
-            all_files.append(full_path)
-
-    content_files = {}
-    with ThreadPoolExecutor() as executor:
-        for file_path, file_size, file_checksum in executor.map(process_file, all_files):
-            # F.eks. content/ARKIV1/arkiv.dat -> ARKIV1/arkiv.dat
-            rel_path = os.path.relpath(file_path, content_dir)
-            content_files[os.path.normpath(rel_path)] = {
-                "size": file_size,
-                "checksum": file_checksum,
-                "full_path": file_path
-            }
-
-    logger.info(f"Fant totalt {len(content_files)} filer i '{content_dir}'.")
-
     # Oppdater hver <mets:file> i METS-filen
     file_elements = root.findall(".//mets:file", namespaces=NSMAP)
     logger.info(f"Antall <file>-elementer i METS: {len(file_elements)}")
 
-    for file_element in file_elements:
-        # Finn <mets:FLocat> inni <file>
-        flocat = file_element.find(".//mets:FLocat", namespaces=NSMAP)
-        if flocat is None:
-            continue
-
-        # Hent ut xlink:href
-        xlink_href = flocat.get("{http://www.w3.org/1999/xlink}href")
-        if not xlink_href:
-            continue  # Finner ingen sti, hopp over
-
-        # Fjern "file:" foran stien, normaliser og relater mot content
-        old_href = xlink_href.replace("file:", "").strip()
-        old_norm = os.path.normpath(old_href)
-
-        # Hvis stien starter med "content", fjern den biten
-        # old_norm = "content/ARKIV1/arkiv.dat" -> "ARKIV1/arkiv.dat"
-        if old_norm.startswith("content" + os.sep):
-            old_norm = os.path.relpath(old_norm, "content")
-
-        logger.debug(f"Sjekker <file>-element med sti: {xlink_href} (-> {old_norm})")
-
-        # Sjekk om vi finner nøyaktig match i content_files
-        if old_norm in content_files:
-            # Filen finnes i riktig posisjon allerede. Oppdater size/checksum i tilfelle det er endret.
-            info = content_files[old_norm]
-            file_element.set("SIZE", str(info["size"]))
-            file_element.set("CHECKSUM", info["checksum"])
-            file_element.set("CHECKSUMTYPE", "SHA-256")
-            # For ordens skyld, sett xlink:href på nytt (kanskje den var litt avvikende)
-            new_href = f"file:content/{old_norm}"
-            flocat.set("{http://www.w3.org/1999/xlink}href", new_href)
-            logger.info(f"Oppdatert metadata for fil: {old_norm}")
-        else:
-            # Ingen direkte match på hele stien. Forsøk fallback ved filnavn
-            base_old = os.path.basename(old_norm)
-            matched = False
-            for new_rel_path, info in content_files.items():
-                if os.path.basename(new_rel_path) == base_old:
-                    # Oppdater <file>-elementet til ny sti
-                    file_element.set("SIZE", str(info["size"]))
-                    file_element.set("CHECKSUM", info["checksum"])
-                    file_element.set("CHECKSUMTYPE", "SHA-256")
-
-                    new_href = f"file:content/{new_rel_path}"
-                    flocat.set("{http://www.w3.org/1999/xlink}href", new_href)
-
-                    logger.info(f"Oppdatert filsti: {old_norm} -> {new_rel_path}")
-                    matched = True
-                    break
-
-            if not matched:
-                logger.warning(f"Fant ingen match for sti: {old_norm}. Ingen oppdatering gjort.")
+    stats = defaultdict(int)
+    with profiler.phase("match") as phase:
+        phase.files = len(file_elements)
+        progress = ProgressLogger(logger, "Matchet <file>-elementer", total=len(file_elements))
+        for file_element in file_elements:
+            status = update_file_element(file_element, index, logger)
+            stats[status] += 1
+            progress.update()
+
+    log_match_summary(index, stats, logger)
+
+    # Valider treet som skal skrives (også ved dry run), ikke filen på disk
+    with profiler.phase("validate_after"):
+        validate_xml(mets_file, stage="after", logger=logger, tree=tree)
 
     # "Prettify" XML via stdlib (valgfritt; lxml kan også brukes)
     # Konverter lxml -> stdlib ElementTree for å bruke prettify_xml
     # (Dette steget er litt valgfritt. Hvis du vil unngå round-trip-problemer,
     # kan du heller bruke lxml pretty_print under skriving.)
-    root_str = etree.tostring(root, encoding="unicode")
-    root_std = ET.fromstring(root_str)
-    prettify_xml(root_std)
+    with profiler.phase("prettify"):
+        root_str = etree.tostring(root, encoding="unicode")
+        root_std = ET.fromstring(root_str)
+        prettify_xml(root_std)
 
     # Skriv endelig resultat (med mindre dry_run)
     if not dry_run:
-        new_tree = ET.ElementTree(root_std)
-        new_tree.write(mets_file, encoding="utf-8", xml_declaration=True)
+        with profiler.phase("write"):
+            new_tree = ET.ElementTree(root_std)
+            new_tree.write(mets_file, encoding="utf-8", xml_declaration=True)
         logger.info("dias-mets.xml er oppdatert med nye stier, filstørrelser og sjekksummer.")
     else:
         logger.info("Dry run - ingen endringer er skrevet til METS-filen.")
 
-    # Valider METS etter endring
-    validate_xml(mets_file, stage="after", logger=logger)
+    if journal:
+        journal.discard()
     logger.info(f"Loggfil er lagret: {log_file}")
+    stop_logging()
+    return _run_summary(index, stats, log_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+"""Fixity-kontroll av en pakke mot SIZE/CHECKSUM i dias-mets.xml.
+
+Kontrollen er skrivebeskyttet: METS leses strømmende, og ingenting i pakken
+endres. Billige sjekker kommer først (finnes filen, stemmer størrelsen), og
+bare filer som består dem hashes, parallelt med HashEngine. Med sampling
+kontrolleres en roterende andel av filene per kjøring, slik at hele pakken
+dekkes i løpet av en syklus.
+"""
+
+import datetime
+import itertools
+import os
+from collections import defaultdict
+
+from lxml import etree
+
+from dimo.hashing import (DEFAULT_CHUNK_SIZE, METS_CHECKSUMTYPES, HashEngine, in_sample,
+                          sample_buckets)
+from dimo.profiling import PhaseRecorder
+from dimo.update_mets import METS_FILE_TAG, XLINK_HREF, _href_to_rel_path
+
+FLOCAT_PATH = ".//{http://www.loc.gov/METS/}FLocat"
+
+# CHECKSUMTYPE i METS -> hashlib-navn
+HASHLIB_NAMES = {checksum_type: name for name, checksum_type in METS_CHECKSUMTYPES.items()}
+
+VERIFY_STATUSES = ("ok", "missing", "size_mismatch", "checksum_mismatch",
+                   "unreadable", "no_checksum", "unsupported", "skipped")
+
+
+class MetsEntry:
+    """Én <mets:file> slik den står i METS."""
+    __slots__ = ("file_id", "rel_path", "size", "checksum", "checksum_type")
+
+    def __init__(self, file_id, rel_path, size, checksum, checksum_type):
+        self.file_id = file_id
+        self.rel_path = rel_path
+        self.size = size
+        self.checksum = checksum
+        self.checksum_type = checksum_type
+
+
+def iter_mets_entries(mets_file):
+    """Leser <mets:file>-elementene strømmende (iterparse) og gir MetsEntry per fil."""
+    context = etree.iterparse(mets_file, events=("end",), huge_tree=True)
+    for _, elem in context:
+        parent = elem.getparent()
+        if elem.tag == METS_FILE_TAG:
+            flocat = elem.find(FLOCAT_PATH)
+            href = flocat.get(XLINK_HREF) if flocat is not None else None
+            if href:
+                size = elem.get("SIZE")
+                try:
+                    size = int(size) if size is not None else None
+                except ValueError:
+                    size = None
+                yield MetsEntry(elem.get("ID"), _href_to_rel_path(href), size,
+                                elem.get("CHECKSUM"), elem.get("CHECKSUMTYPE", "SHA-256"))
+        elif parent is not None and parent.tag == METS_FILE_TAG:
+            # Barn av <mets:file> trengs til hele filelementet er lest
+            continue
+        # Frigjør minne: tøm elementet og fjern ferdige søsken
+        elem.clear(keep_tail=True)
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+    del context
+
+
+def verify_dias_mets(mets_file, content_dir, sample=1.0, sample_slot=None,
+                     hash_workers=None, hash_mode="auto", hash_chunk_size=DEFAULT_CHUNK_SIZE,
+                     hash_mmap_threshold=None, profiler=None):
+    """
+    Kontrollerer filene i content mot SIZE/CHECKSUM i METS uten å skrive noe.
+
+    - Først stat per fil: mangler den eller har feil størrelse, hashes den ikke.
+    - Filer som består hashes parallelt mens METS fortsatt leses
+      (HashEngine.imap med begrenset kø), så minnebruken er uavhengig av
+      pakkestørrelsen. Filer med samme CHECKSUMTYPE som den første hashes
+      fortløpende; filer med andre typer samles og hashes til slutt.
+    - Filer på minst hash_mmap_threshold bytes hashes via mmap (None: aldri).
+    - En fil som ikke kan leses (tilgang, katalog, forsvunnet underveis) gir
+      status "unreadable" for den filen; resten kontrolleres som vanlig.
+    - sample < 1 kontrollerer bare en andel av filene. Gruppen som kontrolleres
+      velges av sample_slot, som standard dagens dato, slik at daglige
+      kjøringer roterer gjennom hele pakken.
+
+    Returnerer en dict med antall per status (se VERIFY_STATUSES), valgt
+    rotasjon og en liste over avvik.
+    """
+    profiler = profiler or PhaseRecorder()
+    buckets = sample_buckets(sample)
+    if sample_slot is None:
+        sample_slot = datetime.date.today().toordinal() % buckets
+    sample_slot %= buckets
+
+    counts = defaultdict(int)
+    failures = []
+    deferred = defaultdict(list)  # andre hashlib-navn -> [(full sti, størrelse, MetsEntry)]
+
+    def fail(entry, status, actual=None):
+        counts[status] += 1
+        failures.append({
+            'id': entry.file_id,
+            'path': entry.rel_path,
+            'status': status,
+            'expected_size': entry.size,
+            'expected_checksum': entry.checksum,
+            'checksum_type': entry.checksum_type,
+            'actual': actual,
+        })
+
+    def candidates():
+        """Billige sjekker per METS-oppføring; gir (algoritme, full sti, størrelse, MetsEntry)."""
+        for entry in iter_mets_entries(mets_file):
+            if not in_sample(entry.rel_path, buckets, sample_slot):
+                counts["skipped"] += 1
+                continue
+            full_path = os.path.join(content_dir, entry.rel_path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                fail(entry, "missing")
+                continue
+            if entry.size is not None and st.st_size != entry.size:
+                fail(entry, "size_mismatch", st.st_size)
+                continue
+            if not entry.checksum:
+                fail(entry, "no_checksum")
+                continue
+            algorithm = HASHLIB_NAMES.get(entry.checksum_type)
+            if algorithm is None:
+                fail(entry, "unsupported")
+                continue
+            yield algorithm, full_path, st.st_size, entry
+
+    def check(engine, items):
+        for entry, checksum in engine.imap(items, errors="return"):
+            if isinstance(checksum, OSError):
+                fail(entry, "unreadable", str(checksum))
+            elif checksum.lower() == entry.checksum.strip().lower():
+                counts["ok"] += 1
+            else:
+                fail(entry, "checksum_mismatch", checksum)
+
+    with profiler.phase("verify") as phase:
+        phase.bytes_read = 0
+        pending = candidates()
+        first = next(pending, None)
+        if first is not None:
+            primary = first[0]
+
+            def primary_items():
+                for algorithm, full_path, size, entry in itertools.chain([first], pending):
+                    if algorithm == primary:
+                        phase.bytes_read += size
+                        yield full_path, size, entry
+                    else:
+                        deferred[algorithm].append((full_path, size, entry))
+
+            with HashEngine(workers=hash_workers, mode=hash_mode, chunk_size=hash_chunk_size,
+                            mmap_threshold=hash_mmap_threshold, algorithm=primary) as engine:
+                check(engine, primary_items())
+        for algorithm, items in deferred.items():
+            phase.bytes_read += sum(size for _, size, _ in items)
+            with HashEngine(workers=hash_workers, mode=hash_mode, chunk_size=hash_chunk_size,
+                            mmap_threshold=hash_mmap_threshold, algorithm=algorithm) as engine:
+                check(engine, items)
+        phase.files = sum(counts.values())
+
+    return {
+        'mets_file': mets_file,
+        'content_dir': content_dir,
+        'verified': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sample': sample,
+        'sample_buckets': buckets,
+        'sample_slot': sample_slot,
+        'counts': {status: counts.get(status, 0) for status in VERIFY_STATUSES},
+        'failures': failures,
+    }
@@ -0,0 +1,307 @@
+"""Watch-modus: holder dias-mets.xml løpende i synk med content.
+
+Ved start skannes og hashes content én gang (med sjekksum-cachen), og METS
+leses inn og matches som i update_dias_mets. Deretter holdes både
+ContentIndex og METS-treet i minnet:
+
+- content polles med en parallell scandir-walk (bare stat, ingen lesing);
+  bare nye og endrede filer hashes,
+- bare <mets:file>-elementer som peker på endrede eller slettede filer, og
+  elementer som ennå ikke har funnet sin fil, matches på nytt
+  (update_file_element),
+- METS skrives atomisk først når content har vært i ro en stund (debounce),
+  men senest etter max_delay sekunder under kontinuerlige endringer.
+
+Kostnaden per runde følger dermed endringen, ikke pakkestørrelsen (bortsett
+fra stat-walken). Endres dias-mets.xml av noen andre, leses den inn på nytt.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+from lxml import etree
+
+from dimo.checksum_cache import CACHE_FILENAME, ChecksumCache
+from dimo.hashing import DEFAULT_CHUNK_SIZE, HashEngine
+from dimo.inventory import iter_scan
+from dimo.update_mets import (
+    METS_CHECKSUMTYPES,
+    NSMAP,
+    PER_FILE,
+    XLINK_HREF,
+    ContentFile,
+    ContentIndex,
+    _href_to_rel_path,
+    configure_logger,
+    stop_logging,
+    update_file_element,
+    validate_xml,
+)
+
+DEFAULT_INTERVAL = 2.0
+DEFAULT_DEBOUNCE = 5.0
+DEFAULT_MAX_DELAY = 60.0
+WATCH_LOG = "mets_watch.log"
+
+RESOLVED = ("exact", "moved", "renamed")
+
+
+def _stat_key(record):
+    return (record.st_size, record.st_mtime_ns, record.st_ino)
+
+
+def _file_state(file_element):
+    flocat = file_element.find(".//mets:FLocat", namespaces=NSMAP)
+    href = flocat.get(XLINK_HREF) if flocat is not None else None
+    return (href, file_element.get("SIZE"), file_element.get("CHECKSUM"),
+            file_element.get("CHECKSUMTYPE"))
+
+
+class MetsWatcher:
+    """
+    Varm indeks over content og METS for én pakke.
+
+    - algorithm: hashlib-navn for sjekksummen som skrives i METS
+    - debounce: sekunder uten endringer før METS skrives
+    - max_delay: METS skrives senest så lenge etter første uskrevne endring
+    - use_cache: gjenbruk og oppdater logs/checksum_cache.sqlite
+    """
+
+    def __init__(self, mets_file, content_dir, algorithm="sha256", hash_workers=None,
+                 hash_mode="auto", hash_chunk_size=DEFAULT_CHUNK_SIZE,
+                 debounce=DEFAULT_DEBOUNCE, max_delay=DEFAULT_MAX_DELAY, use_cache=True,
+                 verbose=False):
+        if algorithm not in METS_CHECKSUMTYPES:
+            raise ValueError(f"Ukjent sjekksum-algoritme: {algorithm} "
+                             f"(gyldige: {', '.join(METS_CHECKSUMTYPES)})")
+        self.mets_file = mets_file
+        self.content_dir = content_dir
+        self.algorithms = (algorithm,)
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        logs_dir = os.path.join(os.path.dirname(mets_file), "logs")
+        os.makedirs(logs_dir, exist_ok=True)
+        self.logger = configure_logger(os.path.join(logs_dir, WATCH_LOG), verbose=verbose)
+        self.cache = ChecksumCache(os.path.join(logs_dir, CACHE_FILENAME)) if use_cache else None
+        self.engine = HashEngine(workers=hash_workers, mode=hash_mode, chunk_size=hash_chunk_size,
+                                 algorithm=self.algorithms)
+
+        self.stats = {}    # relativ sti -> (størrelse, mtime_ns, inode)
+        self.index = ContentIndex({}, METS_CHECKSUMTYPES[algorithm])
+        self.tree = None
+        self.elements_by_path = defaultdict(list)
+        self.unresolved = set()
+        self.mets_mtime_ns = None
+        self.first_change = None
+        self.last_change = None
+        self.writes = 0
+
+    # -- content ----------------------------------------------------------
+
+    def _scan(self):
+        records = {}
+        for record in iter_scan(self.content_dir):
+            if record.name != ".DS_Store":
+                records[os.path.normpath(record.rel_path)] = record
+        return records
+
+    def _hash(self, records):
+        """Sjekksummer for records ({sti: FileRecord}); cache først, så HashEngine."""
+        found, misses = {}, []
+        for rel_path, record in records.items():
+            checksums = self.cache.lookup(rel_path, record, self.algorithms) if self.cache else None
+            if checksums is None:
+                misses.append(rel_path)
+            else:
+                found[rel_path] = checksums
+        paths = [os.path.join(self.content_dir, rel_path) for rel_path in misses]
+        hashed = self.engine.map(paths, [records[rel_path].st_size for rel_path in misses],
+                                 errors="return")
+        for rel_path, checksums in zip(misses, hashed):
+            if isinstance(checksums, OSError):
+                # F.eks. forsvant filen underveis; den fanges opp i neste runde
+                self.logger.debug(f"Kunne ikke lese {rel_path}: {checksums}", extra=PER_FILE)
+                continue
+            found[rel_path] = checksums
+            if self.cache:
+                self.cache.store(rel_path, records[rel_path], checksums, self.algorithms)
+        if self.cache:
+            self.cache.flush()
+        return found
+
+    def _add_files(self, records):
+        checksums = self._hash(records)
+        for rel_path, file_checksums in checksums.items():
+            self.index.add(rel_path, ContentFile(records[rel_path].st_size, file_checksums))
+            self.stats[rel_path] = _stat_key(records[rel_path])
+        return len(checksums)
+
+    def _remove_file(self, rel_path):
+        self.index.remove(rel_path)
+        self.stats.pop(rel_path, None)
+
+    # -- METS -------------------------------------------------------------
+
+    def _sync_element(self, file_element, old_path=None):
+        """Matcher ett element på nytt; True hvis det ble endret."""
+        before = _file_state(file_element)
+        status = update_file_element(file_element, self.index, self.logger)
+        if status in RESOLVED:
+            self.unresolved.discard(file_element)
+        elif status != "skipped":
+            self.unresolved.add(file_element)
+        after = _file_state(file_element)
+        if after[0] != before[0] or old_path is None:
+            if old_path is not None and file_element in self.elements_by_path.get(old_path, ()):
+                self.elements_by_path[old_path].remove(file_element)
+                if not self.elements_by_path[old_path]:
+                    del self.elements_by_path[old_path]
+            if after[0]:
+                self.elements_by_path[_href_to_rel_path(after[0])].append(file_element)
+        return after != before
+
+    def load_mets(self):
+        """Leser METS og matcher alle <mets:file>-elementer mot indeksen."""
+        parser = etree.XMLParser(remove_blank_text=True)
+        self.tree = etree.parse(self.mets_file, parser)
+        self.mets_mtime_ns = os.stat(self.mets_file).st_mtime_ns
+        self.elements_by_path.clear()
+        self.unresolved.clear()
+        self.index.referenced.clear()
+        file_elements = self.tree.getroot().findall(".//mets:file", namespaces=NSMAP)
+        changed = sum(self._sync_element(file_element) for file_element in file_elements)
+        self.logger.info(
+            f"Lest METS: {len(file_elements)} <file>-elementer, {changed} oppdatert, "
+            f"{len(self.unresolved)} uten match."
+        )
+        return changed
+
+    def _mark_changed(self, now):
+        if self.first_change is None:
+            self.first_change = now
+        self.last_change = now
+
+    def write(self):
+        """Validerer treet og skriver METS atomisk (temp-fil + os.replace)."""
+        validate_xml(self.mets_file, stage="after", logger=self.logger, tree=self.tree)
+        target_dir = os.path.dirname(os.path.abspath(self.mets_file))
+        fd, tmp_path = tempfile.mkstemp(prefix=".dias-mets.", suffix=".tmp", dir=target_dir)
+        os.close(fd)
+        try:
+            self.tree.write(tmp_path, encoding="utf-8", xml_declaration=True, pretty_print=True)
+            shutil.copymode(self.mets_file, tmp_path)
+            os.replace(tmp_path, self.mets_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.mets_mtime_ns = os.stat(self.mets_file).st_mtime_ns
+        self.first_change = self.last_change = None
+        self.writes += 1
+        self.logger.info(f"dias-mets.xml er skrevet ({len(self.unresolved)} <file>-elementer uten match).")
+
+    def maybe_write(self, now=None):
+        """Skriver METS hvis content har vært i ro i debounce sekunder (eller max_delay er nådd)."""
+        if self.last_change is None:
+            return False
+        now = time.monotonic() if now is None else now
+        if now - self.last_change >= self.debounce or now - self.first_change >= self.max_delay:
+            self.write()
+            return True
+        return False
+
+    # -- runder -----------------------------------------------------------
+
+    def start(self):
+        """Første fulle synk: skann og hash content, les og match METS."""
+        self.logger.info(f"Starter watch av {self.content_dir} -> {self.mets_file}.")
+        backup_file = os.path.join(os.path.dirname(self.mets_file), "logs", "dias-mets.xml.bak")
+        shutil.copy(self.mets_file, backup_file)
+        self.logger.info(f"Laget backup av METS-fil: {backup_file}")
+        records = self._scan()
+        hashed = self._add_files(records)
+        self.logger.info(f"Indeksert {hashed} filer i '{self.content_dir}'.")
+        if self.load_mets():
+            self._mark_changed(time.monotonic())
+
+    def poll(self, now=None):
+        """
+        Én runde: finner nye, endrede og slettede filer, hasher bare de nye og
+        endrede, og matcher berørte METS-elementer på nytt. Returnerer antall
+        endrede filer.
+        """
+        now = time.monotonic() if now is None else now
+        try:
+            mets_mtime_ns = os.stat(self.mets_file).st_mtime_ns
+        except OSError:
+            mets_mtime_ns = self.mets_mtime_ns
+        if mets_mtime_ns != self.mets_mtime_ns:
+            self.logger.info("dias-mets.xml er endret utenfra; leser den inn på nytt.")
+            if self.last_change is not None:
+                self.logger.warning("Uskrevne endringer i METS forkastes.")
+                self.first_change = self.last_change = None
+            if self.load_mets():
+                self._mark_changed(now)
+
+        records = self._scan()
+        removed = [rel_path for rel_path in self.stats if rel_path not in records]
+        changed = {rel_path: record for rel_path, record in records.items()
+                   if self.stats.get(rel_path) != _stat_key(record)}
+        if not removed and not changed:
+            return 0
+
+        affected = []
+        for rel_path in removed + [rel_path for rel_path in changed if rel_path in self.stats]:
+            self._remove_file(rel_path)
+            affected.extend((element, rel_path) for element in self.elements_by_path.get(rel_path, ()))
+        self._add_files(changed)
+        for rel_path in removed:
+            self.logger.debug(f"Slettet: {rel_path}", extra=PER_FILE)
+        for rel_path in changed:
+            self.logger.debug(f"Ny eller endret: {rel_path}", extra=PER_FILE)
+
+        # Nye eller forsvunne filer kan gi match for elementer som manglet en
+        seen = {element for element, _ in affected}
+        for element in list(self.unresolved):
+            if element not in seen:
+                flocat_state = _file_state(element)[0]
+                affected.append((element, _href_to_rel_path(flocat_state) if flocat_state else None))
+
+        updated = sum(self._sync_element(element, old_path) for element, old_path in affected)
+        self.logger.info(
+            f"{len(changed)} nye/endrede og {len(removed)} slettede filer; "
+            f"{updated} <file>-elementer oppdatert."
+        )
+        if updated:
+            self._mark_changed(now)
+        return len(changed) + len(removed)
+
+    def run(self, interval=DEFAULT_INTERVAL, max_polls=None):
+        """Poller til den avbrytes (Ctrl+C) eller etter max_polls runder."""
+        polls = 0
+        try:
+            self.start()
+            self.maybe_write()
+            while max_polls is None or polls < max_polls:
+                time.sleep(interval)
+                self.poll()
+                self.maybe_write()
+                polls += 1
+        except KeyboardInterrupt:
+            self.logger.info("Avbrutt.")
+        finally:
+            self.close()
+
+    def close(self):
+        """Skriver uskrevne endringer og frigjør cache, hashing og logging."""
+        try:
+            if self.last_change is not None and self.tree is not None:
+                self.write()
+        finally:
+            self.engine.shutdown()
+            if self.cache:
+                self.cache.close()
+            stop_logging()
@@ -0,0 +1,80 @@
+"""A saved inventory must not hand stale stats to update-mets."""
+
+import hashlib
+import os
+
+from lxml import etree
+
+from dimo.update_mets import NSMAP, stop_logging, update_dias_mets
+
+METS = """<?xml version='1.0' encoding='utf-8'?>
+<mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <mets:fileSec>
+    <mets:fileGrp USE="FILES">
+{files}
+    </mets:fileGrp>
+  </mets:fileSec>
+</mets:mets>
+"""
+FILE = """      <mets:file ID="{id}" SIZE="0" CHECKSUM="" CHECKSUMTYPE="SHA-256">
+        <mets:FLocat LOCTYPE="URL" xlink:href="file:content/{name}" xlink:type="simple"/>
+      </mets:file>"""
+
+
+def _workspace(tmp_path, names):
+    content = tmp_path / "content"
+    content.mkdir()
+    for name in names:
+        (content / name).write_bytes(name.encode() * 100)
+    files = "\n".join(FILE.format(id=f"fil{i}", name=name) for i, name in enumerate(names))
+    mets_file = tmp_path / "dias-mets.xml"
+    mets_file.write_text(METS.format(files=files), encoding="utf-8")
+    return str(mets_file), str(content)
+
+
+def _update(mets_file, content, inventory, **kwargs):
+    try:
+        return update_dias_mets(mets_file, content, inventory_path=inventory,
+                                hash_mode="thread", **kwargs)
+    finally:
+        stop_logging()
+
+
+def _checksums(mets_file):
+    tree = etree.parse(mets_file)
+    return {
+        element.find("mets:FLocat", NSMAP).get("{http://www.w3.org/1999/xlink}href"):
+            element.get("CHECKSUM")
+        for element in tree.getroot().iterfind(".//mets:file", NSMAP)
+    }
+
+
+def test_file_modified_in_place_is_hashed_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mets_file, content = _workspace(tmp_path, ["a.txt", "b.txt"])
+    inventory = str(tmp_path / "inventory.bin")
+    _update(mets_file, content, inventory)
+
+    # Same size and directory mtime; only the file's own mtime changes
+    path = os.path.join(content, "a.txt")
+    st = os.stat(path)
+    with open(path, "r+b") as f:
+        f.write(b"X")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    _update(mets_file, content, inventory)
+
+    with open(path, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    assert _checksums(mets_file)["file:content/a.txt"] == expected
+
+
+def test_deleted_file_is_skipped_without_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mets_file, content = _workspace(tmp_path, ["a.txt", "b.txt"])
+    inventory = str(tmp_path / "inventory.bin")
+    _update(mets_file, content, inventory)
+
+    os.remove(os.path.join(content, "b.txt"))
+    summary = _update(mets_file, content, inventory, use_cache=False)
+
+    assert summary['files'] == 1